@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Benchmark the GeoDirectoryMixin against a local fake geodirectory server and a sqlite database.
+
+    $ python -m benchmarks.run --count 500 --latency 5 --output results.json
+    $ python -m benchmarks.run --count 500 --latency 5 --compare results.json
+
+For each scenario, the throughput, the p50/p99 latencies, the database queries per operation and the peak of memory
+allocated are reported. The results are stored as JSON to compare versions.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+
+
+def setup_django(database):
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'django_terralego.tests.settings'
+    settings.DATABASES['default']['NAME'] = database
+    django.setup()
+    from django.core.management import call_command
+    import django_terralego.tests.models  # noqa, registers the Dummy model
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rank))]
+
+
+def measure(name, objs, operation):
+    """
+    Call `operation` on every object and measure it.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    durations = []
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.time()
+        for obj in objs:
+            operation_started = time.time()
+            operation(obj)
+            durations.append(time.time() - operation_started)
+        elapsed = time.time() - started
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'name': name,
+        'count': len(objs),
+        'throughput': len(objs) / elapsed if elapsed else 0,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'queries_per_operation': len(queries) / float(len(objs)),
+        'peak_memory_kb': memory / 1024.0,
+    }
+
+
+def run(count):
+    from django_terralego.tests.models import Dummy
+
+    objs = [Dummy(terralego_geometry='POINT({0} {1})'.format(i % 360 - 180, i % 180 - 90)) for i in range(count)]
+    results = [measure('save (create)', objs, lambda obj: obj.save())]
+
+    def move(obj):
+        obj.terralego_geometry = {'type': 'Point', 'coordinates': [obj.pk % 360 - 180, 0]}
+        obj.save()
+    results.append(measure('save (update)', objs, move))
+    results.append(measure('save (unchanged)', objs, lambda obj: obj.save()))
+    results.append(measure('update_from_terralego_entry', objs, lambda obj: obj.update_from_terralego_entry()))
+    results.append(measure('closest', objs, lambda obj: obj.closest()))
+    results.append(measure('delete', objs, lambda obj: obj.delete()))
+    return results
+
+
+def print_results(results, previous=None):
+    previous = {result['name']: result for result in previous or []}
+    print('{0:30} {1:>10} {2:>10} {3:>10} {4:>10} {5:>12}'.format(
+        'operation', 'ops/s', 'p50 ms', 'p99 ms', 'queries', 'memory kB'))
+    for result in results:
+        line = '{name:30} {throughput:10.1f} {p50_ms:10.2f} {p99_ms:10.2f} {queries_per_operation:10.2f} ' \
+               '{peak_memory_kb:12.1f}'.format(**result)
+        if result['name'] in previous and previous[result['name']]['throughput']:
+            line += ' ({0:+.1%} ops/s)'.format(result['throughput'] / previous[result['name']]['throughput'] - 1)
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200, help='Number of objects per scenario.')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds added by the server to each request.')
+    parser.add_argument('--error-rate', type=float, default=0, help='Probability of a 503 answer, from 0 to 1.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Compare with the results of this JSON file.')
+    args = parser.parse_args(argv)
+
+    with tempfile.NamedTemporaryFile(suffix='.sqlite3') as database:
+        setup_django(database.name)
+        from django_terralego.testing import FakeGeoDirectoryServer
+        with FakeGeoDirectoryServer(latency=args.latency / 1000.0, error_rate=args.error_rate):
+            results = run(args.count)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'options': vars(args),
+                'python': sys.version.split()[0],
+                'django': django.get_version(),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,3 +8,5 @@ if 'USER' in TERRALEGO:
     os.environ['TERRALEGO_USER'] = TERRALEGO['USER']
 if 'PASSWORD' in TERRALEGO:
     os.environ['TERRALEGO_PASSWORD'] = TERRALEGO['PASSWORD']
+
+default_app_config = 'django_terralego.apps.DjangoTerralegoConfig'
@@ -0,0 +1,191 @@
+"""
+The geodirectory endpoints for asyncio, on top of a pooled aiohttp session.
+
+The errors are raised as the `requests` exceptions, like the synchronous API. aiohttp is an optional dependency:
+`pip install django-terralego[async]`.
+"""
+import asyncio
+import json
+import weakref
+from functools import partial
+
+import requests
+from terralego.conf import settings
+
+from django_terralego import cache, conf, singleflight
+from django_terralego.breaker import get_breaker
+from django_terralego.geodirectory import get_entry_data, get_request_size, get_tags_key, get_url
+from django_terralego.instrumentation import instrument
+from django_terralego.session import get_timeout
+from django_terralego.stats import counters
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+_sessions = weakref.WeakKeyDictionary()  # Event loop -> session
+
+
+def get_client_session():
+    """
+    Get the aiohttp session of the running event loop, keeping the connections to terralego alive.
+    """
+    if aiohttp is None:
+        raise ImportError('aiohttp is required by the asyncio API.')
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        close_stale_client_sessions()
+        connector = aiohttp.TCPConnector(limit=conf.TERRALEGO.get('POOL_SIZE', 10))
+        auth = aiohttp.BasicAuth(settings.USER, settings.PASSWORD) if settings.USER else None
+        session = aiohttp.ClientSession(connector=connector, auth=auth)
+        _sessions[loop] = session
+    return session
+
+
+def close_stale_client_sessions():
+    """
+    Close the sessions of the closed event loops, from the current one. A session references its loop, so it is not
+    dropped from the weak dict when the loop is closed without `close_client_session()`.
+    """
+    for loop in [loop for loop in _sessions if loop.is_closed()]:
+        asyncio.ensure_future(_sessions.pop(loop).close())
+
+
+def run_blocking(func, *args):
+    """
+    Run a blocking call, e.g. to the Django cache, in the default executor of the event loop.
+    """
+    return asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
+
+
+async def close_client_session():
+    """
+    Close the aiohttp session of the running event loop, to call before closing the loop.
+    """
+    session = _sessions.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def request(operation, method, url, data=None, **kwargs):
+    timeout = aiohttp.ClientTimeout(total=get_timeout(operation))
+    # The state of the circuit breaker may be in the Django cache, it is read and written from a thread
+    breaker = get_breaker()
+    if breaker is not None:
+        await run_blocking(breaker.before_call)
+    call = None
+    try:
+        with instrument(operation, get_request_size(data), guarded=False) as call:
+            try:
+                async with get_client_session().request(method, url, data=data, timeout=timeout, **kwargs) as response:
+                    body = await response.read()
+            except asyncio.TimeoutError as e:
+                raise requests.Timeout(e)
+            except aiohttp.ClientError as e:
+                raise requests.ConnectionError(e)
+            call.response_size = len(body)
+            if response.status >= 400:
+                error = requests.HTTPError('{0} Error for url: {1}'.format(response.status, url))
+                error.response = requests.Response()
+                error.response.status_code = response.status
+                raise error
+    finally:
+        if breaker is not None and call is not None:
+            await run_blocking(breaker.after_call, call.duration, call.error)
+    return json.loads(body.decode('utf-8')) if body else None
+
+
+async def create_entry(geometry, tags=None):
+    """
+    Create a new entry, see `django_terralego.geodirectory.create_entry`.
+    """
+    return await request('create', 'POST', get_url('entries/'), data=get_entry_data(geometry, tags))
+
+
+async def get_entry(entry_id):
+    """
+    Get an entry, see `django_terralego.geodirectory.get_entry`. The identical requests of the event loop are shared.
+    """
+    url = get_url('entries/{0}/'.format(entry_id))
+    return await singleflight.group.ado(('get', str(entry_id)), request, 'get', 'GET', url)
+
+
+async def update_entry(entry_id, geometry, tags=None):
+    """
+    Update an entry, see `django_terralego.geodirectory.update_entry`.
+    """
+    url = get_url('entries/{0}/'.format(entry_id))
+    return await request('update', 'PUT', url, data=get_entry_data(geometry, tags))
+
+
+async def delete_entry(entry_id):
+    """
+    Delete an entry, see `django_terralego.geodirectory.delete_entry`.
+    """
+    await request('delete', 'DELETE', get_url('entries/{0}/'.format(entry_id)))
+
+
+async def closest(entry_id, tags=None):
+    """
+    Get the closest entry of an entry, see `django_terralego.geodirectory.closest`. The identical requests of the event
+    loop are shared.
+    """
+    params = {'tags': json.dumps(tags)} if tags else {}
+    url = get_url('entries/{0}/closest/'.format(entry_id))
+    key = ('closest', str(entry_id), get_tags_key(tags))
+    return await singleflight.group.ado(key, partial(request, params=params), 'closest', 'GET', url)
+
+
+async def get_cached_entry(entry_id):
+    """
+    Get an entry through the cache configured by `TERRALEGO['CACHE']`, see `django_terralego.cache.get_entry`. The
+    cache is read and written from a thread.
+    """
+    if not cache.is_enabled():
+        return await get_entry(entry_id)
+    entry = await run_blocking(cache.get_cache().get, cache.get_key(entry_id))
+    if entry is not None:
+        counters.incr('cache_hits')
+        return entry
+    counters.incr('cache_misses')
+    entry = await get_entry(entry_id)
+    await run_blocking(cache.get_cache().set, cache.get_key(entry_id), entry, cache.get_settings().get('TIMEOUT', 300))
+    return entry
+
+
+async def get_cached_closest(entry_id, tags=None):
+    """
+    Get the closest entry of an entry through the cache, see `django_terralego.cache.get_closest`. The cache is read
+    and written from a thread.
+    """
+    if not cache.is_closest_enabled():
+        return await closest(entry_id, tags)
+    key = cache.get_closest_key(entry_id, tags)
+    entry = await run_blocking(cache.get_cache().get, key)
+    if entry is not None:
+        counters.incr('closest_cache_hits')
+        return entry
+    counters.incr('closest_cache_misses')
+    entry = await closest(entry_id, tags)
+    await run_blocking(cache.get_cache().set, key, entry, cache.get_settings().get('TIMEOUT', 300))
+    return entry
+
+
+async def gather(aws, limit=None, return_exceptions=True):
+    """
+    Run awaitables concurrently like `asyncio.gather`, with at most `limit` of them at once.
+
+    :param aws: An iterable of awaitables, e.g. `[obj.asave_to_terralego() for obj in objs]`.
+    :param limit: Optional. Defaults to `TERRALEGO['POOL_SIZE']`.
+    :param return_exceptions: Return the exceptions in the results instead of raising the first one.
+    :return: The list of the results, in the same order as `aws`.
+    """
+    semaphore = asyncio.Semaphore(limit or conf.TERRALEGO.get('POOL_SIZE', 10))
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run(aw) for aw in aws], return_exceptions=return_exceptions)
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
 
+from django_terralego import conf
+
 
 class DjangoTerralegoConfig(AppConfig):
     name = 'django_terralego'
+
+    def ready(self):
+        if conf.TERRALEGO.get('CLOSEST_BACKEND', 'remote') == 'local':
+            from django_terralego.spatial import connect_signals
+            connect_signals()
+        if conf.TERRALEGO.get('TILES'):
+            from django_terralego.tiles import connect_signals
+            connect_signals()
@@ -0,0 +1,181 @@
+"""
+A circuit breaker in front of the requests to terralego, enabled by `TERRALEGO['CIRCUIT_BREAKER']`::
+
+    TERRALEGO = {
+        'CIRCUIT_BREAKER': {
+            'FAILURE_THRESHOLD': 5,  # Consecutive failures opening the circuit
+            'RECOVERY_TIMEOUT': 30,  # Seconds before a trial request is let through
+            'SLOW_CALL_THRESHOLD': 5,  # Optional. Seconds after which a successful request counts as a failure
+            'CACHE_ALIAS': 'default',  # Optional. Share the state between the processes through this cache
+        },
+    }
+
+While the circuit is open, the requests fail immediately with `CircuitOpenError`. After `RECOVERY_TIMEOUT`, the circuit
+is half-open: a single trial request is let through, closing the circuit if it succeeds.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+from requests import ConnectionError, HTTPError
+
+from django_terralego import conf
+from django_terralego.stats import counters
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of requesting terralego while the circuit is open.
+    """
+
+
+class LocalState(object):
+    """
+    The state of the circuit in the current process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def get_opened_at(self):
+        return self.opened_at
+
+    def get_status(self):
+        return self.opened_at, self.failures
+
+    def add_failure(self):
+        with self.lock:
+            self.failures += 1
+            return self.failures
+
+    def open(self):
+        self.opened_at = time.time()
+        self.probing = False
+
+    def close(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def start_probe(self, timeout):
+        with self.lock:
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+
+class CacheState(object):
+    """
+    The state of the circuit shared by the processes through a Django cache.
+    """
+    FAILURES_KEY = 'terralego:breaker:failures'
+    OPENED_AT_KEY = 'terralego:breaker:opened_at'
+    PROBE_KEY = 'terralego:breaker:probe'
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def get_opened_at(self):
+        return self.cache.get(self.OPENED_AT_KEY)
+
+    def get_status(self):
+        values = self.cache.get_many([self.OPENED_AT_KEY, self.FAILURES_KEY])
+        return values.get(self.OPENED_AT_KEY), values.get(self.FAILURES_KEY, 0)
+
+    def add_failure(self):
+        self.cache.add(self.FAILURES_KEY, 0, None)
+        try:
+            return self.cache.incr(self.FAILURES_KEY)
+        except ValueError:
+            # Evicted in between
+            self.cache.set(self.FAILURES_KEY, 1, None)
+            return 1
+
+    def open(self):
+        self.cache.set(self.OPENED_AT_KEY, time.time(), None)
+        self.cache.delete(self.PROBE_KEY)
+
+    def close(self):
+        self.cache.delete_many([self.FAILURES_KEY, self.OPENED_AT_KEY, self.PROBE_KEY])
+
+    def start_probe(self, timeout):
+        return self.cache.add(self.PROBE_KEY, 1, timeout)
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, slow_call_threshold=None, cache_alias=None):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.state = CacheState(cache_alias) if cache_alias else LocalState()
+
+    def is_open(self):
+        return self.state.get_opened_at() is not None
+
+    def before_call(self):
+        """
+        Raise `CircuitOpenError` if the request must not be made.
+        """
+        opened_at = self.state.get_opened_at()
+        if opened_at is None:
+            return
+        if time.time() - opened_at >= self.recovery_timeout and self.state.start_probe(self.recovery_timeout):
+            # Half-open, this request is the trial
+            return
+        counters.incr('breaker.rejected')
+        raise CircuitOpenError('The terralego circuit breaker is open')
+
+    def after_call(self, duration, error=None):
+        if isinstance(error, CircuitOpenError):
+            return
+        failed = error is not None and not (
+            isinstance(error, HTTPError) and error.response is not None and error.response.status_code < 500)
+        if self.slow_call_threshold is not None and duration > self.slow_call_threshold:
+            failed = True
+        if not failed:
+            opened_at, failures = self.state.get_status()
+            if opened_at is not None or (error is None and failures):
+                # Only written on a transition: the trial succeeded, or the first success after failures
+                self.state.close()
+            return
+        if self.state.get_opened_at() is not None or self.state.add_failure() >= self.failure_threshold:
+            # The trial failed or too many failures
+            counters.incr('breaker.opened')
+            self.state.open()
+
+
+_breaker = None
+_breaker_settings = None
+
+
+def get_breaker():
+    """
+    Get the circuit breaker configured by `TERRALEGO['CIRCUIT_BREAKER']`, or None.
+    """
+    global _breaker, _breaker_settings
+    options = conf.TERRALEGO.get('CIRCUIT_BREAKER')
+    if not options:
+        return None
+    if _breaker is None or _breaker_settings != options:
+        _breaker = CircuitBreaker(
+            failure_threshold=options.get('FAILURE_THRESHOLD', 5),
+            recovery_timeout=options.get('RECOVERY_TIMEOUT', 30),
+            slow_call_threshold=options.get('SLOW_CALL_THRESHOLD'),
+            cache_alias=options.get('CACHE_ALIAS'),
+        )
+        _breaker_settings = dict(options)
+    return _breaker
+
+
+def reset_breaker():
+    """
+    Drop the circuit breaker of the current process, starting again from a closed circuit.
+    """
+    global _breaker, _breaker_settings
+    _breaker = _breaker_settings = None
@@ -0,0 +1,194 @@
+"""
+A read-through cache of the geodirectory entries, stored in a Django cache.
+
+It is enabled by `TERRALEGO['CACHE']`, for example `{'ALIAS': 'default', 'TIMEOUT': 300}`. Hits and misses are
+counted in `django_terralego.stats.counters` as `cache_hits` and `cache_misses`.
+
+With `'CLOSEST': True`, the results of `closest` are cached too, counted as `closest_cache_hits` and
+`closest_cache_misses`. Their keys contain the generation of the entry and of the requested tags, which are bumped when
+an entry having these tags is written: the affected results are never read again, without looking for their keys.
+"""
+import hashlib
+import json
+import logging
+import uuid
+
+from django.core.cache import caches
+
+from django_terralego import conf, geodirectory
+from django_terralego.stats import counters
+from django_terralego.utils import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+
+def get_settings():
+    return conf.TERRALEGO.get('CACHE') or {}
+
+
+def is_enabled():
+    return bool(get_settings())
+
+
+def get_cache():
+    return caches[get_settings().get('ALIAS', 'default')]
+
+
+def get_key(entry_id):
+    return 'terralego:entry:{0}'.format(entry_id)
+
+
+def get_entry(entry_id):
+    """
+    Get an entry from the cache, or from terralego on a miss.
+
+    :param entry_id: The id of the entry.
+    :return: A geojson describing the entry as a python dictionnary.
+    """
+    if not is_enabled():
+        return geodirectory.get_entry(entry_id)
+    cache = get_cache()
+    entry = cache.get(get_key(entry_id))
+    if entry is not None:
+        counters.incr('cache_hits')
+        return entry
+    counters.incr('cache_misses')
+    entry = geodirectory.get_entry(entry_id)
+    cache.set(get_key(entry_id), entry, get_settings().get('TIMEOUT', 300))
+    return entry
+
+
+def get_entries(entry_ids, max_workers=None):
+    """
+    Get many entries with one cache round trip, the misses being requested concurrently to terralego.
+
+    :param entry_ids: The ids of the entries.
+    :param max_workers: Optional. The maximum number of concurrent requests.
+    :return: A dict of the entries by id. The entries which could not be retrieved are logged and missing.
+    """
+    entry_ids = set(str(entry_id) for entry_id in entry_ids)
+    entries = {}
+    if is_enabled():
+        cached = get_cache().get_many([get_key(entry_id) for entry_id in entry_ids])
+        for entry_id in entry_ids:
+            if get_key(entry_id) in cached:
+                entries[entry_id] = cached[get_key(entry_id)]
+        counters.incr('cache_hits', len(entries))
+        counters.incr('cache_misses', len(entry_ids) - len(entries))
+    missing = [entry_id for entry_id in entry_ids if entry_id not in entries]
+    fetched = {}
+    results = run_concurrently(geodirectory.get_entry, missing, max_workers or conf.TERRALEGO.get('MAX_WORKERS', 8))
+    for entry_id, entry, error in results:
+        if error is None:
+            fetched[entry_id] = entry
+        else:
+            logger.error('Error while getting entry {0} from terralego: {1}'.format(entry_id, error))
+    if fetched and is_enabled():
+        get_cache().set_many(
+            {get_key(entry_id): entry for entry_id, entry in fetched.items()}, get_settings().get('TIMEOUT', 300))
+    entries.update(fetched)
+    return entries
+
+
+def invalidate(entry_id):
+    """
+    Remove an entry from the cache, after it was updated or deleted.
+    """
+    if is_enabled() and entry_id is not None:
+        get_cache().delete(get_key(entry_id))
+
+
+def invalidate_many(entry_ids):
+    """
+    Remove many entries from the cache at once.
+    """
+    if is_enabled():
+        get_cache().delete_many([get_key(entry_id) for entry_id in entry_ids if entry_id is not None])
+
+
+def is_closest_enabled():
+    return is_enabled() and get_settings().get('CLOSEST', False)
+
+
+def get_generation_key(name):
+    return 'terralego:generation:{0}'.format(hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+
+def get_generations(names):
+    """
+    Get the current generation of every name, the missing ones being started.
+
+    :return: A list of the generations, in the same order as names.
+    """
+    cache = get_cache()
+    keys = [get_generation_key(name) for name in names]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # A new generation, never used by a cached result even if it was evicted
+            generation = uuid.uuid4().hex
+            if not cache.add(key, generation, None):
+                generation = cache.get(key) or generation
+            generations[key] = generation
+    return [generations[key] for key in keys]
+
+
+def get_dependencies(entry_id, tags):
+    """
+    Get the generation names a closest result depends on: the entry itself, and the entries having the tags.
+    """
+    names = ['global', 'entry:{0}'.format(entry_id)]
+    if tags:
+        names.extend('tag:{0}'.format(tag) for tag in sorted(set(tags)))
+    else:
+        names.append('untagged')
+    return names
+
+
+def get_closest_key(entry_id, tags=None):
+    names = get_dependencies(entry_id, tags)
+    content = json.dumps([names, get_generations(names)])
+    return 'terralego:closest:{0}'.format(hashlib.sha1(content.encode('utf-8')).hexdigest())
+
+
+def get_closest(entry_id, tags=None):
+    """
+    Get the closest entry of an entry from the cache, or from terralego on a miss.
+
+    :param entry_id: The id of the entry.
+    :param tags: Optional. A list of tags to filter the entries on which the request is made.
+    :return: A geojson describing the closest entry as a python dictionnary.
+    """
+    if not is_closest_enabled():
+        return geodirectory.closest(entry_id, tags)
+    # The key is computed before the request: a result is not cached under a generation bumped during it
+    key = get_closest_key(entry_id, tags)
+    entry = get_cache().get(key)
+    if entry is not None:
+        counters.incr('closest_cache_hits')
+        return entry
+    counters.incr('closest_cache_misses')
+    entry = geodirectory.closest(entry_id, tags)
+    get_cache().set(key, entry, get_settings().get('TIMEOUT', 300))
+    return entry
+
+
+def invalidate_closest(entries):
+    """
+    Invalidate the cached closest results which could change after entries were created, updated or deleted.
+
+    :param entries: `(entry_id, tags)` tuples, `tags` being the tags before and after the change. When the tags are
+                    unknown (None), every result is invalidated.
+    """
+    if not is_closest_enabled():
+        return
+    names = set()
+    for entry_id, tags in entries:
+        if tags is None:
+            names.add('global')
+            continue
+        names.update(['entry:{0}'.format(entry_id), 'untagged'])
+        names.update('tag:{0}'.format(tag) for tag in tags)
+    if names:
+        generation = uuid.uuid4().hex
+        get_cache().set_many({get_generation_key(name): generation for name in names}, None)
@@ -0,0 +1,307 @@
+"""
+Geometry fields decoding their value lazily, on first access.
+
+`LazyGeometryField` stores GeoJSON text like djgeojson's `GeometryField`, which is used by `GeoDirectoryMixin`. The
+opt-in `CompactGeometryField` stores the geometries in a packed binary format instead: a small JSON header describing
+the structure of the geometry, followed by every coordinate as little-endian float64, readable as a NumPy array without
+copy with `get_coordinates()`.
+
+Both keep the value read from the database as is until the attribute is accessed, and write it back as is when it was
+not accessed, so that iterating over large querysets does not decode geometries which are never used.
+"""
+import json
+import struct
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+from djgeojson.fields import GeoJSONFormField, GeometryField
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PACKED_MAGIC = b'TLG\x01'
+GEOMETRY_DEPTHS = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'MultiLineString': 2,
+    'Polygon': 2,
+    'MultiPolygon': 3,
+}
+
+
+class RawGeometry(str):
+    """
+    GeoJSON text read from the database, not decoded yet.
+    """
+
+
+class LazyGeometryDescriptor(object):
+    """
+    Keep the raw value of a geometry field in the instance until first access.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        name = self.field.attname
+        if name not in instance.__dict__:
+            # Deferred field
+            instance.refresh_from_db(fields=[name])
+        value = instance.__dict__[name]
+        if self.field.is_raw(value):
+            value = instance.__dict__[name] = self.field.decode(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = self.field.from_assignment(value, instance)
+
+
+def get_raw_value(instance, name):
+    """
+    Get the value of a field without decoding it, the raw value being returned if the field was not accessed yet.
+    """
+    if name in instance.__dict__:
+        return instance.__dict__[name]
+    return getattr(instance, name)
+
+
+class LazyGeometryField(GeometryField):
+    """
+    A djgeojson `GeometryField` decoding the GeoJSON text only when the attribute is accessed.
+    """
+
+    def is_raw(self, value):
+        return isinstance(value, RawGeometry)
+
+    def decode(self, value):
+        try:
+            return json.loads(value, **self.load_kwargs)
+        except ValueError:
+            raise ValidationError(_('Enter valid JSON'))
+
+    def from_assignment(self, value, instance):
+        # Where jsonfield's `pre_init` decodes the value, i.e. when loading an instance from the database
+        if instance._state.adding and getattr(instance, 'pk', None) is not None and isinstance(value, str):
+            return RawGeometry(value)
+        return value
+
+    def pre_save(self, model_instance, add):
+        return get_raw_value(model_instance, self.attname)
+
+    def get_prep_value(self, value):
+        if isinstance(value, RawGeometry):
+            return str(value)
+        return super(LazyGeometryField, self).get_prep_value(value)
+
+
+def _contribute_lazy_descriptor(self, cls, name, **kwargs):
+    super(LazyGeometryField, self).contribute_to_class(cls, name, **kwargs)
+    setattr(cls, self.attname, LazyGeometryDescriptor(self))
+
+
+# Set after the class creation, jsonfield's metaclass would set its own descriptor after ours otherwise
+LazyGeometryField.contribute_to_class = _contribute_lazy_descriptor
+
+
+def _flatten(coordinates, depth, positions):
+    if depth == 0:
+        positions.append(coordinates)
+        return None
+    if depth == 1:
+        positions.extend(coordinates)
+        return len(coordinates)
+    return [_flatten(item, depth - 1, positions) for item in coordinates]
+
+
+def _get_structure(geometry, positions):
+    geometry_type = geometry.get('type')
+    if geometry_type == 'GeometryCollection':
+        return {
+            'type': geometry_type,
+            'geometries': [_get_structure(item, positions) for item in geometry.get('geometries', [])],
+        }
+    if geometry_type not in GEOMETRY_DEPTHS:
+        raise ValueError('Unsupported geometry type: {0}'.format(geometry_type))
+    return {
+        'type': geometry_type,
+        'parts': _flatten(geometry.get('coordinates') or [], GEOMETRY_DEPTHS[geometry_type], positions),
+    }
+
+
+def pack_geometry(geometry):
+    """
+    Pack a GeoJSON geometry: a header describing its structure, followed by its coordinates as float64.
+    """
+    positions = []
+    structure = _get_structure(geometry, positions)
+    dimension = len(positions[0]) if positions else 2
+    if any(len(position) != dimension for position in positions):
+        raise ValueError('Every position of the geometry must have the same dimension')
+    structure['dimension'] = dimension
+    header = json.dumps(structure, separators=(',', ':')).encode('utf-8')
+    # The coordinates start at a multiple of 8 bytes
+    header += b' ' * (-(len(PACKED_MAGIC) + 4 + len(header)) % 8)
+    values = [value for position in positions for value in position]
+    return b''.join([
+        PACKED_MAGIC, struct.pack('<I', len(header)), header, struct.pack('<{0}d'.format(len(values)), *values),
+    ])
+
+
+def _read_header(packed):
+    if bytes(packed[:len(PACKED_MAGIC)]) != PACKED_MAGIC:
+        raise ValueError('Not a packed geometry')
+    start = len(PACKED_MAGIC) + 4
+    header_size, = struct.unpack_from('<I', packed, len(PACKED_MAGIC))
+    structure = json.loads(bytes(packed[start:start + header_size]).decode('utf-8'))
+    return structure, start + header_size
+
+
+def _unflatten(parts, depth, positions):
+    if depth == 0:
+        return next(positions)
+    if depth == 1:
+        return [next(positions) for _ in range(parts)]
+    return [_unflatten(item, depth - 1, positions) for item in parts]
+
+
+def _build_geometry(structure, positions):
+    if structure['type'] == 'GeometryCollection':
+        return {
+            'type': 'GeometryCollection',
+            'geometries': [_build_geometry(item, positions) for item in structure['geometries']],
+        }
+    return {
+        'type': structure['type'],
+        'coordinates': _unflatten(structure['parts'], GEOMETRY_DEPTHS[structure['type']], positions),
+    }
+
+
+def _unpack_values(packed):
+    structure, offset = _read_header(packed)
+    count = (len(packed) - offset) // 8
+    return structure, struct.unpack_from('<{0}d'.format(count), packed, offset)
+
+
+def unpack_geometry(packed):
+    """
+    Get the GeoJSON geometry of a packed geometry.
+    """
+    structure, values = _unpack_values(packed)
+    dimension = structure['dimension']
+    positions = iter([list(values[i:i + dimension]) for i in range(0, len(values), dimension)])
+    return _build_geometry(structure, positions)
+
+
+def unpack_positions(packed):
+    """
+    Get every `(x, y)` position of a packed geometry, without building the GeoJSON geometry.
+    """
+    structure, values = _unpack_values(packed)
+    dimension = structure['dimension']
+    return [(values[i], values[i + 1]) for i in range(0, len(values), dimension)]
+
+
+def get_coordinates(packed):
+    """
+    Get every position of a packed geometry as a `(positions, dimension)` NumPy array sharing the packed buffer.
+
+    It requires NumPy.
+    """
+    structure, offset = _read_header(packed)
+    return np.frombuffer(packed, dtype='<f8', offset=offset).reshape(-1, structure['dimension'])
+
+
+def is_packed(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:len(PACKED_MAGIC)]) == PACKED_MAGIC
+
+
+def load_geometry(value):
+    """
+    Get a GeoJSON geometry from a dict, a GeoJSON text or a packed geometry, or None if it is none of them.
+    """
+    if isinstance(value, dict):
+        return value
+    if is_packed(value):
+        return unpack_geometry(value)
+    try:
+        value = json.loads(value)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+class CompactGeometryField(models.Field):
+    """
+    A geometry field storing GeoJSON geometries packed in a binary column, decoded only when the attribute is accessed.
+
+    To use it, override the `terralego_geometry` field of `GeoDirectoryMixin` in your model.
+    """
+    description = _('Geometry packed as float64 coordinates')
+    empty_values = [None, b'']
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def get_placeholder(self, value, compiler, connection):
+        return connection.ops.binary_placeholder_sql(value)
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(CompactGeometryField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, LazyGeometryDescriptor(self))
+
+    def is_raw(self, value):
+        return isinstance(value, (bytes, bytearray, memoryview))
+
+    def decode(self, value):
+        return unpack_geometry(value)
+
+    def from_assignment(self, value, instance):
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError:
+                # e.g. WKT, replaced by the GeoJSON geometry of the entry before saving
+                return value
+        return value
+
+    def pre_save(self, model_instance, add):
+        return get_raw_value(model_instance, self.attname)
+
+    def get_prep_value(self, value):
+        value = super(CompactGeometryField, self).get_prep_value(value)
+        if value is None or self.is_raw(value):
+            return value
+        if not isinstance(value, dict):
+            raise ValueError('{0} only stores GeoJSON geometries'.format(self.__class__.__name__))
+        return pack_geometry(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super(CompactGeometryField, self).get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def value_from_object(self, obj):
+        # GeoJSON text, for the forms and the serializers
+        value = getattr(obj, self.attname)
+        return None if value is None else json.dumps(value)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        defaults = {'form_class': GeoJSONFormField, 'geom_type': 'GEOMETRY'}
+        defaults.update(kwargs)
+        return super(CompactGeometryField, self).formfield(**defaults)
@@ -0,0 +1,132 @@
+"""
+The geodirectory endpoints, like `terralego.geodirectory`, using the shared session of `django_terralego.session`.
+"""
+import json
+
+from requests.compat import urlencode
+from terralego.conf import settings
+
+from django_terralego import singleflight
+from django_terralego.instrumentation import instrument
+from django_terralego.session import get_session, get_timeout
+
+
+def get_url(path=''):
+    return '{0}{1}'.format(settings.TERRALEGO_URL.format(api='geodirectory'), path)
+
+
+def get_auth():
+    return settings.USER, settings.PASSWORD
+
+
+def get_entry_data(geometry, tags):
+    if tags is None:
+        tags = []
+    if isinstance(geometry, dict):
+        geometry = json.dumps(geometry)
+    return {
+        'geometry': geometry,
+        'tags': json.dumps(tags),
+    }
+
+
+def get_tags_key(tags):
+    # The entries have all the tags, whatever their order
+    return tuple(sorted(set(tags or [])))
+
+
+def get_request_size(data):
+    return len(urlencode(data)) if data else 0
+
+
+def create_entry(geometry, tags=None):
+    """
+    Create a new entry.
+
+    :param geometry: A WKT string representing the geometry of the entry or a dict representing the geojson.
+    :param tags: A list of string describing the entry. Can be used for filtering later on.
+    :return: A geojson describing the entry as a python dictionnary.
+    """
+    data = get_entry_data(geometry, tags)
+    with instrument('create', get_request_size(data)) as call:
+        response = get_session().post(get_url('entries/'), data=data, auth=get_auth(), timeout=get_timeout('create'))
+        call.set_response(response)
+        response.raise_for_status()
+    return response.json()
+
+
+def get_entry(entry_id):
+    """
+    Get an entry.
+
+    The identical requests made at the same time by other threads are shared, see `django_terralego.singleflight`.
+
+    :param entry_id: The id of the entry.
+    :return: A geojson describing the entry as a python dictionnary.
+    """
+    return singleflight.group.do(('get', str(entry_id)), _get_entry, entry_id)
+
+
+def _get_entry(entry_id):
+    url = get_url('entries/{0}/'.format(entry_id))
+    with instrument('get') as call:
+        response = get_session().get(url, auth=get_auth(), timeout=get_timeout('get'))
+        call.set_response(response)
+        response.raise_for_status()
+    return response.json()
+
+
+def update_entry(entry_id, geometry, tags=None):
+    """
+    Update an entry.
+
+    :param entry_id: The id of the entry.
+    :param geometry: A WKT string representing the geometry of the entry or a dict representing the geojson.
+    :param tags: A list of string describing the entry. Can be used for filtering later on.
+    :return: A geojson describing the updated entry as a python dictionnary.
+    """
+    url = get_url('entries/{0}/'.format(entry_id))
+    data = get_entry_data(geometry, tags)
+    with instrument('update', get_request_size(data)) as call:
+        response = get_session().put(url, data=data, auth=get_auth(), timeout=get_timeout('update'))
+        call.set_response(response)
+        response.raise_for_status()
+    return response.json()
+
+
+def delete_entry(entry_id):
+    """
+    Delete an entry.
+
+    :param entry_id: The id of the entry.
+    """
+    url = get_url('entries/{0}/'.format(entry_id))
+    with instrument('delete') as call:
+        response = get_session().delete(url, auth=get_auth(), timeout=get_timeout('delete'))
+        call.set_response(response)
+        response.raise_for_status()
+
+
+def closest(entry_id, tags=None):
+    """
+    Get the closest entry of an entry.
+
+    The identical requests made at the same time by other threads are shared, see `django_terralego.singleflight`.
+
+    :param entry_id: The id of the entry.
+    :param tags: Optional. A list of tags to filter the entries on which the request is made.
+    :return: A geojson describing the closest entry as a python dictionnary.
+    """
+    return singleflight.group.do(('closest', str(entry_id), get_tags_key(tags)), _closest, entry_id, tags)
+
+
+def _closest(entry_id, tags):
+    params = {}
+    if tags:
+        params['tags'] = json.dumps(tags)
+    url = get_url('entries/{0}/closest/'.format(entry_id))
+    with instrument('closest') as call:
+        response = get_session().get(url, params=params, auth=get_auth(), timeout=get_timeout('closest'))
+        call.set_response(response)
+        response.raise_for_status()
+    return response.json()
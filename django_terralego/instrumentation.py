@@ -0,0 +1,166 @@
+"""
+Measure the requests made to terralego.
+
+Every request sends the `pre_terralego_call` and `post_terralego_call` signals, and updates these counters of
+`django_terralego.stats.counters`, for each operation:
+
+- `calls.<operation>` and `errors.<operation>`
+- `duration_ms.<operation>`, the total duration in milliseconds
+- `latency.<operation>.le_<bucket>`, the number of requests which took at most `<bucket>` milliseconds
+- `request_bytes.<operation>` and `response_bytes.<operation>`
+- `retries.<operation>`
+
+The requests slower than `TERRALEGO['SLOW_CALL_THRESHOLD']` seconds are logged as warnings.
+
+The block is also guarded by the circuit breaker of `django_terralego.breaker`, when enabled.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django_terralego import conf
+from django_terralego.breaker import get_breaker
+from django_terralego.signals import post_terralego_call, pre_terralego_call
+from django_terralego.stats import counters
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class Call(object):
+    """
+    The measures of a request, to complete in the `instrument` block.
+    """
+
+    def __init__(self, operation, request_size=0):
+        self.operation = operation
+        self.request_size = request_size
+        self.response_size = 0
+        self.retries = 0
+        self.duration = None
+        self.error = None
+
+    def set_response(self, response):
+        """
+        Read the response size and the number of retries of a `requests` response.
+        """
+        self.response_size = len(response.content or b'')
+        retries = getattr(getattr(response, 'raw', None), 'retries', None)
+        self.retries = len(getattr(retries, 'history', None) or ())
+
+
+def get_bucket(duration_ms):
+    for bucket in LATENCY_BUCKETS:
+        if duration_ms <= bucket:
+            return bucket
+
+
+def get_latency_histogram(operation):
+    """
+    :return: A list of `(bucket, count)`, the count being the number of requests which took at most `bucket` ms.
+    """
+    snapshot = counters.snapshot()
+    histogram = []
+    count = 0
+    for bucket in LATENCY_BUCKETS:
+        count += snapshot.get('latency.{0}.le_{1}'.format(operation, bucket), 0)
+        histogram.append((bucket, count))
+    return histogram
+
+
+def record(call):
+    duration_ms = call.duration * 1000
+    counters.incr('calls.{0}'.format(call.operation))
+    counters.incr('duration_ms.{0}'.format(call.operation), duration_ms)
+    counters.incr('latency.{0}.le_{1}'.format(call.operation, get_bucket(duration_ms)))
+    counters.incr('request_bytes.{0}'.format(call.operation), call.request_size)
+    counters.incr('response_bytes.{0}'.format(call.operation), call.response_size)
+    if call.retries:
+        counters.incr('retries.{0}'.format(call.operation), call.retries)
+    if call.error is not None:
+        counters.incr('errors.{0}'.format(call.operation))
+    collector = get_collector()
+    if collector is not None:
+        with _lock:
+            collector.append(call)
+    threshold = conf.TERRALEGO.get('SLOW_CALL_THRESHOLD', 1)
+    if threshold is not None and call.duration > threshold:
+        logger.warning('Slow terralego {0}: {1:.0f}ms'.format(call.operation, duration_ms))
+
+
+@contextmanager
+def instrument(operation, request_size=0, guarded=True):
+    """
+    Measure the request made in the block.
+
+    :param operation: One of `create`, `get`, `update`, `delete` and `closest`.
+    :param request_size: Optional. The size of the request body in bytes.
+    :param guarded: Check the circuit breaker. False when the caller does it, e.g. from a thread for an event loop.
+    """
+    breaker = get_breaker() if guarded else None
+    if breaker is not None:
+        breaker.before_call()
+    call = Call(operation, request_size)
+    pre_terralego_call.send(sender=None, operation=operation)
+    started = time.time()
+    try:
+        yield call
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        call.duration = time.time() - started
+        if breaker is not None:
+            breaker.after_call(call.duration, call.error)
+        record(call)
+        post_terralego_call.send(
+            sender=None, operation=operation, duration=call.duration, request_size=call.request_size,
+            response_size=call.response_size, error=call.error,
+        )
+
+
+def get_collector():
+    """
+    Get the list collecting the requests made by the current thread, or None.
+    """
+    return getattr(_local, 'collector', None)
+
+
+@contextmanager
+def collecting(collector):
+    """
+    Collect the requests made by the current thread in the block into `collector`, as returned by `get_collector` in
+    another thread, e.g. the one which submitted the work to a pool.
+    """
+    previous = get_collector()
+    _local.collector = collector
+    try:
+        yield
+    finally:
+        _local.collector = previous
+
+
+def start_collecting():
+    """
+    Start collecting the requests made by the current thread, and by the threads of `run_concurrently` it uses.
+
+    :return: A list of `Call`, filled at the end of each request.
+    """
+    _local.collector = []
+    return _local.collector
+
+
+def stop_collecting():
+    """
+    Stop collecting the requests made by the current thread.
+
+    :return: The list of `Call` collected since `start_collecting`.
+    """
+    calls = get_collector()
+    _local.collector = None
+    return calls or []
@@ -0,0 +1,262 @@
+import codecs
+import json
+import os
+import re
+import time
+from collections import deque
+from multiprocessing import Pool
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from django_terralego.models import GeoDirectoryMixin, TerralegoImportChunk
+from django_terralego.utils import chunked
+
+FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+SEPARATORS = re.compile(r'[ \t\r\n,]*')
+
+
+def iter_feature_collection(stream, offset=0, block_size=65536):
+    """
+    Parse the features of a GeoJSON FeatureCollection one by one, without reading the whole file.
+
+    :param stream: A file opened in binary mode.
+    :param offset: Optional. The offset returned with a feature, to resume after it.
+    :return: An iterator of `(feature, offset)`, `offset` being the position in bytes after the feature.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    stream.seek(offset)
+    # The features are decoded at a moving position, the buffer is only sliced when it is filled
+    state = {'buffer': '', 'position': 0, 'offset': offset}
+
+    def fill(size=block_size):
+        data = stream.read(size)
+        state['buffer'] = state['buffer'][state['position']:] + text_decoder.decode(data, final=not data)
+        state['position'] = 0
+        return bool(data)
+
+    def consume(end):
+        state['offset'] += len(state['buffer'][state['position']:end].encode('utf-8'))
+        state['position'] = end
+
+    if not offset:
+        while True:
+            match = FEATURES_START.search(state['buffer'])
+            if match:
+                consume(match.end())
+                break
+            if not fill():
+                raise CommandError('The file is not a GeoJSON FeatureCollection')
+    while True:
+        consume(SEPARATORS.match(state['buffer'], state['position']).end())
+        if state['position'] == len(state['buffer']):
+            if not fill():
+                raise CommandError('Unexpected end of file')
+            continue
+        if state['buffer'][state['position']] == ']':
+            return
+        try:
+            feature, end = decoder.raw_decode(state['buffer'], state['position'])
+        except ValueError:
+            # An incomplete feature, read as much again
+            if not fill(max(block_size, len(state['buffer']) - state['position'])):
+                raise CommandError('Invalid feature at byte {0}'.format(state['offset']))
+            continue
+        consume(end)
+        yield feature, state['offset']
+
+
+def iter_ndjson(stream, offset=0):
+    """
+    Parse a file with one GeoJSON feature per line.
+
+    :param stream: A file opened in binary mode.
+    :param offset: Optional. The offset returned with a feature, to resume after it.
+    :return: An iterator of `(feature, offset)`, `offset` being the position in bytes after the feature.
+    """
+    stream.seek(offset)
+    for line in iter(stream.readline, b''):
+        offset += len(line)
+        if line.strip():
+            yield json.loads(line.decode('utf-8')), offset
+
+
+def build_object(model, feature, mapping, tags):
+    """
+    Build an instance of `model` from a feature, its properties being set to the fields of the same name or to the
+    fields given by `mapping`.
+    """
+    field_names = set(field.name for field in model._meta.concrete_fields if not field.auto_created)
+    values = {}
+    for key, value in (feature.get('properties') or {}).items():
+        field = mapping.get(key, key if key in field_names else None)
+        if field is not None:
+            values[field] = value
+    feature_tags = values.pop('terralego_tags', None) or []
+    if not isinstance(feature_tags, list):
+        feature_tags = [feature_tags]
+    obj = model(**values)
+    obj.terralego_geometry = feature.get('geometry')
+    obj.terralego_tags = json.dumps(tags + [tag for tag in feature_tags if tag not in tags])
+    return obj
+
+
+def import_chunk(args):
+    """
+    Insert the objects of a chunk of features, their entries being created in terralego first.
+
+    With a checkpoint, a `(name, source, start, end)` tuple, the chunk is recorded in the same transaction as its
+    objects.
+
+    :return: A tuple `(imported, failed)`, with the number of objects inserted and the number of entries which could
+             not be created.
+    """
+    label, features, mapping, tags, workers, sync, checkpoint = args
+    model = apps.get_model(label)
+    objs = [build_object(model, feature, mapping, tags) for feature in features]
+    failures = model._default_manager.bulk_save_to_terralego(objs, max_workers=workers) if sync else []
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        model._default_manager.db_manager(using).bulk_create(objs, terralego_commit=False)
+        if checkpoint is not None:
+            name, source, start, end = checkpoint
+            TerralegoImportChunk.objects.using(using).create(
+                checkpoint=name, source=source, start=start, end=end, count=len(objs))
+    return len(objs), len(failures)
+
+
+def skip_imported(features, offset, imported):
+    """
+    Drop the features of the chunks already imported.
+
+    :param features: An iterator of `(feature, end)`, `end` being the offset after the feature.
+    :param offset: The offset of the first feature.
+    :param imported: A list of `(start, end)` offsets of the chunks imported.
+    :return: An iterator of `(feature, start, end)`.
+    """
+    for feature, end in features:
+        if not any(chunk_start < end <= chunk_end for chunk_start, chunk_end in imported):
+            yield feature, offset, end
+        offset = end
+
+
+def run_chunks(tasks, processes):
+    """
+    Run `import_chunk` for every task, in a pool of processes if `processes` is above 1.
+
+    :return: An iterator of the results in the order of the tasks, at most `2 * processes` tasks being pending.
+    """
+    if processes <= 1:
+        for args in tasks:
+            yield import_chunk(args)
+        return
+    # The connections can not be shared with the children
+    connections.close_all()
+    pool = Pool(processes)
+    try:
+        pending = deque()
+        for args in tasks:
+            pending.append(pool.apply_async(import_chunk, (args,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Command(BaseCommand):
+    help = 'Import the features of a GeoJSON or NDJSON file in a GeoDirectoryMixin model.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='The model to import to, as app_label.ModelName.')
+        parser.add_argument('path', help='A GeoJSON FeatureCollection, or a file with one feature per line.')
+        parser.add_argument('--format', choices=['geojson', 'ndjson'],
+                            help='Default to ndjson for the .ndjson, .jsonl and .geojsonl files, geojson otherwise.')
+        parser.add_argument('--map', action='append', default=[], metavar='PROPERTY=FIELD',
+                            help='Set a property to a field. By default, the properties are set to the fields of the '
+                                 'same name.')
+        parser.add_argument('--tag', action='append', default=[], help='A tag added to every entry.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of features inserted at once.')
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent requests per process.')
+        parser.add_argument('--processes', type=int, default=1, help='Number of processes importing the chunks.')
+        parser.add_argument('--no-sync', action='store_false', dest='sync', help='Do not create the entries.')
+        parser.add_argument('--checkpoint', help='A name under which the chunks inserted are recorded, to resume the '
+                                                 'import after a crash.')
+
+    def get_model(self, label):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError):
+            raise CommandError('Unknown model {0}'.format(label))
+        if not issubclass(model, GeoDirectoryMixin):
+            raise CommandError('{0} does not use GeoDirectoryMixin'.format(label))
+        return model
+
+    def get_mapping(self, model, values):
+        mapping = {}
+        for value in values:
+            if '=' not in value:
+                raise CommandError('Invalid mapping {0}, expected PROPERTY=FIELD'.format(value))
+            key, field = value.split('=', 1)
+            try:
+                model._meta.get_field(field)
+            except FieldDoesNotExist:
+                raise CommandError('{0} has no field {1}'.format(model.__name__, field))
+            mapping[key] = field
+        return mapping
+
+    def read_checkpoint(self, name, source):
+        """
+        :return: A tuple `(offset, imported, count)`: the offset after the first chunks imported in a row, the
+                 `(start, end)` offsets of the chunks imported after them, and the number of features imported.
+        """
+        offset, imported, count = 0, [], 0
+        if not name:
+            return offset, imported, count
+        for chunk in TerralegoImportChunk.objects.filter(checkpoint=name).order_by('start'):
+            if chunk.source != source:
+                raise CommandError('The checkpoint {0} is for {1}'.format(name, chunk.source))
+            if chunk.start <= offset:
+                offset = max(offset, chunk.end)
+            else:
+                imported.append((chunk.start, chunk.end))
+            count += chunk.count
+        return offset, imported, count
+
+    def handle(self, *args, **options):
+        model = self.get_model(options['model'])
+        label = '{0}.{1}'.format(model._meta.app_label, model._meta.object_name)
+        mapping = self.get_mapping(model, options['map'])
+        source = os.path.abspath(options['path'])
+        file_format = options['format'] or (
+            'ndjson' if os.path.splitext(source)[1] in ('.ndjson', '.jsonl', '.geojsonl') else 'geojson')
+        offset, skipped, count = self.read_checkpoint(options['checkpoint'], source)
+        if count:
+            self.stdout.write('Resuming after {0} features'.format(count))
+        started = time.time()
+        imported = failed = 0
+        with open(source, 'rb') as stream:
+            features = (iter_ndjson if file_format == 'ndjson' else iter_feature_collection)(stream, offset)
+            tasks = (
+                (
+                    label, [feature for feature, start, end in chunk], mapping, options['tag'], options['workers'],
+                    options['sync'],
+                    (options['checkpoint'], source, chunk[0][1], chunk[-1][2]) if options['checkpoint'] else None,
+                )
+                for chunk in chunked(skip_imported(features, offset, skipped), options['chunk_size'])
+            )
+            for chunk_imported, chunk_failed in run_chunks(tasks, options['processes']):
+                imported += chunk_imported
+                failed += chunk_failed
+                if options['verbosity'] > 1:
+                    elapsed = time.time() - started
+                    self.stdout.write('{0} features imported ({1:.1f} features/s)'.format(
+                        imported, imported / elapsed if elapsed else 0))
+        elapsed = time.time() - started
+        self.stdout.write('{0}: {1} features imported, {2} failed to sync in {3:.1f}s ({4:.1f} features/s)'.format(
+            label, imported, failed, elapsed, imported / elapsed if elapsed else 0))
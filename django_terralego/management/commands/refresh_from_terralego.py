@@ -0,0 +1,91 @@
+import time
+from datetime import timedelta
+from multiprocessing import Pool
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from django_terralego.models import GeoDirectoryMixin
+
+
+def get_queryset(model, older_than=None):
+    queryset = model._default_manager.filter(terralego_id__isnull=False)
+    if older_than is not None:
+        cutoff = timezone.now() - timedelta(hours=older_than)
+        queryset = queryset.filter(Q(terralego_last_update__lt=cutoff) | Q(terralego_last_update__isnull=True))
+    return queryset
+
+
+def refresh_range(args):
+    """
+    Refresh the objects of a model with a primary key in `[start, end]`, in a worker process.
+    """
+    label, start, end, older_than, chunk_size, workers = args
+    queryset = get_queryset(apps.get_model(label), older_than).filter(pk__gte=start, pk__lte=end)
+    total = queryset.count()
+    updated, failures = queryset.refresh_from_terralego(chunk_size, workers)
+    return total, updated, len(failures)
+
+
+class Command(BaseCommand):
+    help = 'Update the geometry and the tags of the GeoDirectoryMixin models from terralego.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Models to refresh as app_label.ModelName, default to all.')
+        parser.add_argument('--older-than', type=float, help='Only refresh the rows updated more than N hours ago.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows handled at once.')
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent requests per process.')
+        parser.add_argument('--processes', type=int, default=1, help='Split the rows by primary key range.')
+
+    def get_models(self, labels):
+        if not labels:
+            return [model for model in apps.get_models() if issubclass(model, GeoDirectoryMixin)]
+        models = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError):
+                raise CommandError('Unknown model {0}'.format(label))
+            if not issubclass(model, GeoDirectoryMixin):
+                raise CommandError('{0} does not use GeoDirectoryMixin'.format(label))
+            models.append(model)
+        return models
+
+    def get_ranges(self, model, older_than, processes):
+        bounds = get_queryset(model, older_than).aggregate(start=Min('pk'), end=Max('pk'))
+        if bounds['start'] is None:
+            return []
+        if not isinstance(bounds['start'], int):
+            raise CommandError('--processes requires an integer primary key')
+        step = (bounds['end'] - bounds['start']) // processes + 1
+        return [(start, start + step - 1) for start in range(bounds['start'], bounds['end'] + 1, step)]
+
+    def handle(self, *args, **options):
+        for model in self.get_models(options['models']):
+            label = '{0}.{1}'.format(model._meta.app_label, model._meta.object_name)
+            started = time.time()
+            if options['processes'] > 1:
+                tasks = [
+                    (label, start, end, options['older_than'], options['chunk_size'], options['workers'])
+                    for start, end in self.get_ranges(model, options['older_than'], options['processes'])
+                ]
+                # The connections can not be shared with the children
+                connections.close_all()
+                pool = Pool(options['processes'])
+                try:
+                    results = pool.map(refresh_range, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+                total, updated, failed = [sum(values) for values in zip(*results)] if results else (0, 0, 0)
+            else:
+                queryset = get_queryset(model, options['older_than'])
+                total = queryset.count()
+                updated, failures = queryset.refresh_from_terralego(options['chunk_size'], options['workers'])
+                failed = len(failures)
+            elapsed = time.time() - started
+            self.stdout.write('{0}: {1} rows checked, {2} updated, {3} failed in {4:.1f}s ({5:.1f} rows/s)'.format(
+                label, total, updated, failed, elapsed, total / elapsed if elapsed else 0))
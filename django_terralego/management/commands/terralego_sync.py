@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_terralego.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Process the pending terralego operations recorded when TERRALEGO["DEFERRED"] is True.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of operations locked at once.')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when there is nothing to do.')
+        parser.add_argument('--once', action='store_true', help='Exit when there is nothing left to do.')
+
+    def handle(self, *args, **options):
+        while True:
+            succeeded, failed = process_outbox(options['batch_size'])
+            if succeeded or failed:
+                self.stdout.write('{0} synced, {1} failed'.format(succeeded, failed))
+                continue
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,25 @@
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+from django_terralego.instrumentation import start_collecting, stop_collecting
+
+
+class TerralegoStatsMiddleware(MiddlewareMixin):
+    """
+    Add the number and the total duration of the requests made to terralego during a request in a `Server-Timing`
+    header, e.g. `Server-Timing: terralego;dur=42.0;desc="3 calls"`.
+    """
+
+    def process_request(self, request):
+        start_collecting()
+
+    def process_response(self, request, response):
+        calls = stop_collecting()
+        duration = sum(call.duration for call in calls) * 1000
+        value = 'terralego;dur={0:.1f};desc="{1} calls"'.format(duration, len(calls))
+        if response.has_header('Server-Timing'):
+            value = '{0}, {1}'.format(response['Server-Timing'], value)
+        response['Server-Timing'] = value
+        return response
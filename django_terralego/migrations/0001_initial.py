@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerralegoOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=255, verbose_name='Object id')),
+                ('operation', models.CharField(choices=[('save', 'Save'), ('delete', 'Delete')], max_length=6, verbose_name='Operation')),
+                ('terralego_id', models.UUIDField(null=True, verbose_name='Terralego id')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Next attempt')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'verbose_name': 'Terralego outbox operation',
+                'verbose_name_plural': 'Terralego outbox operations',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='terralegooutbox',
+            index_together=set([('content_type', 'object_id')]),
+        ),
+    ]
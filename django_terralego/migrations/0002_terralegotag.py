@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_terralego', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerralegoTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terralego_id', models.UUIDField(verbose_name='Terralego id')),
+                ('tag', models.CharField(max_length=255, verbose_name='Tag')),
+            ],
+            options={
+                'verbose_name': 'Terralego tag',
+                'verbose_name_plural': 'Terralego tags',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='terralegotag',
+            unique_together=set([('terralego_id', 'tag')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='terralegotag',
+            index_together=set([('tag', 'terralego_id')]),
+        ),
+    ]
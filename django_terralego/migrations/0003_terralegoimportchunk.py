@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_terralego', '0002_terralegotag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerralegoImportChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkpoint', models.CharField(db_index=True, max_length=255, verbose_name='Checkpoint')),
+                ('source', models.TextField(verbose_name='Source')),
+                ('start', models.BigIntegerField(verbose_name='Start')),
+                ('end', models.BigIntegerField(verbose_name='End')),
+                ('count', models.PositiveIntegerField(verbose_name='Count')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+            ],
+            options={
+                'verbose_name': 'Terralego import chunk',
+                'verbose_name_plural': 'Terralego import chunks',
+                'ordering': ('checkpoint', 'start'),
+            },
+        ),
+    ]
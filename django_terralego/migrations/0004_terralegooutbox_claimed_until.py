@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_terralego', '0003_terralegoimportchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='terralegooutbox',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Claimed until'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_terralego', '0004_terralegooutbox_claimed_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerralegoGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.BigIntegerField(default=0, verbose_name='Generation')),
+                ('modified', models.DateTimeField(null=True, verbose_name='Modified')),
+                ('content_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'verbose_name': 'Terralego generation',
+                'verbose_name_plural': 'Terralego generations',
+            },
+        ),
+    ]
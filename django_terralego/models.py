@@ -1,40 +1,635 @@
+import asyncio
+import hashlib
 import json
 import logging
+import math
+from functools import partial
 
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, models, router, transaction
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from djgeojson.fields import GeometryField
 from requests import HTTPError, RequestException
 
-from terralego import geodirectory
-from django_terralego import conf
-from django_terralego.utils import convert_geodirectory_entry_to_model_instance
+from django_terralego import aio, cache, conf, geodirectory, simplify, spatial, unitofwork
+from django_terralego.breaker import CircuitOpenError
+from django_terralego.fields import LazyGeometryField, get_raw_value, load_geometry
+from django_terralego.stats import counters
+from django_terralego.utils import (
+    bulk_update, chunked, convert_geodirectory_entries, convert_geodirectory_entry_to_model_instance, run_concurrently,
+)
 
 logger = logging.getLogger(__name__)
 
+TERRALEGO_BBOX_FIELDS = ('terralego_min_x', 'terralego_min_y', 'terralego_max_x', 'terralego_max_y')
+TERRALEGO_FIELDS = (
+    'terralego_id', 'terralego_last_update', 'terralego_geometry', 'terralego_tags',
+) + TERRALEGO_BBOX_FIELDS
+
+
+def delete_entry(terralego_id):
+    """
+    Delete an entry in terralego, an entry already gone being considered deleted.
+    """
+    try:
+        geodirectory.delete_entry(terralego_id)
+    except HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+
+
+def load_tags(value):
+    """
+    Parse a `terralego_tags` value, or return None if it is not a JSON list.
+    """
+    try:
+        tags = json.loads(value) if value else []
+    except ValueError:
+        return None
+    return tags if isinstance(tags, list) else None
+
+
+class GeoDirectoryQuerySet(models.QuerySet):
+    """
+    A queryset able to synchronize many entries with terralego at once.
+
+    The requests are made concurrently by chunks of `TERRALEGO['BULK_CHUNK_SIZE']` objects, using at most
+    `TERRALEGO['MAX_WORKERS']` threads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(GeoDirectoryQuerySet, self).__init__(*args, **kwargs)
+        self._terralego_prefetch = None
+        self._terralego_near = None
+
+    def _clone(self, *args, **kwargs):
+        clone = super(GeoDirectoryQuerySet, self)._clone(*args, **kwargs)
+        clone._terralego_prefetch = self._terralego_prefetch
+        clone._terralego_near = self._terralego_near
+        return clone
+
+    def _is_near(self, geometry):
+        point, radius = self._terralego_near
+        distance = spatial.distance_to_geometry(point, geometry)
+        return distance is not None and distance <= radius
+
+    def _filter_near(self, objs):
+        for obj in objs:
+            if isinstance(obj, dict):
+                geometry = obj.get('terralego_geometry')
+            elif isinstance(obj, GeoDirectoryMixin):
+                geometry = obj.terralego_geometry
+            else:
+                raise TypeError('The distance of near() can only be checked on instances or values() dicts')
+            if self._is_near(geometry):
+                yield obj
+
+    def iterator(self, *args, **kwargs):
+        objs = super(GeoDirectoryQuerySet, self).iterator(*args, **kwargs)
+        return objs if self._terralego_near is None else self._filter_near(objs)
+
+    def _fetch_all(self):
+        prefetch = self._result_cache is None and self._terralego_prefetch is not None
+        if self._result_cache is None and self._terralego_near is not None:
+            # Not every version of Django fetches the results through iterator()
+            self._result_cache = list(self.iterator())
+        super(GeoDirectoryQuerySet, self)._fetch_all()
+        if prefetch:
+            self._prefetch_terralego_entries(self._result_cache, **self._terralego_prefetch)
+
+    def _prefetch_terralego_entries(self, objs, max_workers=None):
+        objs = [obj for obj in objs if isinstance(obj, GeoDirectoryMixin) and obj.terralego_id is not None]
+        if not objs or not conf.TERRALEGO.get('ENABLED', True):
+            return
+        entries = cache.get_entries([obj.terralego_id for obj in objs], max_workers)
+        for obj in objs:
+            data = entries.get(str(obj.terralego_id))
+            if data is not None:
+                obj.update_from_terralego_data(data)
+
+    def __getitem__(self, k):
+        if self._terralego_near is not None:
+            # The distance is not checked by the database, the results cannot be sliced by the query
+            self._fetch_all()
+        return super(GeoDirectoryQuerySet, self).__getitem__(k)
+
+    def count(self):
+        if self._terralego_near is not None:
+            return len(self)
+        return super(GeoDirectoryQuerySet, self).count()
+
+    def exists(self):
+        if self._terralego_near is not None:
+            return bool(self)
+        return super(GeoDirectoryQuerySet, self).exists()
+
+    def _resolve_near(self):
+        # The writes, aggregations and subqueries are done by the database, on the objects at the distance only
+        rows = super(GeoDirectoryQuerySet, self).values_list('pk', 'terralego_geometry')
+        rows._terralego_near = None
+        resolved = self.filter(pk__in=[pk for pk, geometry in rows.iterator() if self._is_near(geometry)])
+        resolved._terralego_near = None
+        return resolved
+
+    def update(self, **kwargs):
+        if self._terralego_near is not None:
+            return self._resolve_near().update(**kwargs)
+        updated = super(GeoDirectoryQuerySet, self).update(**kwargs)
+        bump_generation(self.model, self.db)
+        return updated
+
+    update.alters_data = True
+
+    def aggregate(self, *args, **kwargs):
+        if self._terralego_near is not None:
+            return self._resolve_near().aggregate(*args, **kwargs)
+        return super(GeoDirectoryQuerySet, self).aggregate(*args, **kwargs)
+
+    def values(self, *fields, **expressions):
+        if self._terralego_near is not None and fields and 'terralego_geometry' not in fields:
+            return self._resolve_near().values(*fields, **expressions)
+        return super(GeoDirectoryQuerySet, self).values(*fields, **expressions)
+
+    def values_list(self, *fields, **kwargs):
+        if self._terralego_near is not None:
+            return self._resolve_near().values_list(*fields, **kwargs)
+        return super(GeoDirectoryQuerySet, self).values_list(*fields, **kwargs)
+
+    def latest(self, *args, **kwargs):
+        if self._terralego_near is not None:
+            return self._resolve_near().latest(*args, **kwargs)
+        return super(GeoDirectoryQuerySet, self).latest(*args, **kwargs)
+
+    def earliest(self, *args, **kwargs):
+        if self._terralego_near is not None:
+            return self._resolve_near().earliest(*args, **kwargs)
+        return super(GeoDirectoryQuerySet, self).earliest(*args, **kwargs)
+
+    def _prepare_as_filter_value(self):
+        # Django >= 1.11, the queryset used as a subquery
+        if self._terralego_near is not None:
+            return self._resolve_near()._prepare_as_filter_value()
+        return super(GeoDirectoryQuerySet, self)._prepare_as_filter_value()
+
+    def prefetch_terralego(self, max_workers=None):
+        """
+        Update the objects from their terralego entry when the queryset is evaluated, like `update_from_terralego_entry`
+        without any save.
+
+        The entries are read through the cache configured by `TERRALEGO['CACHE']`, if any, and the misses requested
+        concurrently. The objects without an entry, and those whose entry could not be retrieved, are left unchanged;
+        the errors are logged. `iterator()` does not prefetch the entries.
+
+        :param max_workers: Optional. The maximum number of concurrent requests.
+        """
+        clone = self._clone()
+        clone._terralego_prefetch = {'max_workers': max_workers}
+        return clone
+
+    def _push_to_terralego(self, objs, max_workers):
+        results = run_concurrently(lambda obj: obj.push_to_terralego(), objs, max_workers)
+        failures = []
+        for obj, data, error in results:
+            if error is None:
+                obj._update_from_pushed_data(data)
+            else:
+                failures.append((obj, error))
+        return failures
+
+    def bulk_save_to_terralego(self, objs=None, chunk_size=None, max_workers=None):
+        """
+        Create or update the entries in terralego for many objects.
+
+        Saved objects are written back with one bulk update per chunk. Objects without a geometry are ignored.
+
+        :param objs: Optional. The objects to synchronize, defaults to every object of the queryset with a geometry.
+        :param chunk_size: Optional. The number of objects handled at once.
+        :param max_workers: Optional. The maximum number of concurrent requests.
+        :return: A list of `(obj, exception)` for every object which could not be synchronized.
+        """
+        if not conf.TERRALEGO.get('ENABLED', True):
+            return []
+        chunk_size = chunk_size or conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)
+        max_workers = max_workers or conf.TERRALEGO.get('MAX_WORKERS', 8)
+        if objs is None:
+            objs = self.filter(terralego_geometry__isnull=False).iterator()
+        failures = []
+        for chunk in chunked((obj for obj in objs if obj.terralego_geometry is not None), chunk_size):
+            chunk_failures = self._push_to_terralego(chunk, max_workers)
+            failed = set(id(obj) for obj, error in chunk_failures)
+            synced = [obj for obj in chunk if id(obj) not in failed and obj.pk is not None]
+            bulk_update(self.model, synced, TERRALEGO_FIELDS, using=self.db)
+            TerralegoTag.objects.using(self.db).set_for(synced)
+            failures.extend(chunk_failures)
+            if synced:
+                bump_generation(self.model, self.db)
+        return failures
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create the entries in terralego before inserting the objects.
+
+        You can pass `terralego_commit` at False to skip terralego. Failures are logged, call
+        `bulk_save_to_terralego(objs)` first then `bulk_create(objs, terralego_commit=False)` to handle them yourself.
+        """
+        terralego_commit = kwargs.pop('terralego_commit', True)
+        objs = list(objs)
+        if terralego_commit:
+            for obj, error in self.bulk_save_to_terralego(objs):
+                logger.error('Error while saving to terralego: {0}'.format(error))
+        objs = super(GeoDirectoryQuerySet, self).bulk_create(objs, *args, **kwargs)
+        for chunk in chunked(objs, conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)):
+            TerralegoTag.objects.using(self.db).set_for(chunk)
+        bump_generation(self.model, self.db)
+        return objs
+
+    def refresh_from_terralego(self, chunk_size=None, max_workers=None):
+        """
+        Update the geometry and the tags of the objects from their terralego entry.
+
+        The objects are streamed by chunks and their entries requested concurrently. Only the objects whose geometry
+        or tags changed are written back, with one bulk update per chunk; the `terralego_last_update` of the others
+        is set with a single update per chunk.
+
+        :param chunk_size: Optional. The number of objects handled at once.
+        :param max_workers: Optional. The maximum number of concurrent requests.
+        :return: A tuple `(updated, failures)`, with the number of objects updated and a list of `(obj, exception)`
+                 for every object which could not be retrieved.
+        """
+        if not conf.TERRALEGO.get('ENABLED', True):
+            return 0, []
+        chunk_size = chunk_size or conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)
+        max_workers = max_workers or conf.TERRALEGO.get('MAX_WORKERS', 8)
+        updated = 0
+        failures = []
+        for chunk in chunked(self.filter(terralego_id__isnull=False).iterator(), chunk_size):
+            results = run_concurrently(lambda obj: geodirectory.get_entry(obj.terralego_id), chunk, max_workers)
+            changed = []
+            unchanged = []
+            for obj, data, error in results:
+                if error is not None:
+                    failures.append((obj, error))
+                    continue
+                previous_hash = obj.get_terralego_hash()
+                previous_tags = obj._get_terralego_known_tags()
+                obj.update_from_terralego_data(data)
+                if obj._terralego_hash != previous_hash:
+                    cache.invalidate(obj.terralego_id)
+                    cache.invalidate_closest([(obj.terralego_id, previous_tags | obj._get_terralego_known_tags())])
+                    changed.append(obj)
+                else:
+                    unchanged.append(obj)
+            bulk_update(self.model, changed, TERRALEGO_FIELDS, using=self.db)
+            if unchanged:
+                # Checked, not to be refreshed again by `--older-than`
+                self.model._base_manager.using(self.db).filter(pk__in=[obj.pk for obj in unchanged]).update(
+                    terralego_last_update=unchanged[0].terralego_last_update)
+            TerralegoTag.objects.using(self.db).set_for(changed)
+            if changed:
+                bump_generation(self.model, self.db)
+            updated += len(changed)
+        return updated, failures
+
+    def _delete_from_terralego(self, chunk_size, max_workers):
+        """
+        Delete the entries of the queryset in terralego, by chunks of concurrent requests.
+
+        :return: A tuple `(deleted, failures)`, with the list of `(pk, terralego_id)` deleted and the list of
+                 `(pk, terralego_id, exception)` which could not be deleted.
+        """
+        chunk_size = chunk_size or conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)
+        max_workers = max_workers or conf.TERRALEGO.get('MAX_WORKERS', 8)
+        rows = self.filter(terralego_id__isnull=False).values_list('pk', 'terralego_id', 'terralego_tags').iterator()
+        deleted = []
+        failures = []
+        for chunk in chunked(rows, chunk_size):
+            results = run_concurrently(lambda row: delete_entry(row[1]), chunk, max_workers)
+            for row, data, error in results:
+                if error is None:
+                    deleted.append(row[:2])
+                else:
+                    failures.append(row[:2] + (error,))
+            cache.invalidate_many(terralego_id for pk, terralego_id, tags in chunk)
+            cache.invalidate_closest((terralego_id, load_tags(tags)) for pk, terralego_id, tags in chunk)
+        return deleted, failures
+
+    def delete_from_terralego(self, chunk_size=None, max_workers=None, set_id_null=True):
+        """
+        Delete the entries of the queryset in terralego, the objects being kept in the database.
+
+        :param chunk_size: Optional. The number of entries handled at once.
+        :param max_workers: Optional. The maximum number of concurrent requests.
+        :param set_id_null: Null the `terralego_id` of the objects whose entry was deleted, with one update per chunk.
+        :return: A list of `(terralego_id, exception)` for every entry which could not be deleted.
+        """
+        if not conf.TERRALEGO.get('ENABLED', True):
+            return []
+        if self._terralego_near is not None:
+            return self._resolve_near().delete_from_terralego(chunk_size, max_workers, set_id_null)
+        deleted, failures = self._delete_from_terralego(chunk_size, max_workers)
+        if set_id_null:
+            for chunk in chunked(deleted, chunk_size or conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)):
+                self.model._base_manager.using(self.db).filter(pk__in=[pk for pk, terralego_id in chunk]).update(
+                    terralego_id=None)
+                TerralegoTag.objects.using(self.db).filter(
+                    terralego_id__in=[terralego_id for pk, terralego_id in chunk]).delete()
+                bump_generation(self.model, self.db)
+        return [(terralego_id, error) for pk, terralego_id, error in failures]
+
+    def unlink_from_terralego(self):
+        """
+        Null the `terralego_id` of the objects with a single update, their entries being kept in terralego.
+
+        :return: The number of objects unlinked.
+        """
+        if self._terralego_near is not None:
+            return self._resolve_near().unlink_from_terralego()
+        with transaction.atomic(using=self.db):
+            TerralegoTag.objects.using(self.db).filter(
+                terralego_id__in=self.filter(terralego_id__isnull=False).values('terralego_id')).delete()
+            return self.filter(terralego_id__isnull=False).update(terralego_id=None)
+
+    def delete(self, terralego_commit=True):
+        """
+        Delete the entries of the objects in terralego before deleting the objects.
+
+        In deferred mode, the deletions are written to the outbox instead. Failures are logged, call
+        `delete_from_terralego()` first then `delete(terralego_commit=False)` to handle them yourself. The entries not
+        deleted because the circuit breaker is open are written to the outbox.
+        """
+        if self._terralego_near is not None:
+            return self._resolve_near().delete(terralego_commit)
+        if terralego_commit and conf.TERRALEGO.get('ENABLED', True):
+            if conf.TERRALEGO.get('DEFERRED', False):
+                with transaction.atomic(using=self.db):
+                    # Including the objects without entry, which may be created by a pending save
+                    TerralegoOutbox.objects.using(self.db).enqueue_many(
+                        self.model, self.select_for_update().values_list('pk', 'terralego_id'),
+                        TerralegoOutbox.DELETE)
+                    return self._delete_with_tags()
+            deleted, failures = self._delete_from_terralego(None, None)
+            reconcile = []
+            for pk, terralego_id, error in failures:
+                if isinstance(error, CircuitOpenError):
+                    reconcile.append((pk, terralego_id))
+                else:
+                    logger.error('Error while deleting {0} from terralego: {1}'.format(terralego_id, error))
+            with transaction.atomic(using=self.db):
+                TerralegoOutbox.objects.using(self.db).enqueue_many(self.model, reconcile, TerralegoOutbox.DELETE)
+                return self._delete_with_tags()
+        return self._delete_with_tags()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def _delete_with_tags(self):
+        with transaction.atomic(using=self.db):
+            TerralegoTag.objects.using(self.db).filter(
+                terralego_id__in=self.filter(terralego_id__isnull=False).values('terralego_id')).delete()
+            deleted = super(GeoDirectoryQuerySet, self).delete()
+            bump_generation(self.model, self.db)
+            return deleted
+
+    def with_tags(self, tags):
+        """
+        Filter the objects whose entry has all the tags, using the indexed `TerralegoTag` table.
+        """
+        queryset = self
+        for tag in tags:
+            queryset = queryset.filter(
+                terralego_id__in=TerralegoTag.objects.using(self.db).filter(tag=tag).values('terralego_id'))
+        return queryset
+
+    def with_any_tags(self, tags):
+        """
+        Filter the objects whose entry has at least one of the tags, using the indexed `TerralegoTag` table.
+        """
+        return self.filter(
+            terralego_id__in=TerralegoTag.objects.using(self.db).filter(tag__in=tags).values('terralego_id'))
+
+    def index_terralego_tags(self, chunk_size=None):
+        """
+        Fill the `TerralegoTag` table with the tags of the objects, e.g. for the rows synced before it existed.
+        """
+        if self._terralego_near is not None:
+            return self._resolve_near().index_terralego_tags(chunk_size)
+        queryset = self.filter(terralego_id__isnull=False).only('terralego_id', 'terralego_tags')
+        for chunk in chunked(queryset.iterator(), chunk_size or conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)):
+            TerralegoTag.objects.using(self.db).set_for(chunk)
+
+    def in_bbox(self, min_x, min_y, max_x, max_y):
+        """
+        Filter the objects whose bounding box intersects the given one, using the indexed bounding box columns.
+        """
+        return self.filter(
+            terralego_max_x__gte=min_x,
+            terralego_min_x__lte=max_x,
+            terralego_max_y__gte=min_y,
+            terralego_min_y__lte=max_y,
+        )
+
+    def near(self, point, radius):
+        """
+        Filter the objects whose geometry is at most at `radius` meters from `point`.
+
+        The objects are filtered on their bounding box with the database indexes, the distance to their geometry is
+        checked when they are fetched. The queryset stays lazy, but the methods done by the database, e.g. `count()`,
+        slicing, `aggregate()`, `update()`, `delete()`, `values_list()`, `values()` without `terralego_geometry` or
+        its use as a subquery, first query the geometries to filter the objects by primary key.
+
+        :param point: A `(longitude, latitude)` tuple.
+        :param radius: The distance in meters.
+        """
+        longitude, latitude = point
+        delta_y = math.degrees(radius / spatial.EARTH_RADIUS)
+        delta_x = min(delta_y / max(math.cos(math.radians(latitude)), 1e-6), 360)
+        clone = self.in_bbox(longitude - delta_x, latitude - delta_y, longitude + delta_x, latitude + delta_y)
+        clone._terralego_near = (point, radius)
+        return clone
+
+    def _closest_from_terralego(self, objs, tags, max_workers):
+        results = run_concurrently(lambda obj: cache.get_closest(obj.terralego_id, tags), objs, max_workers)
+        entries = []
+        for obj, entry, error in results:
+            if error is not None:
+                logger.error('Error while getting closest: {0}'.format(error))
+            elif entry:
+                entries.append(entry)
+        instances = iter(convert_geodirectory_entries(entries))
+        return [[next(instances)] if error is None and entry else [] for obj, entry, error in results]
+
+    def iter_closest(self, tags=None, k=1, chunk_size=None, max_workers=None):
+        """
+        Get the closest entries of every object, streamed by chunks.
+
+        With the remote backend, the closest requests of a chunk are made concurrently and their entries converted
+        with one query per model; terralego only returns the closest entry, so there is at most one neighbour. With
+        `TERRALEGO['CLOSEST_BACKEND']` at `local`, the k nearest entries are searched in the local index.
+
+        :param tags: Optional. A list of tags to filter the entries on which the request is made.
+        :param k: The maximum number of neighbours of each object.
+        :param chunk_size: Optional. The number of objects handled at once.
+        :param max_workers: Optional. The maximum number of concurrent requests.
+        :return: An iterator of `(obj, neighbours)`, `neighbours` being a list sorted by distance of instances of
+                 GeoDirectoryMixin, or dicts describing the entries which are not. The failures are logged and
+                 have no neighbour.
+        """
+        chunk_size = chunk_size or conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500)
+        max_workers = max_workers or conf.TERRALEGO.get('MAX_WORKERS', 8)
+        local = conf.TERRALEGO.get('CLOSEST_BACKEND', 'remote') == 'local'
+        for chunk in chunked(self.filter(terralego_id__isnull=False).iterator(), chunk_size):
+            if local:
+                neighbours = spatial.closest_many(chunk, tags, k)
+            else:
+                neighbours = self._closest_from_terralego(chunk, tags, max_workers)
+            for obj, obj_neighbours in zip(chunk, neighbours):
+                yield obj, obj_neighbours
+
+    def closest_many(self, tags=None, k=1, chunk_size=None, max_workers=None):
+        """
+        Get the closest entries of every object, see `iter_closest`.
+
+        :return: A dict of the neighbours by object.
+        """
+        return dict(self.iter_closest(tags, k, chunk_size, max_workers))
+
+
+GeoDirectoryManager = models.Manager.from_queryset(GeoDirectoryQuerySet)
+
 
 class GeoDirectoryMixin(models.Model):
     """
     A model with a corresponding entry in Terralego.
 
-    The entry will be updated at every save.
+    The entry will be updated at every save changing the geometry or the tags.
     You can pass `terralego_commit` at False to force not updating the entry.
 
     This model is designed to be one-way only. This means that it won't update from terralego automatically.
     If you update the entry from somewhere else, you will have to call `_update_from_terralego_entry` manually.
     """
 
-    terralego_id = models.UUIDField(verbose_name=_('Terralego id'), editable=False, null=True)
+    terralego_id = models.UUIDField(verbose_name=_('Terralego id'), editable=False, null=True, db_index=True)
     terralego_last_update = models.DateTimeField(_('Terralego last update'), editable=False, null=True)
-    terralego_geometry = GeometryField(_('Terralego geometry field'), blank=True, null=True)
+    terralego_geometry = LazyGeometryField(_('Terralego geometry field'), blank=True, null=True)
     terralego_tags = models.TextField(_('Terralego tags'), blank=True, null=True)  # JSON list of tags
+    terralego_min_x = models.FloatField(_('Terralego bbox min x'), editable=False, null=True, db_index=True)
+    terralego_min_y = models.FloatField(_('Terralego bbox min y'), editable=False, null=True, db_index=True)
+    terralego_max_x = models.FloatField(_('Terralego bbox max x'), editable=False, null=True, db_index=True)
+    terralego_max_y = models.FloatField(_('Terralego bbox max y'), editable=False, null=True, db_index=True)
+
+    # Reduction of the geometries sent to terralego, see django_terralego.simplify. It requires numpy.
+    terralego_simplify_tolerance = None  # Maximum distance to the original lines, in degrees
+    terralego_max_vertices = None  # Maximum number of positions
+    terralego_precision = None  # Number of decimals of the coordinates
+    terralego_simplify_storage = False  # Also store the reduced geometry instead of the original one
+
+    objects = GeoDirectoryManager()
 
     class Meta:
         abstract = True
 
     # Save/update handling
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(GeoDirectoryMixin, cls).from_db(db, field_names, values)
+        if 'terralego_geometry' in instance.__dict__ and 'terralego_tags' in instance.__dict__:
+            # The hash is computed on the first dirty check, the geometry not being decoded until then
+            instance._terralego_loaded = (instance.__dict__['terralego_geometry'], instance.terralego_tags)
+        if 'terralego_id' in instance.__dict__ and 'terralego_tags' in instance.__dict__:
+            instance._terralego_indexed = instance._get_terralego_indexed()
+        if all(field in instance.__dict__ for field in TERRALEGO_BBOX_FIELDS):
+            # The tiles of the previous bounding box are invalidated on save, see django_terralego.tiles
+            bbox = tuple(instance.__dict__[field] for field in TERRALEGO_BBOX_FIELDS)
+            instance._terralego_loaded_bbox = None if None in bbox else bbox
+        return instance
+
+    def get_terralego_tags(self):
+        """
+        Get the list of tags, `terralego_tags` being parsed only once per value.
+        """
+        cached = getattr(self, '_terralego_tags_cache', None)
+        if cached is None or cached[0] != self.terralego_tags:
+            cached = (self.terralego_tags, self.terralego_tags and json.loads(self.terralego_tags) or [])
+            self._terralego_tags_cache = cached
+        return list(cached[1])
+
+    def _get_terralego_known_tags(self):
+        """
+        Get the tags which may be those of the entry in terralego: the last indexed ones and the current ones.
+        """
+        tags = set()
+        for value in (getattr(self, '_terralego_indexed', (None, None))[1], self.terralego_tags):
+            tags.update(load_tags(value) or [])
+        return tags
+
+    def _get_terralego_reduction(self):
+        options = (self.terralego_simplify_tolerance, self.terralego_max_vertices, self.terralego_precision)
+        return None if options == (None, None, None) else options
+
+    def reduce_terralego_geometry(self, geometry, report=False):
+        """
+        Reduce a geojson geometry following the `terralego_simplify_tolerance`, `terralego_max_vertices` and
+        `terralego_precision` options of the model.
+
+        :param report: Count the vertices before and after in `django_terralego.stats.counters`, as
+                       `simplify_vertices_in` and `simplify_vertices_out`.
+        :return: The reduced geometry, or the geometry itself if there is nothing to do.
+        """
+        options = self._get_terralego_reduction()
+        loaded = load_geometry(geometry) if options else None
+        if loaded is None:
+            # Nothing to do, or e.g. a WKT geometry
+            return geometry
+        reduced = simplify.reduce_geometry(loaded, *options)
+        if report:
+            vertices_in, vertices_out = simplify.count_vertices(loaded), simplify.count_vertices(reduced)
+            counters.incr('simplify_vertices_in', vertices_in)
+            counters.incr('simplify_vertices_out', vertices_out)
+            logger.debug('Geometry of {0} reduced from {1} to {2} vertices'.format(self, vertices_in, vertices_out))
+        return reduced
+
+    def get_terralego_hash(self):
+        """
+        Get a hash of the geometry and the tags, as they would be sent to terralego.
+        """
+        return self._get_terralego_hash(self.terralego_geometry, self.get_terralego_tags())
+
+    def _get_terralego_hash(self, geometry, tags):
+        tags = self._update_tags_with_model(tags)
+        content = json.dumps([self._get_terralego_geometry_content(geometry), tags], sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _get_terralego_geometry_content(self, geometry):
+        # The reduction of the last geometry is memoized by its content and the options, for the dirty checks
+        content = json.dumps(geometry, sort_keys=True)
+        options = self._get_terralego_reduction()
+        if options is None:
+            return content
+        key = (hashlib.sha1(content.encode('utf-8')).hexdigest(), options)
+        reduced = getattr(self, '_terralego_reduced', None)
+        if reduced is None or reduced[0] != key:
+            reduced = self._terralego_reduced = (
+                key, json.dumps(self.reduce_terralego_geometry(geometry), sort_keys=True))
+        return reduced[1]
+
+    def terralego_is_dirty(self):
+        """
+        Return True if the geometry or the tags changed since the instance was loaded or synced with terralego.
+        """
+        if self.terralego_id is None:
+            return True
+        loaded = getattr(self, '_terralego_loaded', None)
+        if loaded is not None:
+            geometry, tags = loaded
+            if self.__dict__.get('terralego_geometry') is geometry and self.terralego_tags == tags:
+                # Neither assigned nor decoded since loaded
+                return False
+            self._terralego_hash = self._get_terralego_hash(
+                geometry if geometry is None else load_geometry(geometry), tags and json.loads(tags) or [])
+            self._terralego_loaded = None
+        return getattr(self, '_terralego_hash', None) != self.get_terralego_hash()
+
     def update_from_terralego_data(self, data):
         """
         Set self.geometry and self.tags with the values in data and cache it.
@@ -45,6 +640,23 @@ class GeoDirectoryMixin(models.Model):
         self.terralego_last_update = timezone.now()
         self.terralego_geometry = data['geometry']
         self.terralego_tags = json.dumps(data['properties']['tags'])
+        self.update_terralego_bbox(data.get('bbox'))
+        self._terralego_hash = self.get_terralego_hash()
+        self._terralego_loaded = None
+
+    def update_terralego_bbox(self, bbox=None):
+        """
+        Set the bounding box columns, computing the bounding box from the geometry if not given.
+
+        :param bbox: Optional. A `[min_x, min_y, max_x, max_y]` list.
+        """
+        if bbox is None:
+            bbox = spatial.get_bbox(self.terralego_geometry)
+            if bbox is None and self.terralego_geometry is not None:
+                # e.g. a WKT geometry, the bounding box will be set from the terralego response
+                return
+        for field, value in zip(TERRALEGO_BBOX_FIELDS, bbox or (None,) * 4):
+            setattr(self, field, value)
 
     def _update_tags_with_model(self, tags):
         model_path = '{0}.{1}'.format(self._meta.app_label, self._meta.object_name)
@@ -62,61 +674,476 @@ class GeoDirectoryMixin(models.Model):
     def update_from_terralego_entry(self):
         """
         Get the terralego entry related to self.terralego_id and update the instance tags and geometry.
+
+        The entry is read through the cache configured by `TERRALEGO['CACHE']`, if any.
         """
         if self.terralego_id is not None and conf.TERRALEGO.get('ENABLED', True):
-            data = geodirectory.get_entry(self.terralego_id)
+            data = cache.get_entry(self.terralego_id)
             self.update_from_terralego_data(data)
 
-    def save_to_terralego(self):
+    def _prepare_terralego_tags(self):
+        tags = self._update_tags_with_model(self.get_terralego_tags())
+        self.terralego_tags = json.dumps(tags)  # Save tags in case of error before the update_from_terralego_data
+        return tags
+
+    def _prepare_terralego_push(self):
+        """
+        :return: A tuple `(geometry, tags, previous_tags)`: the geometry and the tags to send, and the tags known
+                 before.
+        """
+        previous_tags = self._get_terralego_known_tags()
+        tags = self._prepare_terralego_tags()
+        return self.reduce_terralego_geometry(self.terralego_geometry, report=True), tags, previous_tags
+
+    def _invalidate_pushed_entry(self, data, tags, previous_tags):
+        # Before the instance is updated from the response, an updated entry has its previous id
+        if self.terralego_id is not None:
+            cache.invalidate(self.terralego_id)
+        cache.invalidate_closest([(data['id'], previous_tags.union(tags))])
+
+    def _invalidate_deleted_entry(self):
+        cache.invalidate(self.terralego_id)
+        cache.invalidate_closest([(self.terralego_id, self._get_terralego_known_tags())])
+
+    def push_to_terralego(self):
         """
         Create or update the entry in terralego, adding the model_path to the tags if needed.
+
+        Unlike `save_to_terralego`, the instance geometry is not updated with the response.
+
+        :return: the geojson representing the entry
         """
-        tags = self.terralego_tags and json.loads(self.terralego_tags) or None
-        tags = self._update_tags_with_model(tags)
-        self.terralego_tags = json.dumps(tags)  # Save tags in case of error before the update_from_terralego_data
+        geometry, tags, previous_tags = self._prepare_terralego_push()
         if self.terralego_id is None:
-            data = geodirectory.create_entry(self.terralego_geometry, tags)
+            data = geodirectory.create_entry(geometry, tags)
         else:
-            data = geodirectory.update_entry(self.terralego_id, self.terralego_geometry, tags)
+            data = geodirectory.update_entry(self.terralego_id, geometry, tags)
+        self._invalidate_pushed_entry(data, tags, previous_tags)
+        return data
+
+    def _update_from_pushed_data(self, data):
+        """
+        Like `update_from_terralego_data`, keeping the original geometry if it was reduced before being sent, unless
+        `terralego_simplify_storage` is set.
+        """
+        geometry = self.terralego_geometry
         self.update_from_terralego_data(data)
+        reduced = self._get_terralego_reduction() and load_geometry(geometry) is not None
+        if reduced and not self.terralego_simplify_storage:
+            self.terralego_geometry = geometry
+            self.update_terralego_bbox()
+            self._terralego_hash = self.get_terralego_hash()
+
+    def save_to_terralego(self):
+        """
+        Create or update the entry in terralego, adding the model_path to the tags if needed.
+        """
+        data = self.push_to_terralego()
+        self._update_from_pushed_data(data)
 
     def delete_from_terralego(self, set_id_null=True):
         """
         Delete the entry in terralego
         """
         geodirectory.delete_entry(self.terralego_id)
+        self._invalidate_deleted_entry()
         if set_id_null:
-            self.terralego_id = None
-            self.save(terralego_commit=False)
+            self._unset_terralego_id()
+
+    def _unset_terralego_id(self):
+        # Only the id column and the tags index are written, the other fields may have unsaved changes
+        terralego_id, self.terralego_id = self.terralego_id, None
+        if self.pk is not None:
+            using = router.db_for_write(self.__class__, instance=self)
+            self.__class__._base_manager.using(using).filter(pk=self.pk).update(terralego_id=None)
+            TerralegoTag.objects.using(using).filter(terralego_id=terralego_id).delete()
+            bump_generation(self.__class__, using)
+            self._terralego_indexed = self._get_terralego_indexed()
+
+    def _get_terralego_indexed(self):
+        return self.terralego_id and str(self.terralego_id), self.terralego_tags
+
+    def _index_terralego_tags(self, using):
+        """
+        Update the `TerralegoTag` rows of the instance if its id or tags changed since the last time.
+        """
+        previous_id, previous_tags = getattr(self, '_terralego_indexed', (None, None))
+        indexed = self._get_terralego_indexed()
+        if indexed == (previous_id, previous_tags):
+            return
+        tags = TerralegoTag.objects.using(using)
+        if previous_id and previous_id != indexed[0]:
+            tags.filter(terralego_id=previous_id).delete()
+        tags.set_for([self])
+        self._terralego_indexed = indexed
 
     def delete(self, *args, **kwargs):
-        if self.terralego_id:
-            try:
-                self.delete_from_terralego(set_id_null=False)
-            except RequestException as e:
-                logger.error('Error while deleting from terralego: {0}'.format(e))
-        return super(GeoDirectoryMixin, self).delete(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        if conf.TERRALEGO.get('DEFERRED', False):
+            with transaction.atomic(using=using):
+                # The entry may have been created by the worker since the instance was read, or be created by a
+                # pending save: the worker then resolves it
+                terralego_id = self.__class__._base_manager.using(using).select_for_update().filter(
+                    pk=self.pk).values_list('terralego_id', flat=True).first() or self.terralego_id
+                TerralegoOutbox.objects.using(using).enqueue_many(
+                    self.__class__, [(self.pk, terralego_id)], TerralegoOutbox.DELETE)
+                if terralego_id:
+                    TerralegoTag.objects.using(using).filter(terralego_id=terralego_id).delete()
+                return self._delete_row(using, *args, **kwargs)
+        if not self.terralego_id:
+            unit = unitofwork.get_current(using, create=False)
+            if unit is not None:
+                # Cancels the pending create of the instance
+                unit.record_delete(self)
+            return self._delete_row(using, *args, **kwargs)
+        unit = unitofwork.get_current(using)
+        if unit is not None:
+            # Deleted from terralego after the commit
+            unit.record_delete(self)
+            TerralegoTag.objects.using(using).filter(terralego_id=self.terralego_id).delete()
+            return self._delete_row(using, *args, **kwargs)
+        try:
+            self.delete_from_terralego(set_id_null=False)
+        except CircuitOpenError:
+            # Reconciled by the terralego_sync command
+            TerralegoOutbox.objects.using(using).enqueue(self, TerralegoOutbox.DELETE)
+        except RequestException as e:
+            logger.error('Error while deleting from terralego: {0}'.format(e))
+        TerralegoTag.objects.using(using).filter(terralego_id=self.terralego_id).delete()
+        return self._delete_row(using, *args, **kwargs)
+
+    def _delete_row(self, using, *args, **kwargs):
+        deleted = super(GeoDirectoryMixin, self).delete(*args, **kwargs)
+        bump_generation(self.__class__, using)
+        return deleted
+
+    def save_base(self, *args, **kwargs):
+        # Every save of the row, whatever the path in save()
+        super(GeoDirectoryMixin, self).save_base(*args, **kwargs)
+        bump_generation(self.__class__, kwargs.get('using') or router.db_for_write(self.__class__, instance=self))
+
+    def _should_save_to_terralego(self, update_fields):
+        if get_raw_value(self, 'terralego_geometry') is None or not conf.TERRALEGO.get('ENABLED', True):
+            return False
+        if update_fields is not None and not {'terralego_geometry', 'terralego_tags'} & set(update_fields):
+            # Neither the geometry nor the tags will be written
+            return False
+        if not self.terralego_is_dirty():
+            counters.incr('sync_skipped')
+            return False
+        return True
 
     def save(self, *args, **kwargs):
         terralego_commit = kwargs.pop('terralego_commit', True)
-        if terralego_commit and self.terralego_geometry is not None and conf.TERRALEGO.get('ENABLED', True):
-            try:
-                self.save_to_terralego()
-            except RequestException as e:
-                logger.error('Error while saving to terralego: {0}'.format(e))
-        return super(GeoDirectoryMixin, self).save(*args, **kwargs)
+        reconcile = False
+        unit = None
+        if self.terralego_simplify_storage and self.terralego_is_dirty():
+            self.terralego_geometry = self.reduce_terralego_geometry(self.terralego_geometry)
+        if self.terralego_min_x is None or self.terralego_is_dirty():
+            self.update_terralego_bbox()
+            if 'terralego_geometry' in (kwargs.get('update_fields') or ()):
+                kwargs['update_fields'] = set(kwargs['update_fields']) | set(TERRALEGO_BBOX_FIELDS)
+        if terralego_commit and self._should_save_to_terralego(kwargs.get('update_fields')):
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | set(TERRALEGO_FIELDS)
+            if conf.TERRALEGO.get('DEFERRED', False):
+                # The outbox row is written in the same transaction, the terralego_sync command will do the request
+                using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+                with transaction.atomic(using=using):
+                    super(GeoDirectoryMixin, self).save(*args, **kwargs)
+                    TerralegoOutbox.objects.using(using).enqueue(self, TerralegoOutbox.SAVE)
+                    self._index_terralego_tags(using)
+                return
+            unit = unitofwork.get_current(kwargs.get('using') or router.db_for_write(self.__class__, instance=self))
+            if unit is None:
+                try:
+                    self.save_to_terralego()
+                except CircuitOpenError:
+                    counters.incr('sync_failed')
+                    reconcile = True
+                except RequestException as e:
+                    counters.incr('sync_failed')
+                    logger.error('Error while saving to terralego: {0}'.format(e))
+                else:
+                    counters.incr('sync_performed')
+        super(GeoDirectoryMixin, self).save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        if unit is not None:
+            # Saved to terralego after the commit, merged with the other saves of the transaction
+            unit.record_save(self)
+        if reconcile:
+            # Terralego was not requested, the terralego_sync command will do it
+            TerralegoOutbox.objects.using(using).enqueue(self, TerralegoOutbox.SAVE)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'terralego_id', 'terralego_tags'} & set(update_fields):
+            self._index_terralego_tags(using)
+
+    # Asyncio counterparts, see django_terralego.aio
+
+    async def aupdate_from_terralego_entry(self):
+        """
+        Like `update_from_terralego_entry`, without blocking the event loop.
+        """
+        if self.terralego_id is not None and conf.TERRALEGO.get('ENABLED', True):
+            data = await aio.get_cached_entry(self.terralego_id)
+            self.update_from_terralego_data(data)
+
+    async def asave_to_terralego(self):
+        """
+        Like `save_to_terralego`, without blocking the event loop. The instance is not saved in the database, the cache
+        is invalidated from a thread.
+        """
+        geometry, tags, previous_tags = self._prepare_terralego_push()
+        if self.terralego_id is None:
+            data = await aio.create_entry(geometry, tags)
+        else:
+            data = await aio.update_entry(self.terralego_id, geometry, tags)
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._invalidate_pushed_entry, data, tags, previous_tags)
+        self._update_from_pushed_data(data)
+
+    async def adelete_from_terralego(self, set_id_null=True):
+        """
+        Like `delete_from_terralego`, without blocking the event loop. The cache and the database are updated from a
+        thread.
+        """
+        await aio.delete_entry(self.terralego_id)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._invalidate_deleted_entry)
+        if set_id_null:
+            await loop.run_in_executor(None, self._unset_terralego_id)
+
+    async def aclosest(self, tags=None):
+        """
+        Like `closest`, without blocking the event loop. The database is queried from a thread.
+        """
+        loop = asyncio.get_event_loop()
+        if conf.TERRALEGO.get('CLOSEST_BACKEND', 'remote') == 'local':
+            instances = await loop.run_in_executor(None, spatial.closest, self, tags)
+            return instances[0] if instances else None
+        try:
+            entry = await aio.get_cached_closest(self.terralego_id, tags)
+        except RequestException as e:
+            return logger.error('Error while getting closest: {0}'.format(e))
+        return await loop.run_in_executor(None, convert_geodirectory_entry_to_model_instance, entry)
 
     # Geodirectory methods
 
     def closest(self, tags=None):
         """
         Get the closest entry of this entry.
-        
+
+        When `TERRALEGO['CLOSEST_BACKEND']` is `local`, the entry is searched in a local index of the synced
+        instances instead, without any request to terralego.
+
         :param tags: Optional. A list of tags to filter the entries on which the request is made.
         :return: An instance of GeoDirectoryMixin if the entry is one, or a dict describing the entry.
         """
+        if conf.TERRALEGO.get('CLOSEST_BACKEND', 'remote') == 'local':
+            instances = spatial.closest(self, tags)
+            return instances[0] if instances else None
         try:
-            entry = geodirectory.closest(self.terralego_id, tags)
+            entry = cache.get_closest(self.terralego_id, tags)
         except RequestException as e:
             return logger.error('Error while getting closest: {0}'.format(e))
         return convert_geodirectory_entry_to_model_instance(entry)
+
+
+def bump_generation(model, using):
+    """
+    Increment the generation of a GeoDirectoryMixin model after the commit of the current transaction, see
+    `TerralegoGeneration`.
+    """
+    bump = partial(TerralegoGeneration.objects.db_manager(using).bump, model)
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(bump, using=using)
+    else:
+        # Django < 1.9, the row stays locked until the commit
+        bump()
+
+
+class TerralegoGenerationQuerySet(models.QuerySet):
+
+    def bump(self, model):
+        """
+        Increment the generation of a model, creating it if needed.
+        """
+        content_type = ContentType.objects.db_manager(self.db).get_for_model(model)
+        changes = {'generation': models.F('generation') + 1, 'modified': timezone.now()}
+        if self.filter(content_type=content_type).update(**changes):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(content_type=content_type, generation=1, modified=changes['modified'])
+        except IntegrityError:
+            # Created concurrently
+            self.filter(content_type=content_type).update(**changes)
+
+    def get_for(self, model):
+        """
+        :return: A tuple `(generation, modified)` of a model, `(0, None)` if its objects were never written.
+        """
+        content_type = ContentType.objects.db_manager(self.db).get_for_model(model)
+        return self.filter(content_type=content_type).values_list('generation', 'modified').first() or (0, None)
+
+
+class TerralegoGeneration(models.Model):
+    """
+    A counter of the writes of the objects of a GeoDirectoryMixin model, incremented after the commit of every save and
+    delete of its instances and every write of its querysets. It versions the collections served by
+    `django_terralego.views.GeoJSONView`.
+    """
+    content_type = models.OneToOneField(ContentType, on_delete=models.CASCADE)
+    generation = models.BigIntegerField(_('Generation'), default=0)
+    modified = models.DateTimeField(_('Modified'), null=True)
+
+    objects = TerralegoGenerationQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Terralego generation')
+        verbose_name_plural = _('Terralego generations')
+
+    def __str__(self):
+        return '{0} {1}'.format(self.content_type_id, self.generation)
+
+
+class TerralegoOutboxQuerySet(models.QuerySet):
+
+    def enqueue(self, instance, operation):
+        """
+        Record an operation to do in terralego for `instance`.
+
+        :param instance: A saved instance of GeoDirectoryMixin.
+        :param operation: `TerralegoOutbox.SAVE` or `TerralegoOutbox.DELETE`.
+        """
+        return self.create(
+            content_type=ContentType.objects.db_manager(self.db).get_for_model(instance),
+            object_id=str(instance.pk),
+            operation=operation,
+            terralego_id=instance.terralego_id,
+        )
+
+    def enqueue_many(self, model, rows, operation):
+        """
+        Record an operation to do in terralego for many objects at once.
+
+        :param model: A subclass of GeoDirectoryMixin.
+        :param rows: An iterable of `(pk, terralego_id)`.
+        :param operation: `TerralegoOutbox.SAVE` or `TerralegoOutbox.DELETE`.
+        """
+        content_type = ContentType.objects.db_manager(self.db).get_for_model(model)
+        return self.bulk_create([
+            TerralegoOutbox(
+                content_type=content_type, object_id=str(pk), operation=operation, terralego_id=terralego_id)
+            for pk, terralego_id in rows
+        ], batch_size=conf.TERRALEGO.get('BULK_CHUNK_SIZE', 500))
+
+    def ready(self):
+        now = timezone.now()
+        return self.filter(
+            models.Q(claimed_until__isnull=True) | models.Q(claimed_until__lte=now),
+            next_attempt__lte=now,
+            attempts__lt=conf.TERRALEGO.get('OUTBOX_MAX_ATTEMPTS', 10),
+        )
+
+    def dead(self):
+        """
+        The operations given up after `TERRALEGO['OUTBOX_MAX_ATTEMPTS']` failures. Reset their attempts to retry them.
+        """
+        return self.filter(attempts__gte=conf.TERRALEGO.get('OUTBOX_MAX_ATTEMPTS', 10))
+
+
+class TerralegoOutbox(models.Model):
+    """
+    An operation to do in terralego, written in the same transaction as the instance when `TERRALEGO['DEFERRED']` is
+    True.
+
+    The rows are processed by the `terralego_sync` management command.
+    """
+    SAVE = 'save'
+    DELETE = 'delete'
+    OPERATIONS = (
+        (SAVE, _('Save')),
+        (DELETE, _('Delete')),
+    )
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(_('Object id'), max_length=255)
+    operation = models.CharField(_('Operation'), max_length=6, choices=OPERATIONS)
+    terralego_id = models.UUIDField(verbose_name=_('Terralego id'), null=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    next_attempt = models.DateTimeField(_('Next attempt'), default=timezone.now, db_index=True)
+    last_error = models.TextField(_('Last error'), blank=True)
+    claimed_until = models.DateTimeField(_('Claimed until'), null=True, blank=True)  # By a worker processing it
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+
+    objects = TerralegoOutboxQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('pk',)
+        index_together = (('content_type', 'object_id'),)
+        verbose_name = _('Terralego outbox operation')
+        verbose_name_plural = _('Terralego outbox operations')
+
+    def __str__(self):
+        return '{0} {1}.{2}'.format(self.operation, self.content_type_id, self.object_id)
+
+
+class TerralegoImportChunk(models.Model):
+    """
+    A chunk of features inserted by the `import_geodirectory` command, written in the same transaction as its objects
+    so that a resumed import skips exactly the chunks inserted.
+    """
+    checkpoint = models.CharField(_('Checkpoint'), max_length=255, db_index=True)
+    source = models.TextField(_('Source'))
+    start = models.BigIntegerField(_('Start'))  # Offsets in bytes of the features in the source
+    end = models.BigIntegerField(_('End'))
+    count = models.PositiveIntegerField(_('Count'))
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+
+    class Meta:
+        ordering = ('checkpoint', 'start')
+        verbose_name = _('Terralego import chunk')
+        verbose_name_plural = _('Terralego import chunks')
+
+    def __str__(self):
+        return '{0} {1}-{2}'.format(self.checkpoint, self.start, self.end)
+
+
+class TerralegoTagQuerySet(models.QuerySet):
+
+    def set_for(self, objs):
+        """
+        Replace the tags of the entries of the given GeoDirectoryMixin instances.
+        """
+        objs = [obj for obj in objs if obj.terralego_id is not None]
+        if not objs:
+            return
+        self.filter(terralego_id__in=[obj.terralego_id for obj in objs]).delete()
+        self.bulk_create([
+            TerralegoTag(terralego_id=obj.terralego_id, tag=tag)
+            for obj in objs
+            for tag in set(obj.get_terralego_tags())
+        ])
+        for obj in objs:
+            obj._terralego_indexed = obj._get_terralego_indexed()
+
+
+class TerralegoTag(models.Model):
+    """
+    A tag of a terralego entry, kept in sync with the `terralego_tags` of the GeoDirectoryMixin instances so the
+    entries can be filtered by tag with an index.
+    """
+    terralego_id = models.UUIDField(verbose_name=_('Terralego id'))
+    tag = models.CharField(_('Tag'), max_length=255)
+
+    objects = TerralegoTagQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (('terralego_id', 'tag'),)
+        index_together = (('tag', 'terralego_id'),)
+        verbose_name = _('Terralego tag')
+        verbose_name_plural = _('Terralego tags')
+
+    def __str__(self):
+        return self.tag
@@ -0,0 +1,155 @@
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from requests import RequestException
+
+from django_terralego import cache, conf
+from django_terralego.models import TERRALEGO_FIELDS, TerralegoOutbox, delete_entry
+
+logger = logging.getLogger(__name__)
+
+
+def get_backoff(attempts):
+    """
+    Get the delay before the next attempt of an operation which failed `attempts` times.
+    """
+    base = conf.TERRALEGO.get('OUTBOX_BACKOFF', 30)
+    maximum = conf.TERRALEGO.get('OUTBOX_MAX_BACKOFF', 3600)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), maximum))
+
+
+def apply_operation(operation):
+    """
+    Do the request in terralego for an outbox operation, outside of any transaction.
+
+    :return: For a save, a tuple `(instance, read_hash)`: the instance updated from the response, and its terralego hash
+             when it was read. None otherwise.
+    """
+    if operation.operation == TerralegoOutbox.DELETE:
+        if operation.terralego_id is None:
+            # Never created, its pending saves are collapsed into this delete
+            return
+        delete_entry(operation.terralego_id)
+        cache.invalidate(operation.terralego_id)
+        # The tags of the deleted entry are unknown
+        cache.invalidate_closest([(operation.terralego_id, None)])
+        return
+    model = operation.content_type.model_class()
+    instance = model._base_manager.filter(pk=operation.object_id).first()
+    if instance is None or instance.terralego_geometry is None:
+        # Deleted since, a delete operation will follow
+        return
+    read_hash = instance.get_terralego_hash()
+    instance.save_to_terralego()
+    return instance, read_hash
+
+
+def write_result(instance, read_hash):
+    """
+    Write the terralego fields of a saved instance, in the transaction completing its operation.
+    """
+    current = type(instance)._base_manager.select_for_update().filter(pk=instance.pk).first()
+    if current is None:
+        return
+    if current.get_terralego_hash() == read_hash:
+        current = instance
+        fields = TERRALEGO_FIELDS
+    else:
+        # Changed while terralego was requested: only the entry is kept, the next operation of the object updates it
+        current.terralego_id = instance.terralego_id
+        current.terralego_last_update = instance.terralego_last_update
+        fields = ('terralego_id', 'terralego_last_update')
+    current.save(update_fields=fields, terralego_commit=False)
+
+
+def get_ready_operations(batch_size):
+    """
+    Lock a batch of ready operations, skipping the rows locked by the other workers when the database supports it.
+    """
+    queryset = TerralegoOutbox.objects.ready().select_related('content_type').order_by('pk')
+    connection = connections[router.db_for_write(TerralegoOutbox)]
+    if getattr(connection.features, 'has_select_for_update_skip_locked', False):
+        # Django >= 1.11
+        queryset = queryset.select_for_update(skip_locked=True)
+    else:
+        queryset = queryset.select_for_update()
+    return list(queryset[:batch_size])
+
+
+def claim_operations(batch_size):
+    """
+    Claim a batch of ready operations for `TERRALEGO['OUTBOX_LEASE']` seconds, in a short transaction. The other workers
+    skip them, and the other operations of their objects, until they are done or the lease expires after a crash.
+
+    :return: A list of the claimed operations grouped by object, in the order of the first operation of each object.
+    """
+    now = timezone.now()
+    with transaction.atomic(using=router.db_for_write(TerralegoOutbox)):
+        operations = get_ready_operations(batch_size)
+        busy = set(TerralegoOutbox.objects.filter(claimed_until__gt=now).values_list('content_type_id', 'object_id'))
+        grouped = OrderedDict()
+        for operation in operations:
+            key = (operation.content_type_id, operation.object_id)
+            if key not in busy:
+                grouped.setdefault(key, []).append(operation)
+        claimed = [operation.pk for group in grouped.values() for operation in group]
+        TerralegoOutbox.objects.filter(pk__in=claimed).update(
+            claimed_until=now + timedelta(seconds=conf.TERRALEGO.get('OUTBOX_LEASE', 300)))
+    return list(grouped.values())
+
+
+def process_outbox(batch_size=100):
+    """
+    Process a batch of ready operations.
+
+    The operations are claimed in a short transaction, then the requests are made without holding any lock, and the
+    result of each object written in its own transaction. Several workers can run in parallel: an object is processed
+    by one worker at a time. Pending operations of the same object are collapsed: only the last one is applied.
+
+    :return: A tuple `(succeeded, failed)` with the number of objects processed.
+    """
+    succeeded = failed = 0
+    for group in claim_operations(batch_size):
+        last = group[-1]
+        try:
+            result = apply_operation(last)
+            with transaction.atomic():
+                if result is not None:
+                    write_result(*result)
+                    # Deleted during the request: the delete did not know the entry
+                    TerralegoOutbox.objects.filter(
+                        content_type_id=last.content_type_id, object_id=last.object_id, pk__gt=last.pk,
+                        operation=TerralegoOutbox.DELETE, terralego_id__isnull=True,
+                    ).update(terralego_id=result[0].terralego_id)
+                # The older operations of the object, given up or waiting for a retry, are superseded
+                TerralegoOutbox.objects.filter(
+                    content_type_id=last.content_type_id, object_id=last.object_id, pk__lte=last.pk).delete()
+        except Exception as e:
+            record_failure(group, e)
+            failed += 1
+        else:
+            succeeded += 1
+    return succeeded, failed
+
+
+def record_failure(group, error):
+    """
+    Delay the next attempt of the operations of an object, or give them up after `TERRALEGO['OUTBOX_MAX_ATTEMPTS']`
+    failures, e.g. for an entry refused by terralego.
+    """
+    if isinstance(error, RequestException):
+        logger.error('Error while syncing with terralego: {0}'.format(error))
+    else:
+        logger.exception('Error while syncing with terralego')
+    attempts = max(operation.attempts for operation in group) + 1
+    if attempts >= conf.TERRALEGO.get('OUTBOX_MAX_ATTEMPTS', 10):
+        logger.error('Giving up the terralego operation {0} after {1} attempts'.format(group[-1], attempts))
+    TerralegoOutbox.objects.filter(pk__in=[operation.pk for operation in group]).update(
+        attempts=attempts,
+        next_attempt=timezone.now() + get_backoff(attempts),
+        last_error=str(error) or repr(error),
+        claimed_until=None,
+    )
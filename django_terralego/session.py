@@ -0,0 +1,76 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from django_terralego import conf
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+def get_retry():
+    """
+    Build the retry policy of the session. Only idempotent requests are retried.
+    """
+    options = {
+        'total': conf.TERRALEGO.get('RETRIES', 3),
+        'backoff_factor': conf.TERRALEGO.get('BACKOFF_FACTOR', 0.1),
+        'status_forcelist': (502, 503, 504),
+        'raise_on_status': False,
+    }
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **options)
+
+
+def build_session():
+    pool_size = conf.TERRALEGO.get('POOL_SIZE', 10)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=get_retry())
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Get the session shared by every thread of the process, keeping the connections to terralego alive.
+
+    A new session is built after a fork so the children never share the sockets of their parent.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = build_session()
+                _session_pid = pid
+    return _session
+
+
+def reset_session():
+    """
+    Close the shared session, the next request will build a new one.
+    """
+    global _session
+    with _lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+        _session = None
+
+
+def get_timeout(operation):
+    """
+    Get the timeout in seconds of a geodirectory operation.
+
+    :param operation: One of `create`, `get`, `update`, `delete` and `closest`.
+    """
+    return conf.TERRALEGO.get('TIMEOUTS', {}).get(operation, conf.TERRALEGO.get('TIMEOUT', 10))
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent before every request to terralego, with the `operation` (create, get, update, delete or closest)
+pre_terralego_call = Signal()
+
+# Sent after every request to terralego, with the `operation`, its `duration` in seconds, the `request_size` and
+# `response_size` in bytes, and the `error` raised if any
+post_terralego_call = Signal()
@@ -0,0 +1,181 @@
+"""
+Reduce the size of geojson geometries before sending them to terralego: coordinates rounded to a decimal precision,
+lines and rings simplified with the Douglas-Peucker algorithm, up to a tolerance and/or a maximum number of vertices.
+
+The distances are computed with NumPy, one vectorized pass per split of the Douglas-Peucker algorithm.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Depth of the lines or rings in the coordinates, None for the points only geometries
+LINE_DEPTHS = {
+    'Point': None,
+    'MultiPoint': None,
+    'LineString': 0,
+    'MultiLineString': 1,
+    'Polygon': 1,
+    'MultiPolygon': 2,
+}
+
+
+def _distances_to_segment(points, a, b):
+    ab = b - a
+    length = ab.dot(ab)
+    if length == 0:
+        # A ring, both ends being the same position
+        return np.hypot(*(points - a).T)
+    t = np.clip((points - a).dot(ab) / length, 0, 1)
+    return np.hypot(*(points - (a + t[:, None] * ab)).T)
+
+
+def get_importances(positions):
+    """
+    Get the importance of every vertex of a line for the Douglas-Peucker algorithm: the distance at which it is kept,
+    capped by the importance of the vertex splitting the line before it. The ends of the line are always kept.
+
+    Simplifying with a tolerance keeps the vertices whose importance is greater than the tolerance.
+
+    :param positions: A `(vertices, dimension)` array.
+    """
+    importances = np.zeros(len(positions))
+    importances[[0, -1]] = np.inf
+    points = positions[:, :2]
+    splits = [(0, len(positions) - 1, np.inf)]
+    while splits:
+        first, last, cap = splits.pop()
+        if last - first < 2:
+            continue
+        distances = _distances_to_segment(points[first + 1:last], points[first], points[last])
+        index = first + 1 + int(distances.argmax())
+        importances[index] = min(distances[index - first - 1], cap)
+        splits.append((first, index, importances[index]))
+        splits.append((index, last, importances[index]))
+    return importances
+
+
+def _drop_duplicates(positions):
+    if len(positions) < 2:
+        return positions
+    keep = np.ones(len(positions), dtype=bool)
+    keep[1:] = (positions[1:] != positions[:-1]).any(axis=1)
+    return positions[keep]
+
+
+def _collect(coordinates, depth, lines):
+    # Replace every line of the coordinates by its index in `lines`
+    if depth == 0:
+        lines.append(np.array(coordinates, dtype=float))
+        return len(lines) - 1
+    return [_collect(item, depth - 1, lines) for item in coordinates]
+
+
+def _rebuild(structure, depth, lines):
+    if depth == 0:
+        return lines[structure]
+    return [_rebuild(item, depth - 1, lines) for item in structure]
+
+
+def _round(coordinates, precision):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [round(value, precision) for value in coordinates]
+    return [_round(item, precision) for item in coordinates]
+
+
+def _reduce(geometry, precision, parts):
+    geometry_type = geometry.get('type')
+    if geometry_type == 'GeometryCollection':
+        return dict(geometry, geometries=[_reduce(item, precision, parts) for item in geometry.get('geometries', [])])
+    if geometry_type not in LINE_DEPTHS:
+        return geometry
+    coordinates = geometry.get('coordinates') or []
+    depth = LINE_DEPTHS[geometry_type]
+    if depth is None:
+        # Points are only rounded
+        parts.append((None, count_vertices(geometry)))
+        return dict(geometry, coordinates=coordinates if precision is None else _round(coordinates, precision))
+    lines = []
+    structure = _collect(coordinates, depth, lines)
+    parts.append((geometry_type in ('Polygon', 'MultiPolygon'), lines))
+    return dict(geometry, coordinates=(structure, depth, lines))
+
+
+def _finish(geometry):
+    if geometry.get('type') == 'GeometryCollection':
+        return dict(geometry, geometries=[_finish(item) for item in geometry['geometries']])
+    if isinstance(geometry.get('coordinates'), tuple):
+        structure, depth, lines = geometry['coordinates']
+        return dict(geometry, coordinates=_rebuild(structure, depth, [line.tolist() for line in lines]))
+    return geometry
+
+
+def count_vertices(geometry):
+    """
+    Get the number of positions of a geojson geometry.
+    """
+    if geometry.get('type') == 'GeometryCollection':
+        return sum(count_vertices(item) for item in geometry.get('geometries', []))
+
+    def count(coordinates):
+        if coordinates and isinstance(coordinates[0], (int, float)):
+            return 1
+        return sum(count(item) for item in coordinates)
+
+    return count(geometry.get('coordinates') or [])
+
+
+def reduce_geometry(geometry, tolerance=None, max_vertices=None, precision=None):
+    """
+    Round and simplify the lines and the rings of a geojson geometry.
+
+    The rings keep at least 4 positions, the lines 2. The points are only rounded.
+
+    :param tolerance: Optional. The maximum distance between the simplified and the original lines, in the unit of
+                      the coordinates.
+    :param max_vertices: Optional. The maximum number of positions of the lines and the rings, the least important
+                         vertices being removed first.
+    :param precision: Optional. The number of decimals of the coordinates.
+    :return: A new geometry.
+    """
+    if np is None:
+        raise ImproperlyConfigured('The geometries simplification requires numpy')
+    parts = []  # (is_polygon, lines), or (None, number of points)
+    reduced = _reduce(geometry, precision, parts)
+    sequences = []
+    points = 0
+    for is_polygon, lines in parts:
+        if is_polygon is None:
+            points += lines
+            continue
+        for index, line in enumerate(lines):
+            if precision is not None:
+                line = _drop_duplicates(np.round(line, precision))
+            lines[index] = line
+            minimum = 4 if is_polygon else 2
+            if len(line) > minimum and (tolerance is not None or max_vertices is not None):
+                sequences.append((lines, index, minimum))
+    importances = []
+    for lines, index, minimum in sequences:
+        line_importances = get_importances(lines[index])
+        if minimum > 2:
+            # Keep the most important vertices of the rings
+            line_importances[np.argsort(-line_importances)[:minimum]] = np.inf
+        importances.append(line_importances)
+    if importances:
+        everything = np.concatenate(importances)
+        keep = everything > (tolerance or 0)
+        if max_vertices is not None:
+            others = points + sum(
+                len(line) for is_polygon, lines in parts if is_polygon is not None for line in lines) - len(everything)
+            budget = max(max_vertices - others, int(np.isinf(everything).sum()))
+            ranked = np.zeros(len(everything), dtype=bool)
+            ranked[np.argsort(-everything, kind='mergesort')[:budget]] = True
+            keep &= ranked
+        start = 0
+        for (lines, index, minimum), line_importances in zip(sequences, importances):
+            lines[index] = lines[index][keep[start:start + len(line_importances)]]
+            start += len(line_importances)
+    return _finish(reduced)
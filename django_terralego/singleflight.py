@@ -0,0 +1,95 @@
+"""
+Single-flight of the read requests: concurrent identical reads of the same process share one request to terralego.
+
+A call made while an identical one is in flight waits for it and gets its result, or its exception, instead of
+requesting terralego again; each caller sharing a result gets its own copy. The shared calls are counted in
+`django_terralego.stats.counters` as `coalesced.<operation>`. It is enabled by default, set
+`TERRALEGO['SINGLE_FLIGHT']` at False to disable it.
+"""
+import asyncio
+import threading
+from copy import deepcopy
+
+from django_terralego import conf
+from django_terralego.stats import counters
+
+
+def is_enabled():
+    return conf.TERRALEGO.get('SINGLE_FLIGHT', True)
+
+
+class Call(object):
+    """
+    A call in flight, waited by the identical calls of the other threads.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group(object):
+    """
+    The calls in flight by key, for the threads and for the event loops of the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}  # (loop, key) -> [task, waiters]
+
+    def do(self, key, func, *args):
+        """
+        Call `func(*args)`, unless a call with the same key is in flight in another thread: its result is returned
+        instead.
+
+        :param key: A hashable `(operation, ...)` tuple identifying the call.
+        """
+        if not is_enabled():
+            return func(*args)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            counters.incr('coalesced.{0}'.format(key[0]))
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return deepcopy(call.result)
+        try:
+            call.result = func(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return deepcopy(call.result) if call.waiters else call.result
+
+    async def ado(self, key, func, *args):
+        """
+        Like `do`, for the coroutine functions: the calls in flight are shared within the running event loop.
+        """
+        if not is_enabled():
+            return await func(*args)
+        task_key = (asyncio.get_event_loop(), key)
+        flight = self._tasks.get(task_key)
+        if flight is not None:
+            counters.incr('coalesced.{0}'.format(key[0]))
+            flight[1] += 1
+            # A cancelled caller does not cancel the request of the others
+            return deepcopy(await asyncio.shield(flight[0]))
+        flight = self._tasks[task_key] = [asyncio.ensure_future(func(*args)), 0]
+        flight[0].add_done_callback(lambda task: self._tasks.pop(task_key, None))
+        result = await asyncio.shield(flight[0])
+        return deepcopy(result) if flight[1] else result
+
+
+group = Group()
@@ -0,0 +1,378 @@
+"""
+A local spatial index of the entries synced by the GeoDirectoryMixin models, used by `closest()` when
+`TERRALEGO['CLOSEST_BACKEND']` is `local`.
+
+The index is built from the `terralego_geometry` and `terralego_tags` columns on first use, kept up to date by the
+`post_save` and `post_delete` signals of the process and fully rebuilt every `TERRALEGO['LOCAL_INDEX_TTL']` seconds
+to catch the changes made by other processes. Distances are computed with a vectorized haversine formula.
+"""
+import json
+import math
+import threading
+import time
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+
+from django_terralego import conf
+from django_terralego.fields import is_packed, load_geometry, unpack_positions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371008.8  # meters
+
+
+def iter_coordinates(coordinates):
+    """
+    Yield every `(x, y)` position of nested geojson coordinates.
+    """
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates[0], coordinates[1]
+        return
+    for item in coordinates:
+        for position in iter_coordinates(item):
+            yield position
+
+
+def get_geometry_positions(geometry):
+    """
+    Get every `(x, y)` position of a geojson geometry, or an empty list if it is not geojson.
+
+    :param geometry: A geojson dict or string, or a packed geometry.
+    """
+    if is_packed(geometry):
+        return unpack_positions(geometry)
+    geometry = load_geometry(geometry)
+    if geometry is None:
+        return []
+    if geometry.get('type') == 'GeometryCollection':
+        return [position for item in geometry.get('geometries', []) for position in get_geometry_positions(item)]
+    return list(iter_coordinates(geometry.get('coordinates') or []))
+
+
+def get_representative_point(geometry):
+    """
+    Get the point used to compute distances: the point itself, or the mean of the vertices for other geometries.
+
+    :return: A `(longitude, latitude)` tuple, or None for an empty or unsupported geometry.
+    """
+    positions = get_geometry_positions(geometry)
+    if not positions:
+        return None
+    return (
+        sum(position[0] for position in positions) / len(positions),
+        sum(position[1] for position in positions) / len(positions),
+    )
+
+
+def get_bbox(geometry):
+    """
+    Get the bounding box of a geojson geometry.
+
+    :return: A `(min_x, min_y, max_x, max_y)` tuple, or None for an empty or unsupported geometry.
+    """
+    positions = get_geometry_positions(geometry)
+    if not positions:
+        return None
+    xs = [position[0] for position in positions]
+    ys = [position[1] for position in positions]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def iter_parts(geometry):
+    """
+    Yield the `(type, coordinates)` of the simple parts of a geojson geometry: `Point`, `LineString` or `Polygon`.
+    """
+    geometry_type = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    if geometry_type in ('Point', 'LineString', 'Polygon'):
+        yield geometry_type, coordinates
+    elif geometry_type in ('MultiPoint', 'MultiLineString', 'MultiPolygon'):
+        for part in coordinates:
+            yield geometry_type[5:], part
+    elif geometry_type == 'GeometryCollection':
+        for item in geometry.get('geometries', []):
+            for part in iter_parts(item):
+                yield part
+
+
+def _segment_distance(a, b):
+    # Distance between the origin and the segment [a, b]
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length = dx * dx + dy * dy
+    t = 0 if length == 0 else max(0, min(1, -(a[0] * dx + a[1] * dy) / length))
+    return math.hypot(a[0] + t * dx, a[1] + t * dy)
+
+
+def _contains_origin(ring):
+    inside = False
+    for a, b in zip(ring, ring[1:] + ring[:1]):
+        if (a[1] > 0) != (b[1] > 0) and 0 < a[0] + (b[0] - a[0]) * -a[1] / (b[1] - a[1]):
+            inside = not inside
+    return inside
+
+
+def distance_to_geometry(point, geometry):
+    """
+    Get the distance in meters between a point and a geojson geometry, 0 if the point is inside a polygon.
+
+    The geometry is projected on a plane tangent at the point, which is accurate for distances of a few hundred
+    kilometers.
+
+    :param point: A `(longitude, latitude)` tuple.
+    :param geometry: A geojson dict or string, or a packed geometry.
+    :return: The distance, or None for an empty or unsupported geometry.
+    """
+    geometry = load_geometry(geometry)
+    if geometry is None:
+        return None
+    scale = math.pi / 180 * EARTH_RADIUS
+    x_scale = scale * math.cos(math.radians(point[1]))
+
+    def project(ring):
+        return [((position[0] - point[0]) * x_scale, (position[1] - point[1]) * scale) for position in ring]
+
+    distances = []
+    for part_type, coordinates in iter_parts(geometry):
+        if part_type == 'Point':
+            distances.append(math.hypot(*project([coordinates])[0]))
+            continue
+        rings = [project(coordinates)] if part_type == 'LineString' else [project(ring) for ring in coordinates]
+        if part_type == 'Polygon' and rings and _contains_origin(rings[0]):
+            if not any(_contains_origin(hole) for hole in rings[1:]):
+                return 0.0
+        for ring in rings:
+            if len(ring) == 1:
+                distances.append(math.hypot(*ring[0]))
+            distances.extend(_segment_distance(a, b) for a, b in zip(ring, ring[1:]))
+    return min(distances) if distances else None
+
+
+def haversine(longitude, latitude, longitudes, latitudes):
+    """
+    Get the distances in meters between a point and arrays of points, all in degrees.
+    """
+    longitude, latitude = np.radians(longitude), np.radians(latitude)
+    longitudes, latitudes = np.radians(longitudes), np.radians(latitudes)
+    a = (
+        np.sin((latitudes - latitude) / 2) ** 2 +
+        np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def get_geodirectory_models():
+    from django_terralego.models import GeoDirectoryMixin
+    return [model for model in apps.get_models() if issubclass(model, GeoDirectoryMixin)]
+
+
+class SpatialIndex(object):
+    """
+    An in-memory index of `(model, pk)` keys with their representative point and tags.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.built_at = None
+            self._keys = []
+            self._positions = {}
+            self._longitudes = []
+            self._latitudes = []
+            self._alive = []
+            self._tags = {}  # tag -> set of positions
+            self._key_tags = []
+            self._arrays = None
+            self._tag_masks = {}  # tag -> boolean array of the positions, built with the arrays
+
+    def is_built(self):
+        ttl = conf.TERRALEGO.get('LOCAL_INDEX_TTL', 300)
+        return self.built_at is not None and (ttl is None or time.time() - self.built_at < ttl)
+
+    def build(self):
+        """
+        Load every synced entry of the GeoDirectoryMixin models.
+        """
+        with self._lock:
+            self.clear()
+            for model in get_geodirectory_models():
+                rows = model._base_manager.filter(terralego_id__isnull=False).values_list(
+                    'pk', 'terralego_geometry', 'terralego_tags')
+                for pk, geometry, tags in rows.iterator():
+                    self._set(model, pk, geometry, tags)
+            self.built_at = time.time()
+
+    def ensure_built(self):
+        if np is None:
+            raise ImproperlyConfigured('numpy is required by the local closest backend.')
+        if not self.is_built():
+            self.build()
+
+    def _set(self, model, pk, geometry, tags):
+        key = (model, pk)
+        point = get_representative_point(geometry)
+        if point is None:
+            return self._remove(key)
+        tags = frozenset(json.loads(tags) if tags else [])
+        position = self._positions.get(key)
+        if position is None:
+            position = len(self._keys)
+            self._positions[key] = position
+            self._keys.append(key)
+            self._longitudes.append(point[0])
+            self._latitudes.append(point[1])
+            self._alive.append(True)
+            self._key_tags.append(frozenset())
+            self._arrays = None
+        else:
+            self._longitudes[position], self._latitudes[position] = point
+            self._alive[position] = True
+            if self._arrays is not None:
+                self._arrays[0][position], self._arrays[1][position] = point
+                self._arrays[2][position] = True
+        for tag in self._key_tags[position] - tags:
+            self._tags[tag].discard(position)
+            self._set_tag_mask(tag, position, False)
+        for tag in tags - self._key_tags[position]:
+            self._tags.setdefault(tag, set()).add(position)
+            self._set_tag_mask(tag, position, True)
+        self._key_tags[position] = tags
+
+    def _set_tag_mask(self, tag, position, value):
+        if self._arrays is not None and tag in self._tag_masks:
+            self._tag_masks[tag][position] = value
+
+    def _remove(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            return
+        self._alive[position] = False
+        if self._arrays is not None:
+            self._arrays[2][position] = False
+
+    def update(self, instance):
+        """
+        Update the entry of an instance, if the index is built.
+        """
+        with self._lock:
+            if self.built_at is None:
+                return
+            if instance.terralego_id is None:
+                return self._remove((type(instance), instance.pk))
+            self._set(type(instance), instance.pk, instance.terralego_geometry, instance.terralego_tags)
+
+    def remove(self, instance):
+        with self._lock:
+            self._remove((type(instance), instance.pk))
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            self._arrays = (
+                np.array(self._longitudes, dtype=np.float64),
+                np.array(self._latitudes, dtype=np.float64),
+                np.array(self._alive, dtype=bool),
+            )
+            self._tag_masks = {}
+        return self._arrays
+
+    def _get_tag_mask(self, tag):
+        mask = self._tag_masks.get(tag)
+        if mask is None:
+            mask = np.zeros(len(self._keys), dtype=bool)
+            positions = self._tags.get(tag, ())
+            mask[np.fromiter(positions, dtype=np.intp, count=len(positions))] = True
+            self._tag_masks[tag] = mask
+        return mask
+
+    def nearest(self, point, tags=None, k=1, exclude=None):
+        """
+        Get the nearest entries of a point.
+
+        :param point: A `(longitude, latitude)` tuple.
+        :param tags: Optional. Only the entries having all these tags are considered.
+        :param k: The maximum number of entries to return.
+        :param exclude: Optional. A `(model, pk)` key to ignore.
+        :return: A list of `(model, pk, distance)` sorted by distance, the distance being in meters.
+        """
+        self.ensure_built()
+        with self._lock:
+            longitudes, latitudes, alive = self._get_arrays()
+            mask = alive.copy()
+            for tag in tags or []:
+                if not self._tags.get(tag):
+                    return []
+                mask &= self._get_tag_mask(tag)
+            if exclude in self._positions:
+                mask[self._positions[exclude]] = False
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            distances = haversine(point[0], point[1], longitudes[candidates], latitudes[candidates])
+            if k < len(candidates):
+                nearest = np.argpartition(distances, k)[:k]
+            else:
+                nearest = np.arange(len(candidates))
+            nearest = nearest[np.argsort(distances[nearest])]
+            return [self._keys[candidates[i]] + (float(distances[i]),) for i in nearest]
+
+
+index = SpatialIndex()
+
+
+def closest(instance, tags=None, k=1):
+    """
+    Get the closest instances of an instance using the local index.
+
+    :return: A list of at most k instances, sorted by distance.
+    """
+    return closest_many([instance], tags, k)[0]
+
+
+def closest_many(instances, tags=None, k=1):
+    """
+    Get the closest instances of many instances using the local index, with one query per model.
+
+    :return: A list, in the same order as instances, of lists of at most k instances sorted by distance.
+    """
+    results = []
+    for instance in instances:
+        point = get_representative_point(instance.terralego_geometry)
+        if point is None:
+            results.append([])
+            continue
+        results.append(index.nearest(point, tags, k, exclude=(type(instance), instance.pk)))
+    pks_by_model = {}
+    for keys in results:
+        for model, pk, distance in keys:
+            pks_by_model.setdefault(model, set()).add(pk)
+    found = {}
+    for model, pks in pks_by_model.items():
+        found.update(((model, obj.pk), obj) for obj in model._default_manager.filter(pk__in=pks))
+    return [
+        [found[(model, pk)] for model, pk, distance in keys if (model, pk) in found]
+        for keys in results
+    ]
+
+
+def update_index(sender, instance, **kwargs):
+    from django_terralego.models import GeoDirectoryMixin
+    if isinstance(instance, GeoDirectoryMixin):
+        index.update(instance)
+
+
+def remove_from_index(sender, instance, **kwargs):
+    from django_terralego.models import GeoDirectoryMixin
+    if isinstance(instance, GeoDirectoryMixin):
+        index.remove(instance)
+
+
+def connect_signals():
+    post_save.connect(update_index, dispatch_uid='django_terralego_spatial_update')
+    post_delete.connect(remove_from_index, dispatch_uid='django_terralego_spatial_remove')
@@ -0,0 +1,33 @@
+import threading
+from collections import Counter
+
+
+class Counters(object):
+    """
+    Thread-safe counters of the terralego operations, e.g. `sync_performed` and `sync_skipped`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = Counter()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counter[name] += value
+
+    def get(self, name):
+        return self._counter[name]
+
+    def snapshot(self):
+        """
+        :return: A dict with the current value of every counter.
+        """
+        with self._lock:
+            return dict(self._counter)
+
+    def reset(self):
+        with self._lock:
+            self._counter.clear()
+
+
+counters = Counters()
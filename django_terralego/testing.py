@@ -0,0 +1,182 @@
+"""
+An in-process stand-in of the terralego geodirectory, for tests and benchmarks.
+
+Usage::
+
+    with FakeGeoDirectoryServer() as server:
+        instance.save()
+        assert str(instance.terralego_id) in server.entries
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from terralego.conf import settings
+
+from django_terralego import spatial
+
+ENTRY_URL = re.compile(r'^/geodirectory/entries/(?:(?P<id>[^/]+)/(?:(?P<closest>closest)/)?)?$')
+
+
+def parse_geometry(geometry):
+    """
+    Parse a geojson string, or a `POINT(x y)` WKT string.
+    """
+    match = re.match(r'^\s*POINT\s*\(\s*(\S+)\s+(\S+)\s*\)\s*$', geometry, re.IGNORECASE)
+    if match:
+        return {'type': 'Point', 'coordinates': [float(match.group(1)), float(match.group(2))]}
+    return json.loads(geometry)
+
+
+class FakeGeoDirectoryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = parse_qs(self.rfile.read(length).decode('utf-8'))
+        return {key: values[0] for key, values in data.items()}
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        match = ENTRY_URL.match(url.path)
+        form = self.read_form() if method in ('POST', 'PUT') else {}
+        if match is None:
+            return self.send_json(404)
+        status, data = self.server.geodirectory.handle(
+            method, match.group('id'), bool(match.group('closest')), form, parse_qs(url.query))
+        self.send_json(status, data)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGeoDirectoryServer(object):
+    """
+    A geodirectory keeping its entries in memory, served over HTTP from a thread.
+
+    Entering the context manager starts the server and points `terralego.conf.settings.TERRALEGO_URL` to it.
+
+    :param latency: Optional. Seconds to wait before answering each request.
+    :param error_rate: Optional. The probability, between 0 and 1, to answer a request with a 503 error.
+    """
+
+    def __init__(self, latency=0, error_rate=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.entries = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+        self.previous_url = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/{{api}}/'.format(self.httpd.server_address[1])
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeoDirectoryHandler)
+        self.httpd.geodirectory = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.previous_url = settings.TERRALEGO_URL
+        settings.TERRALEGO_URL = self.url
+        return self
+
+    def stop(self):
+        settings.TERRALEGO_URL = self.previous_url
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def make_entry(self, entry_id, form):
+        geometry = parse_geometry(form['geometry'])
+        return {
+            'id': entry_id,
+            'type': 'Feature',
+            'geometry': geometry,
+            'bbox': list(spatial.get_bbox(geometry)),
+            'properties': {'tags': json.loads(form.get('tags') or '[]')},
+        }
+
+    def closest(self, entry, tags):
+        point = spatial.get_representative_point(entry['geometry'])
+        candidates = [
+            other for other in self.entries.values()
+            if other['id'] != entry['id'] and set(tags) <= set(other['properties']['tags'])
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda other: math.hypot(*[
+            a - b for a, b in zip(point, spatial.get_representative_point(other['geometry']))]))
+
+    def handle(self, method, entry_id, closest, form, query):
+        """
+        :return: A `(status, data)` tuple.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, None
+        with self.lock:
+            self.requests.append((method, entry_id))
+            if entry_id is None:
+                if method != 'POST':
+                    return 405, None
+                entry = self.make_entry(str(uuid.uuid4()), form)
+                self.entries[entry['id']] = entry
+                return 201, entry
+            if entry_id not in self.entries:
+                return 404, None
+            if closest:
+                tags = json.loads(query['tags'][0]) if 'tags' in query else []
+                entry = self.closest(self.entries[entry_id], tags)
+                return (200, entry) if entry is not None else (404, None)
+            if method == 'GET':
+                return 200, self.entries[entry_id]
+            if method == 'PUT':
+                self.entries[entry_id] = self.make_entry(entry_id, form)
+                return 200, self.entries[entry_id]
+            if method == 'DELETE':
+                del self.entries[entry_id]
+                return 204, None
+            return 405, None
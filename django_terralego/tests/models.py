@@ -1,5 +1,12 @@
+from django.db import models
+
+from django_terralego.fields import CompactGeometryField
 from django_terralego.models import GeoDirectoryMixin
 
 
 class Dummy(GeoDirectoryMixin):
     pass
+
+
+class CompactGeometry(models.Model):
+    geometry = CompactGeometryField(null=True)
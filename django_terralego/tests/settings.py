@@ -41,3 +41,8 @@ TEMPLATES = [
         },
     },
 ]
+
+# The test models live in the django_terralego app, create every table without the migrations
+MIGRATION_MODULES = {
+    'django_terralego': None,
+}
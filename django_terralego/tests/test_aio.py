@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from unittest import skipIf
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import TransactionTestCase
+from requests import HTTPError
+
+from django_terralego import aio, cache, conf
+from django_terralego.testing import FakeGeoDirectoryServer
+from django_terralego.tests.models import Dummy
+
+
+@skipIf(aio.aiohttp is None, 'aiohttp is not installed')
+class AsyncGeoDirectoryTest(TransactionTestCase):
+    """ Test the asyncio API against the fake geodirectory server. """
+
+    def setUp(self):
+        self.server = FakeGeoDirectoryServer().start()
+        self.addCleanup(self.server.stop)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        self.addCleanup(self.loop.run_until_complete, aio.close_client_session())
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_save_update_delete(self):
+        dummy = Dummy(terralego_geometry='POINT(1 2)')
+        self.run_async(dummy.asave_to_terralego())
+        self.assertIn(dummy.terralego_id, self.server.entries)
+        self.assertEqual(dummy.terralego_geometry, {'type': 'Point', 'coordinates': [1, 2]})
+        dummy.terralego_geometry = 'POINT(3 4)'
+        self.run_async(dummy.asave_to_terralego())
+        self.assertEqual(self.server.entries[dummy.terralego_id]['geometry']['coordinates'], [3, 4])
+        dummy.save(terralego_commit=False)
+        dummy.terralego_geometry = 'POINT(5 6)'
+        self.run_async(dummy.adelete_from_terralego())
+        self.assertEqual(self.server.entries, {})
+        self.assertIsNone(dummy.terralego_id)
+        saved = Dummy.objects.get()
+        self.assertIsNone(saved.terralego_id)
+        # Only the id is written, not the unsaved changes
+        self.assertEqual(saved.terralego_geometry['coordinates'], [3, 4])
+
+    def test_update_from_terralego_entry(self):
+        dummy = Dummy(terralego_geometry='POINT(1 2)')
+        self.run_async(dummy.asave_to_terralego())
+        dummy.terralego_geometry = None
+        self.run_async(dummy.aupdate_from_terralego_entry())
+        self.assertEqual(dummy.terralego_geometry, {'type': 'Point', 'coordinates': [1, 2]})
+
+    def test_errors(self):
+        dummy = Dummy(terralego_id='6af234fb-ec81-4189-ab6b-ac9b1483e665')
+        with self.assertRaises(HTTPError):
+            self.run_async(dummy.aupdate_from_terralego_entry())
+
+    def test_gather_and_closest(self):
+        dummies = [Dummy(terralego_geometry='POINT({0} 0)'.format(i)) for i in range(20)]
+        results = self.run_async(aio.gather([dummy.asave_to_terralego() for dummy in dummies], limit=5))
+        self.assertEqual(results, [None] * 20)
+        self.assertEqual(len(self.server.entries), 20)
+        for dummy in dummies:
+            dummy.save(terralego_commit=False)
+        self.assertEqual(self.run_async(dummies[0].aclosest()), dummies[1])
+
+    def test_cache_is_used_from_a_thread(self):
+        dummy = Dummy(terralego_geometry='POINT(1 2)')
+        self.run_async(dummy.asave_to_terralego())
+        threads = []
+        cache_get = cache.get_cache().get
+
+        def get(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return cache_get(*args, **kwargs)
+
+        with mock.patch.dict(conf.TERRALEGO, {'CACHE': {'ALIAS': 'default'}}), \
+                mock.patch.object(cache.get_cache(), 'get', side_effect=get):
+            self.run_async(dummy.aupdate_from_terralego_entry())
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_breaker_is_used_from_a_thread(self):
+        threads = []
+        with mock.patch.dict(conf.TERRALEGO, {'CIRCUIT_BREAKER': {'CACHE_ALIAS': 'default'}}), \
+                mock.patch('django_terralego.breaker.CacheState.get_opened_at',
+                           side_effect=lambda: threads.append(threading.current_thread())):
+            self.run_async(Dummy(terralego_geometry='POINT(1 2)').asave_to_terralego())
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_stale_sessions_are_closed(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        session = loop.run_until_complete(self.get_session())
+        loop.close()
+        asyncio.set_event_loop(self.loop)
+        self.run_async(self.get_session())
+        self.run_async(asyncio.sleep(0))
+        self.assertTrue(session.closed)
+        self.assertEqual(list(aio._sessions), [self.loop])
+
+    async def get_session(self):
+        return aio.get_client_session()
@@ -0,0 +1,119 @@
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.db.models import Count
+from django.test import TestCase
+
+from django_terralego import conf, spatial
+from django_terralego.models import TerralegoTag
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+
+class BoundingBoxTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(conf.TERRALEGO, {'ENABLED': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.square = Dummy.objects.create(terralego_geometry=SQUARE)
+        self.point = Dummy.objects.create(terralego_geometry={'type': 'Point', 'coordinates': [2, 0.5]})
+        self.far = Dummy.objects.create(terralego_geometry={'type': 'Point', 'coordinates': [50, 50]})
+        # In the bounding box of near((1.5, 1.5), 80000), but at about 110 km
+        self.corner = Dummy.objects.create(terralego_geometry={'type': 'Point', 'coordinates': [2.2, 2.2]})
+        Dummy.objects.create()
+
+    def test_bbox_from_geometry(self):
+        self.assertEqual(
+            (self.square.terralego_min_x, self.square.terralego_min_y, self.square.terralego_max_x,
+             self.square.terralego_max_y),
+            (0, 0, 1, 1))
+        self.point.terralego_geometry = {'type': 'Point', 'coordinates': [3, 4]}
+        self.point.save(update_fields=['terralego_geometry'])
+        self.point.refresh_from_db()
+        self.assertEqual((self.point.terralego_min_x, self.point.terralego_max_y), (3, 4))
+
+    def test_bbox_from_data(self):
+        dummy = Dummy()
+        dummy.update_from_terralego_data(GEOJSON_SAMPLE)
+        self.assertEqual(dummy.terralego_min_x, GEOJSON_SAMPLE['bbox'][0])
+        self.assertEqual(dummy.terralego_max_y, GEOJSON_SAMPLE['bbox'][3])
+
+    def test_in_bbox(self):
+        self.assertEqual(set(Dummy.objects.in_bbox(0.5, 0.5, 2.5, 0.6)), {self.square, self.point})
+        self.assertEqual(set(Dummy.objects.in_bbox(1.5, 0, 2.5, 0.4)), set())
+
+    def test_near(self):
+        self.assertEqual(set(Dummy.objects.near((0.5, 0.5), 10)), {self.square})
+        # 1 degree of longitude is about 111 km at the equator
+        self.assertEqual(set(Dummy.objects.near((1.5, 0.5), 60000)), {self.square, self.point})
+        self.assertEqual(set(Dummy.objects.near((1.5, 1.5), 80000)), {self.square})
+
+    def test_near_is_lazy(self):
+        with self.assertNumQueries(0):
+            queryset = Dummy.objects.near((1.5, 1.5), 80000).filter(terralego_id__isnull=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(queryset.iterator()), [self.square])
+        self.assertEqual(Dummy.objects.near((1.5, 1.5), 80000).count(), 1)
+        self.assertTrue(Dummy.objects.near((1.5, 0.5), 60000).exists())
+        self.assertEqual(Dummy.objects.near((1.5, 0.5), 60000).order_by('pk')[1:], [self.point])
+        self.assertEqual(
+            [row['pk'] for row in Dummy.objects.near((1.5, 1.5), 80000).values('pk', 'terralego_geometry')],
+            [self.square.pk])
+
+    def test_near_update(self):
+        self.assertEqual(Dummy.objects.near((1.5, 1.5), 80000).update(terralego_tags='["a"]'), 1)
+        self.assertEqual(set(Dummy.objects.filter(terralego_tags='["a"]')), {self.square})
+
+    def test_near_aggregate(self):
+        self.assertEqual(Dummy.objects.near((1.5, 1.5), 80000).aggregate(count=Count('pk')), {'count': 1})
+
+    def test_near_values_list(self):
+        self.assertEqual(list(Dummy.objects.near((1.5, 1.5), 80000).values_list('pk', flat=True)), [self.square.pk])
+        self.assertEqual([row['pk'] for row in Dummy.objects.near((1.5, 1.5), 80000).values('pk')], [self.square.pk])
+        self.assertEqual(
+            set(Dummy.objects.filter(pk__in=Dummy.objects.near((1.5, 1.5), 80000).values('pk'))), {self.square})
+        self.assertEqual(Dummy.objects.near((1.5, 1.5), 80000).latest('pk'), self.square)
+
+    def test_near_subquery(self):
+        self.assertEqual(set(Dummy.objects.filter(pk__in=Dummy.objects.near((1.5, 1.5), 80000))), {self.square})
+
+    def test_near_unlink(self):
+        for dummy in (self.square, self.corner):
+            dummy.terralego_id = uuid4()
+            dummy.terralego_tags = '["a"]'
+            dummy.save()
+        self.assertEqual(Dummy.objects.near((1.5, 1.5), 80000).unlink_from_terralego(), 1)
+        self.assertEqual(list(TerralegoTag.objects.values_list('terralego_id', flat=True)), [self.corner.terralego_id])
+        self.assertIsNotNone(Dummy.objects.get(pk=self.corner.pk).terralego_id)
+
+    @mock.patch('requests.Session.delete')
+    def test_near_delete_from_terralego(self, mocked_delete):
+        for dummy in (self.square, self.corner):
+            dummy.terralego_id = uuid4()
+            dummy.save()
+        with mock.patch.dict(conf.TERRALEGO, {'ENABLED': True}):
+            self.assertEqual(Dummy.objects.near((1.5, 1.5), 80000).delete_from_terralego(), [])
+        self.assertEqual(mocked_delete.call_count, 1)
+        self.assertIsNone(Dummy.objects.get(pk=self.square.pk).terralego_id)
+        self.assertIsNotNone(Dummy.objects.get(pk=self.corner.pk).terralego_id)
+
+    def test_near_index_terralego_tags(self):
+        for dummy in (self.square, self.corner):
+            dummy.terralego_id = uuid4()
+            dummy.terralego_tags = '["a"]'
+            dummy.save()
+        TerralegoTag.objects.all().delete()
+        Dummy.objects.near((1.5, 1.5), 80000).index_terralego_tags()
+        self.assertEqual(list(TerralegoTag.objects.values_list('terralego_id', flat=True)), [self.square.terralego_id])
+
+    def test_distance_to_geometry(self):
+        self.assertEqual(spatial.distance_to_geometry((0.5, 0.5), SQUARE), 0)
+        self.assertAlmostEqual(spatial.distance_to_geometry((0.5, 2), SQUARE) / 1000, 111.2, delta=0.1)
+        self.assertIsNone(spatial.distance_to_geometry((0, 0), 'POINT(0 0)'))
@@ -0,0 +1,112 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import TestCase
+from requests import ConnectionError, HTTPError
+
+from django_terralego import conf, geodirectory
+from django_terralego.breaker import CircuitBreaker, CircuitOpenError, reset_breaker
+from django_terralego.models import TerralegoOutbox
+from django_terralego.stats import counters
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+
+class CircuitBreakerTest(TestCase):
+    """ Test the circuit breaker by mocking the actual requests. """
+
+    def setUp(self):
+        counters.reset()
+        patcher = mock.patch.dict(conf.TERRALEGO, {
+            'CIRCUIT_BREAKER': {'FAILURE_THRESHOLD': 2, 'RECOVERY_TIMEOUT': 30},
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(reset_breaker)
+        self.response = mock.MagicMock()
+        self.response.json.return_value = GEOJSON_SAMPLE
+        self.response.content = b''
+
+    def open_circuit(self, mocked_get):
+        mocked_get.side_effect = ConnectionError('Down')
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                geodirectory.get_entry('1')
+        mocked_get.reset_mock()
+        mocked_get.side_effect = None
+
+    @mock.patch('requests.Session.get')
+    def test_fail_fast_when_open(self, mocked_get):
+        self.open_circuit(mocked_get)
+        with self.assertRaises(CircuitOpenError):
+            geodirectory.get_entry('1')
+        self.assertEqual(mocked_get.call_count, 0)
+        self.assertEqual(counters.get('breaker.rejected'), 1)
+
+    @mock.patch('requests.Session.get')
+    def test_client_errors_do_not_open(self, mocked_get):
+        self.response.status_code = 404
+        self.response.raise_for_status.side_effect = HTTPError('Not found', response=self.response)
+        mocked_get.return_value = self.response
+        for _ in range(3):
+            with self.assertRaises(HTTPError):
+                geodirectory.get_entry('1')
+        self.assertEqual(mocked_get.call_count, 3)
+
+    @mock.patch('requests.Session.get')
+    def test_half_open(self, mocked_get):
+        self.open_circuit(mocked_get)
+        mocked_get.return_value = self.response
+        with mock.patch('django_terralego.breaker.time.time', return_value=10 ** 10):
+            geodirectory.get_entry('1')
+        geodirectory.get_entry('1')
+        self.assertEqual(mocked_get.call_count, 2)
+
+    @mock.patch('requests.Session.get')
+    def test_failed_trial_reopens(self, mocked_get):
+        self.open_circuit(mocked_get)
+        mocked_get.side_effect = ConnectionError('Still down')
+        with mock.patch('django_terralego.breaker.time.time', return_value=10 ** 10):
+            with self.assertRaises(ConnectionError):
+                geodirectory.get_entry('1')
+            with self.assertRaises(CircuitOpenError):
+                geodirectory.get_entry('1')
+        self.assertEqual(mocked_get.call_count, 1)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker(failure_threshold=1, slow_call_threshold=1)
+        breaker.after_call(0.5)
+        self.assertFalse(breaker.is_open())
+        breaker.after_call(2)
+        self.assertTrue(breaker.is_open())
+
+    def test_shared_state(self):
+        breaker = CircuitBreaker(failure_threshold=1, cache_alias='default')
+        breaker.after_call(0, ConnectionError('Down'))
+        self.assertTrue(CircuitBreaker(cache_alias='default').is_open())
+        breaker.state.close()
+
+    def test_state_is_written_on_transitions(self):
+        breaker = CircuitBreaker(failure_threshold=3, cache_alias='default')
+        self.addCleanup(breaker.state.close)
+        with mock.patch.object(breaker.state, 'close', wraps=breaker.state.close) as mocked_close:
+            breaker.after_call(0)
+            self.assertEqual(mocked_close.call_count, 0)
+            breaker.after_call(0, ConnectionError('Down'))
+            breaker.after_call(0)
+            self.assertEqual(mocked_close.call_count, 1)
+            breaker.after_call(0)
+            self.assertEqual(mocked_close.call_count, 1)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('requests.Session.post')
+    def test_save_is_reconciled(self, mocked_post, mocked_get):
+        self.open_circuit(mocked_get)
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(mocked_post.call_count, 0)
+        self.assertIsNone(dummy.terralego_id)
+        operation = TerralegoOutbox.objects.get()
+        self.assertEqual(operation.operation, TerralegoOutbox.SAVE)
+        self.assertEqual(operation.object_id, str(dummy.pk))
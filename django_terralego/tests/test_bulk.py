@@ -0,0 +1,219 @@
+import json
+
+from copy import deepcopy
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.db.utils import ConnectionDoesNotExist
+from django.test import TestCase
+from requests import HTTPError
+
+from django_terralego import conf
+from django_terralego.models import TerralegoOutbox, TerralegoTag
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+from django_terralego.utils import bulk_update
+
+FAILING_ID = '00000000-0000-0000-0000-000000000000'
+
+
+def fake_delete(url, **kwargs):
+    if url.rstrip('/').endswith(FAILING_ID):
+        raise HTTPError('Server error')
+    return mock.MagicMock()
+
+
+def fake_post(url, data, **kwargs):
+    if data['geometry'] == 'POINT(0 0)':
+        raise HTTPError('Bad geometry')
+    entry = deepcopy(GEOJSON_SAMPLE)
+    entry['id'] = str(uuid4())
+    entry['properties']['tags'] = json.loads(data['tags'])
+    response = mock.MagicMock()
+    response.json.return_value = entry
+    return response
+
+
+class GeoDirectoryQuerySetTest(TestCase):
+    """ Test the bulk synchronization by mocking the actual requests. """
+
+    @mock.patch('requests.Session.post', side_effect=fake_post)
+    def test_bulk_create(self, mocked_post):
+        dummies = [Dummy(terralego_geometry='POINT(1 1)') for i in range(5)] + [Dummy()]
+        Dummy.objects.bulk_create(dummies)
+        self.assertEqual(mocked_post.call_count, 5)
+        self.assertEqual(Dummy.objects.count(), 6)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=False).count(), 5)
+        self.assertEqual(len(set(Dummy.objects.values_list('terralego_id', flat=True))), 6)
+
+    @mock.patch('requests.Session.post', side_effect=fake_post)
+    def test_bulk_create_without_commit(self, mocked_post):
+        Dummy.objects.bulk_create([Dummy(terralego_geometry='POINT(1 1)')], terralego_commit=False)
+        self.assertEqual(mocked_post.call_count, 0)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=True).count(), 1)
+
+    def test_bulk_update_uses_the_given_database(self):
+        dummy = Dummy(terralego_tags='["a"]')
+        dummy.save(terralego_commit=False)
+        dummy.terralego_tags = '["b"]'
+        with self.assertRaises(ConnectionDoesNotExist):
+            bulk_update(Dummy, [dummy], ['terralego_tags'], using='other')
+        bulk_update(Dummy, [dummy], ['terralego_tags'], using='default')
+        self.assertEqual(Dummy.objects.get().terralego_tags, '["b"]')
+
+    @mock.patch('requests.Session.post', side_effect=fake_post)
+    def test_bulk_save_to_terralego_returns_failures(self, mocked_post):
+        Dummy.objects.bulk_create([
+            Dummy(terralego_geometry='POINT(1 1)'),
+            Dummy(terralego_geometry='POINT(0 0)'),
+            Dummy(),
+        ], terralego_commit=False)
+        failures = Dummy.objects.bulk_save_to_terralego(chunk_size=1)
+        self.assertEqual(mocked_post.call_count, 2)
+        self.assertEqual(len(failures), 1)
+        obj, error = failures[0]
+        self.assertEqual(obj.terralego_geometry, 'POINT(0 0)')
+        self.assertIsInstance(error, HTTPError)
+        synced = Dummy.objects.get(terralego_id__isnull=False)
+        self.assertEqual(synced.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+        self.assertEqual(json.loads(synced.terralego_tags), ['django_terralego.Dummy'])
+
+
+class GeoDirectoryQuerySetDeleteTest(TestCase):
+    """ Test the bulk deletion by mocking the actual requests. """
+
+    def setUp(self):
+        Dummy.objects.bulk_create([
+            Dummy(terralego_geometry='POINT(1 1)', terralego_id=uuid4(), terralego_tags='["a"]') for i in range(3)
+        ] + [Dummy(terralego_geometry='POINT(1 1)')], terralego_commit=False)
+
+    @mock.patch('requests.Session.delete', side_effect=fake_delete)
+    def test_delete(self, mocked_delete):
+        Dummy.objects.all().delete()
+        self.assertEqual(mocked_delete.call_count, 3)
+        self.assertFalse(Dummy.objects.exists())
+        self.assertFalse(TerralegoTag.objects.exists())
+
+    @mock.patch('requests.Session.delete', side_effect=fake_delete)
+    def test_delete_without_commit(self, mocked_delete):
+        Dummy.objects.all().delete(terralego_commit=False)
+        self.assertEqual(mocked_delete.call_count, 0)
+        self.assertFalse(Dummy.objects.exists())
+
+    @mock.patch('requests.Session.delete', side_effect=fake_delete)
+    def test_deferred_delete(self, mocked_delete):
+        with mock.patch.dict(conf.TERRALEGO, {'DEFERRED': True}):
+            Dummy.objects.filter(terralego_id__isnull=False).delete()
+        self.assertEqual(mocked_delete.call_count, 0)
+        self.assertEqual(Dummy.objects.count(), 1)
+        self.assertEqual(TerralegoOutbox.objects.filter(operation=TerralegoOutbox.DELETE).count(), 3)
+
+    @mock.patch('requests.Session.delete', side_effect=fake_delete)
+    def test_delete_from_terralego_returns_failures(self, mocked_delete):
+        Dummy(terralego_geometry='POINT(1 1)', terralego_id=FAILING_ID).save(terralego_commit=False)
+        failures = Dummy.objects.delete_from_terralego(chunk_size=2)
+        self.assertEqual(mocked_delete.call_count, 4)
+        self.assertEqual(len(failures), 1)
+        terralego_id, error = failures[0]
+        self.assertEqual(str(terralego_id), FAILING_ID)
+        self.assertIsInstance(error, HTTPError)
+        self.assertEqual(list(Dummy.objects.filter(terralego_id__isnull=False).values_list('terralego_id', flat=True)),
+                         [terralego_id])
+        self.assertEqual(Dummy.objects.count(), 5)
+
+    def test_unlink_from_terralego(self):
+        # The generation is bumped after the commit from Django 1.9, see test_views
+        with self.assertNumQueries(4), mock.patch('django_terralego.models.bump_generation'):
+            # The tags and the update, in a savepoint
+            self.assertEqual(Dummy.objects.unlink_from_terralego(), 3)
+        self.assertFalse(Dummy.objects.filter(terralego_id__isnull=False).exists())
+        self.assertFalse(TerralegoTag.objects.exists())
+
+
+class GeoDirectoryQuerySetClosestTest(TestCase):
+    """ Test the batched closest requests by mocking the actual requests. """
+
+    def setUp(self):
+        self.dummies = []
+        for i in range(4):
+            dummy = Dummy(terralego_geometry='POINT(1 1)', terralego_id=uuid4())
+            dummy.save(terralego_commit=False)
+            self.dummies.append(dummy)
+        self.failing = Dummy(terralego_geometry='POINT(1 1)', terralego_id=FAILING_ID)
+        self.failing.save(terralego_commit=False)
+
+    def fake_get(self, url, **kwargs):
+        # The closest entry of each dummy is the next one
+        entry_id = url.rstrip('/').split('/')[-2]
+        if entry_id == FAILING_ID:
+            raise HTTPError('Server error')
+        ids = [str(dummy.terralego_id) for dummy in self.dummies]
+        entry = deepcopy(GEOJSON_SAMPLE)
+        entry['id'] = ids[(ids.index(entry_id) + 1) % len(ids)]
+        response = mock.MagicMock()
+        response.json.return_value = entry
+        return response
+
+    def test_closest_many(self):
+        with mock.patch('requests.Session.get', side_effect=self.fake_get) as mocked_get:
+            with self.assertNumQueries(3):  # The objects, then one query per chunk with entries
+                neighbours = Dummy.objects.closest_many(tags=['city'], chunk_size=2)
+        self.assertEqual(mocked_get.call_count, 5)
+        self.assertEqual(json.loads(mocked_get.call_args[1]['params']['tags']), ['city'])
+        self.assertEqual(len(neighbours), 5)
+        for i, dummy in enumerate(self.dummies):
+            self.assertEqual(neighbours[dummy], [self.dummies[(i + 1) % 4]])
+        self.assertEqual(neighbours[self.failing], [])
+
+
+class GeoDirectoryQuerySetPrefetchTest(TestCase):
+    """ Test the prefetch of the entries by mocking the actual requests. """
+
+    def setUp(self):
+        for i in range(3):
+            Dummy(terralego_geometry='POINT(1 1)', terralego_id=uuid4()).save(terralego_commit=False)
+        Dummy(terralego_geometry='POINT(1 1)').save(terralego_commit=False)
+
+    def fake_get(self, url, **kwargs):
+        entry = deepcopy(GEOJSON_SAMPLE)
+        entry['id'] = url.rstrip('/').split('/')[-1]
+        response = mock.MagicMock()
+        response.json.return_value = entry
+        return response
+
+    def test_prefetch_terralego(self):
+        with mock.patch('requests.Session.get', side_effect=self.fake_get) as mocked_get:
+            queryset = Dummy.objects.prefetch_terralego().filter(terralego_geometry__isnull=False).order_by('pk')
+            self.assertEqual(mocked_get.call_count, 0)
+            with self.assertNumQueries(1):
+                dummies = list(queryset)
+        self.assertEqual(mocked_get.call_count, 3)
+        for dummy in dummies[:3]:
+            self.assertEqual(dummy.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+            self.assertFalse(dummy.terralego_is_dirty())
+        self.assertEqual(dummies[3].terralego_geometry, 'POINT(1 1)')
+        # Nothing was saved
+        self.assertEqual(Dummy.objects.filter(terralego_geometry='POINT(1 1)').count(), 4)
+
+    def test_failures_are_skipped(self):
+        def fake_get(url, **kwargs):
+            if url.rstrip('/').endswith(str(failing.terralego_id)):
+                raise HTTPError('Server error')
+            return self.fake_get(url, **kwargs)
+
+        failing = Dummy.objects.filter(terralego_id__isnull=False).first()
+        with mock.patch('requests.Session.get', side_effect=fake_get):
+            dummies = {dummy.pk: dummy for dummy in Dummy.objects.prefetch_terralego()}
+        self.assertEqual(dummies[failing.pk].terralego_geometry, 'POINT(1 1)')
+        self.assertEqual(sum(dummy.terralego_geometry == GEOJSON_SAMPLE['geometry'] for dummy in dummies.values()), 2)
+
+    def test_without_prefetch(self):
+        with mock.patch('requests.Session.get') as mocked_get:
+            list(Dummy.objects.all())
+            Dummy.objects.prefetch_terralego().count()
+            list(Dummy.objects.prefetch_terralego().values_list('pk'))
+        self.assertEqual(mocked_get.call_count, 0)
@@ -0,0 +1,172 @@
+import json
+from copy import deepcopy
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from django_terralego import cache, conf
+from django_terralego.stats import counters
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+
+class EntryCacheTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(conf.TERRALEGO, {'CACHE': {'ALIAS': 'default', 'TIMEOUT': 60}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(caches['default'].clear)
+        counters.reset()
+        self.response = mock.MagicMock()
+        self.response.json.return_value = GEOJSON_SAMPLE
+
+    @mock.patch('requests.Session.get')
+    def test_read_through(self, mocked_get):
+        mocked_get.return_value = self.response
+        dummy = Dummy(terralego_id=GEOJSON_SAMPLE['id'])
+        dummy.update_from_terralego_entry()
+        dummy.update_from_terralego_entry()
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(dummy.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+        self.assertEqual(counters.get('cache_hits'), 1)
+        self.assertEqual(counters.get('cache_misses'), 1)
+
+    @mock.patch('requests.Session.put')
+    @mock.patch('requests.Session.get')
+    def test_invalidated_by_save(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        mocked_put.return_value = self.response
+        dummy = Dummy(terralego_id=GEOJSON_SAMPLE['id'])
+        dummy.update_from_terralego_entry()
+        dummy.terralego_geometry = 'POINT(1 1)'
+        dummy.save()
+        dummy.update_from_terralego_entry()
+        self.assertEqual(mocked_get.call_count, 2)
+
+    @mock.patch('requests.Session.delete')
+    @mock.patch('requests.Session.get')
+    def test_invalidated_by_delete(self, mocked_get, mocked_delete):
+        mocked_get.return_value = self.response
+        dummy = Dummy.objects.create(terralego_id=GEOJSON_SAMPLE['id'])
+        dummy.update_from_terralego_entry()
+        dummy.delete_from_terralego()
+        self.assertIsNone(caches['default'].get(cache.get_key(GEOJSON_SAMPLE['id'])))
+
+    @mock.patch('requests.Session.get')
+    def test_get_entries(self, mocked_get):
+        mocked_get.return_value = self.response
+        cache.get_entry(GEOJSON_SAMPLE['id'])
+        other_id = str(uuid4())
+        entries = cache.get_entries([GEOJSON_SAMPLE['id'], other_id])
+        self.assertEqual(set(entries), {GEOJSON_SAMPLE['id'], other_id})
+        self.assertEqual(mocked_get.call_count, 2)
+        self.assertEqual(counters.get('cache_hits'), 1)
+        self.assertEqual(counters.get('cache_misses'), 2)
+
+
+def fake_put(url, data, **kwargs):
+    entry = deepcopy(GEOJSON_SAMPLE)
+    entry['id'] = url.rstrip('/').split('/')[-1]
+    entry['properties']['tags'] = json.loads(data['tags'])
+    response = mock.MagicMock()
+    response.json.return_value = entry
+    return response
+
+
+@mock.patch('requests.Session.put', side_effect=fake_put)
+@mock.patch('requests.Session.get')
+class ClosestCacheTest(TestCase):
+    """ Test the closest results cache and its invalidation by the tag generations. """
+
+    def setUp(self):
+        patcher = mock.patch.dict(conf.TERRALEGO, {'CACHE': {'ALIAS': 'default', 'TIMEOUT': 60, 'CLOSEST': True}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(caches['default'].clear)
+        counters.reset()
+        self.response = mock.MagicMock()
+        self.response.json.return_value = GEOJSON_SAMPLE
+        self.origin = self.create_dummy(['django_terralego.Dummy'])
+        self.city = self.create_dummy(['django_terralego.Dummy', 'city'])
+        self.port = self.create_dummy(['django_terralego.Dummy', 'port'])
+
+    def create_dummy(self, tags):
+        dummy = Dummy(terralego_id=uuid4(), terralego_geometry={'type': 'Point', 'coordinates': [1, 1]},
+                      terralego_tags=json.dumps(tags))
+        dummy.save(terralego_commit=False)
+        return Dummy.objects.get(pk=dummy.pk)
+
+    def move(self, dummy):
+        longitude, latitude = dummy.terralego_geometry['coordinates']
+        dummy.terralego_geometry = {'type': 'Point', 'coordinates': [longitude + 1, latitude]}
+        dummy.save()
+
+    def test_cached(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['city'])
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(counters.get('closest_cache_hits'), 1)
+        self.assertEqual(counters.get('closest_cache_misses'), 1)
+
+    def test_invalidated_by_entries_with_the_tags(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['city'])
+        self.move(self.port)
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 1)
+        self.move(self.city)
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 2)
+        # Every entry is a candidate without tags
+        self.origin.closest()
+        self.move(self.port)
+        self.origin.closest()
+        self.assertEqual(mocked_get.call_count, 4)
+
+    def test_invalidated_by_removed_tags(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['city'])
+        self.city.terralego_tags = json.dumps(['django_terralego.Dummy'])
+        self.city.save()
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 2)
+
+    def test_invalidated_by_the_entry(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['city'])
+        self.move(self.origin)
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 2)
+
+    @mock.patch('requests.Session.delete')
+    def test_invalidated_by_delete(self, mocked_delete, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['port'])
+        Dummy.objects.filter(pk=self.port.pk).delete()
+        self.origin.closest(tags=['port'])
+        self.assertEqual(mocked_get.call_count, 2)
+        self.city.delete_from_terralego()
+        self.origin.closest(tags=['port'])
+        self.assertEqual(mocked_get.call_count, 2)
+
+    def test_unknown_tags(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['city'])
+        cache.invalidate_closest([(uuid4(), None)])
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 2)
+
+    def test_evicted_generation(self, mocked_get, mocked_put):
+        mocked_get.return_value = self.response
+        self.origin.closest(tags=['city'])
+        caches['default'].delete(cache.get_generation_key('tag:city'))
+        self.origin.closest(tags=['city'])
+        self.assertEqual(mocked_get.call_count, 2)
@@ -0,0 +1,82 @@
+from unittest import skipIf
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import TestCase
+
+from django_terralego.fields import RawGeometry, get_coordinates, np, pack_geometry, unpack_geometry
+from django_terralego.tests.models import CompactGeometry, Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+GEOMETRIES = [
+    {'type': 'Point', 'coordinates': [1.5, 2.5]},
+    {'type': 'LineString', 'coordinates': [[0, 0], [1, 1], [2, 0]]},
+    {'type': 'Polygon', 'coordinates': [[[0, 0], [4, 0], [4, 4], [0, 0]], [[1, 1], [2, 1], [2, 2], [1, 1]]]},
+    {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 0]]], [[[5, 5], [6, 5], [6, 6], [5, 5]]]]},
+    {'type': 'GeometryCollection', 'geometries': [
+        {'type': 'Point', 'coordinates': [1, 2, 3]},
+        {'type': 'MultiPoint', 'coordinates': [[4, 5, 6], [7, 8, 9]]},
+    ]},
+]
+
+
+class LazyGeometryFieldTest(TestCase):
+    """ Test the lazy decoding of the geometries. """
+
+    def setUp(self):
+        Dummy(terralego_geometry=GEOJSON_SAMPLE['geometry'], terralego_id=GEOJSON_SAMPLE['id']).save(
+            terralego_commit=False)
+
+    def test_decoded_on_access(self):
+        dummy = Dummy.objects.get()
+        self.assertIsInstance(dummy.__dict__['terralego_geometry'], RawGeometry)
+        self.assertEqual(dummy.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+        self.assertEqual(dummy.__dict__['terralego_geometry'], GEOJSON_SAMPLE['geometry'])
+
+    @mock.patch('requests.Session.put')
+    def test_save_without_access(self, mocked_put):
+        dummy = Dummy.objects.get()
+        self.assertFalse(dummy.terralego_is_dirty())
+        dummy.save()
+        self.assertEqual(mocked_put.call_count, 0)
+        self.assertIsInstance(dummy.__dict__['terralego_geometry'], RawGeometry)
+        self.assertEqual(Dummy.objects.get().terralego_geometry, GEOJSON_SAMPLE['geometry'])
+
+    def test_dirty_after_change(self):
+        dummy = Dummy.objects.get()
+        dummy.terralego_geometry['coordinates'] = [0, 0]
+        self.assertTrue(dummy.terralego_is_dirty())
+        dummy = Dummy.objects.get()
+        dummy.terralego_geometry = GEOJSON_SAMPLE['geometry']
+        self.assertFalse(dummy.terralego_is_dirty())
+
+    def test_deferred(self):
+        dummy = Dummy.objects.defer('terralego_geometry').get()
+        self.assertEqual(dummy.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+
+
+class CompactGeometryFieldTest(TestCase):
+    """ Test the packed storage of the geometries. """
+
+    def test_pack_unpack(self):
+        for geometry in GEOMETRIES:
+            self.assertEqual(unpack_geometry(pack_geometry(geometry)), geometry)
+
+    def test_storage(self):
+        for geometry in GEOMETRIES:
+            CompactGeometry.objects.create(geometry=geometry)
+        CompactGeometry.objects.create(geometry=None)
+        self.assertEqual([obj.geometry for obj in CompactGeometry.objects.order_by('pk')], GEOMETRIES + [None])
+        packed = CompactGeometry.objects.values_list('geometry', flat=True).order_by('pk')[0]
+        self.assertEqual(bytes(packed), pack_geometry(GEOMETRIES[0]))
+
+    @skipIf(np is None, 'NumPy is not installed')
+    def test_get_coordinates(self):
+        packed = pack_geometry(GEOMETRIES[2])
+        coordinates = get_coordinates(packed)
+        self.assertEqual(coordinates.shape, (8, 2))
+        self.assertEqual(coordinates[1].tolist(), [4, 0])
+        self.assertFalse(coordinates.flags.owndata)
@@ -1,6 +1,7 @@
 import json
 
 from copy import deepcopy
+from uuid import uuid4
 
 try:
     from unittest import mock
@@ -9,7 +10,9 @@ except ImportError:
 
 from django.test import TestCase
 
+from django_terralego.stats import counters
 from django_terralego.tests.models import Dummy
+from django_terralego.utils import convert_geodirectory_entries
 
 GEOJSON_SAMPLE = {
     "id": "6af234fb-ec81-4189-ab6b-ac9b1483e665",
@@ -39,13 +42,13 @@ GEOJSON_SAMPLE = {
 class GeoDirectoryMixinTest(TestCase):
     """ Test the mixins by mocking the actual requests. """
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_save_without_geo_info(self, mocked_post):
         dummy = Dummy()
         dummy.save()
         self.assertEqual(mocked_post.call_count, 0)
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_save_with_geo_info(self, mocked_post):
         mocked_response = mock.MagicMock()
         mocked_response.json.return_value = GEOJSON_SAMPLE
@@ -58,7 +61,7 @@ class GeoDirectoryMixinTest(TestCase):
         self.assertEqual(dummy.terralego_tags, json.dumps(GEOJSON_SAMPLE['properties']['tags']))
         self.assertEqual(mocked_post.call_count, 1)
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     def test_retrieve_geo_info(self, mocked_get):
         mocked_response = mock.MagicMock()
         mocked_response.json.return_value = GEOJSON_SAMPLE
@@ -69,7 +72,7 @@ class GeoDirectoryMixinTest(TestCase):
         self.assertEqual(dummy.terralego_tags, json.dumps(GEOJSON_SAMPLE['properties']['tags']))
         self.assertEqual(mocked_get.call_count, 1)
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_save_without_model_path_in_tags(self, mocked_post):
         mocked_response = mock.MagicMock()
         mocked_response.json.return_value = GEOJSON_SAMPLE
@@ -82,7 +85,7 @@ class GeoDirectoryMixinTest(TestCase):
         tags = mocked_post.mock_calls[0][2]['data']['tags']
         self.assertEqual(tags, json.dumps(['django_terralego.Dummy']))
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_save_with_model_path_in_wrong_position_in_tags(self, mocked_post):
         mocked_response = mock.MagicMock()
         mocked_response.json.return_value = GEOJSON_SAMPLE
@@ -95,7 +98,7 @@ class GeoDirectoryMixinTest(TestCase):
         tags = mocked_post.mock_calls[0][2]['data']['tags']
         self.assertEqual(tags, json.dumps(['django_terralego.Dummy', 'test']))
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     def test_closest_with_right_tag(self, mocked_get):
         mocked_response = mock.MagicMock()
         mocked_response.json.return_value = GEOJSON_SAMPLE
@@ -106,7 +109,7 @@ class GeoDirectoryMixinTest(TestCase):
         self.assertEqual(entry, dummy)
         self.assertEqual(mocked_get.call_count, 1)
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     def test_closest_with_bad_tag(self, mocked_get):
         mocked_response = mock.MagicMock()
         return_value = deepcopy(GEOJSON_SAMPLE)
@@ -118,3 +121,71 @@ class GeoDirectoryMixinTest(TestCase):
         self.assertIsInstance(entry, dict)
         self.assertDictEqual(entry, return_value)
         self.assertEqual(mocked_get.call_count, 1)
+
+
+class DirtyTrackingTest(TestCase):
+    """ Test that terralego is only requested when the geometry or the tags changed. """
+
+    def setUp(self):
+        counters.reset()
+        dummy = Dummy(
+            terralego_id=GEOJSON_SAMPLE['id'],
+            terralego_geometry=GEOJSON_SAMPLE['geometry'],
+            terralego_tags=json.dumps(GEOJSON_SAMPLE['properties']['tags']),
+        )
+        dummy.save(terralego_commit=False)
+        self.dummy = Dummy.objects.get(pk=dummy.pk)
+
+    @mock.patch('requests.Session.put')
+    def test_save_without_changes(self, mocked_put):
+        self.dummy.save()
+        self.assertEqual(mocked_put.call_count, 0)
+        self.assertEqual(counters.get('sync_skipped'), 1)
+
+    @mock.patch('requests.Session.put')
+    def test_save_with_changed_geometry(self, mocked_put):
+        mocked_response = mock.MagicMock()
+        mocked_response.json.return_value = GEOJSON_SAMPLE
+        mocked_put.return_value = mocked_response
+        self.dummy.terralego_geometry = 'POINT(1 1)'
+        self.dummy.save()
+        self.assertEqual(mocked_put.call_count, 1)
+        self.assertEqual(counters.get('sync_performed'), 1)
+        # Synced with the response, nothing to do anymore
+        self.dummy.save()
+        self.assertEqual(mocked_put.call_count, 1)
+
+    @mock.patch('requests.Session.put')
+    def test_save_with_changed_tags(self, mocked_put):
+        mocked_response = mock.MagicMock()
+        mocked_response.json.return_value = GEOJSON_SAMPLE
+        mocked_put.return_value = mocked_response
+        self.dummy.terralego_tags = json.dumps(['titi'])
+        self.dummy.save(update_fields=['terralego_tags'])
+        self.assertEqual(mocked_put.call_count, 1)
+        self.assertIsNotNone(Dummy.objects.get(pk=self.dummy.pk).terralego_last_update)
+
+    @mock.patch('requests.Session.put')
+    def test_save_with_update_fields_without_geo_info(self, mocked_put):
+        self.dummy.terralego_geometry = 'POINT(1 1)'
+        self.dummy.save(update_fields=['terralego_last_update'])
+        self.assertEqual(mocked_put.call_count, 0)
+
+
+class ConvertGeodirectoryEntriesTest(TestCase):
+
+    def test_one_query_per_model(self):
+        dummies = [Dummy.objects.create(terralego_id=uuid4()) for i in range(3)]
+        entries = []
+        for dummy in reversed(dummies):
+            entry = deepcopy(GEOJSON_SAMPLE)
+            entry['id'] = str(dummy.terralego_id)
+            entries.append(entry)
+        unknown = deepcopy(GEOJSON_SAMPLE)
+        unknown['id'] = str(uuid4())
+        untagged = deepcopy(GEOJSON_SAMPLE)
+        untagged['properties']['tags'] = ['toto']
+        entries += [unknown, untagged]
+        with self.assertNumQueries(1):
+            result = convert_geodirectory_entries(entries, only=['terralego_tags'])
+        self.assertEqual(result, list(reversed(dummies)) + [unknown, untagged])
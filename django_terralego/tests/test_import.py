@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from django_terralego.management.commands import import_geodirectory
+from django_terralego.management.commands.import_geodirectory import iter_feature_collection, iter_ndjson
+from django_terralego.models import TerralegoImportChunk
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_bulk import fake_post
+
+FEATURES = [
+    {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [i, i]},
+        'properties': {'name': 'Épinal {0}'.format(i), 'tags': ['city']},
+    }
+    for i in range(5)
+]
+
+
+class GeoJSONParsingTest(TestCase):
+    """ Test the streaming parsers. """
+
+    def test_feature_collection(self):
+        content = json.dumps({'type': 'FeatureCollection', 'features': FEATURES}, ensure_ascii=False).encode('utf-8')
+        results = list(iter_feature_collection(BytesIO(content), block_size=7))
+        self.assertEqual([feature for feature, offset in results], FEATURES)
+        # Resume after the second feature
+        resumed = list(iter_feature_collection(BytesIO(content), offset=results[1][1], block_size=7))
+        self.assertEqual([feature for feature, offset in resumed], FEATURES[2:])
+        # Many features decoded from one block, at the same offsets
+        self.assertEqual(list(iter_feature_collection(BytesIO(content))), results)
+
+    def test_ndjson(self):
+        content = '\n'.join(json.dumps(feature) for feature in FEATURES).encode('utf-8') + b'\n\n'
+        results = list(iter_ndjson(BytesIO(content)))
+        self.assertEqual([feature for feature, offset in results], FEATURES)
+        resumed = list(iter_ndjson(BytesIO(content), offset=results[2][1]))
+        self.assertEqual([feature for feature, offset in resumed], FEATURES[3:])
+
+
+@mock.patch('requests.Session.post', side_effect=fake_post)
+class ImportGeodirectoryTest(TestCase):
+    """ Test the import command by mocking the actual requests. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'features.geojson')
+        with open(self.path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': FEATURES}, f)
+
+    def test_import(self, mocked_post):
+        out = StringIO()
+        call_command('import_geodirectory', 'django_terralego.Dummy', self.path, '--chunk-size=2', '--tag=imported',
+                     '--map', 'tags=terralego_tags',
+                     stdout=out)
+        self.assertEqual(mocked_post.call_count, 5)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=False).count(), 5)
+        tags = json.loads(Dummy.objects.first().terralego_tags)
+        self.assertEqual(tags, ['django_terralego.Dummy', 'imported', 'city'])
+        self.assertIn('5 features imported, 0 failed to sync', out.getvalue())
+
+    def test_invalid_mapping(self, mocked_post):
+        with self.assertRaises(CommandError):
+            call_command('import_geodirectory', 'django_terralego.Dummy', self.path, '--map', 'name=name',
+                         stdout=StringIO())
+        self.assertEqual(Dummy.objects.count(), 0)
+
+    def test_import_without_sync(self, mocked_post):
+        path = os.path.join(self.directory, 'features.ndjson')
+        with open(path, 'w') as f:
+            f.write('\n'.join(json.dumps(feature) for feature in FEATURES))
+        call_command('import_geodirectory', 'django_terralego.Dummy', path, '--no-sync', stdout=StringIO())
+        self.assertEqual(mocked_post.call_count, 0)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=True).count(), 5)
+        self.assertEqual(Dummy.objects.first().terralego_geometry, FEATURES[0]['geometry'])
+
+    def test_resume(self, mocked_post):
+        import_chunk = import_geodirectory.import_chunk
+        calls = []
+
+        def crash_on_second_chunk(args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return import_chunk(args)
+
+        with mock.patch.object(import_geodirectory, 'import_chunk', side_effect=crash_on_second_chunk):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('import_geodirectory', 'django_terralego.Dummy', self.path, '--chunk-size=2',
+                             '--checkpoint', 'places', stdout=StringIO())
+        self.assertEqual(Dummy.objects.count(), 2)
+        out = StringIO()
+        call_command('import_geodirectory', 'django_terralego.Dummy', self.path, '--chunk-size=2',
+                     '--checkpoint', 'places', stdout=out)
+        self.assertIn('Resuming after 2 features', out.getvalue())
+        self.assertEqual(Dummy.objects.count(), 5)
+        with self.assertRaises(CommandError):
+            call_command('import_geodirectory', 'django_terralego.Dummy', self.directory, '--checkpoint', 'places',
+                         stdout=StringIO())
+
+    def test_resume_after_later_chunks(self, mocked_post):
+        # e.g. with processes, the third chunk was inserted before the crash but not the second one
+        with open(self.path, 'rb') as stream:
+            offsets = [end for feature, end in iter_feature_collection(stream)]
+        import_geodirectory.import_chunk(
+            ('django_terralego.Dummy', FEATURES[:2], {}, [], 1, False, ('places', self.path, 0, offsets[1])))
+        import_geodirectory.import_chunk(
+            ('django_terralego.Dummy', FEATURES[4:], {}, [], 1, False, ('places', self.path, offsets[3], offsets[4])))
+        out = StringIO()
+        call_command('import_geodirectory', 'django_terralego.Dummy', self.path, '--chunk-size=2', '--no-sync',
+                     '--checkpoint', 'places', stdout=out)
+        self.assertIn('Resuming after 3 features', out.getvalue())
+        self.assertIn('2 features imported', out.getvalue())
+        self.assertEqual(
+            sorted(dummy.terralego_geometry['coordinates'][0] for dummy in Dummy.objects.all()), [0, 1, 2, 3, 4])
+        self.assertEqual(TerralegoImportChunk.objects.filter(checkpoint='places').count(), 3)
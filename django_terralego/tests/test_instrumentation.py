@@ -0,0 +1,79 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from requests import HTTPError
+
+from django_terralego import conf, geodirectory
+from django_terralego.instrumentation import get_latency_histogram
+from django_terralego.middleware import TerralegoStatsMiddleware
+from django_terralego.signals import post_terralego_call, pre_terralego_call
+from django_terralego.stats import counters
+from django_terralego.utils import run_concurrently
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+
+@mock.patch('requests.Session.get')
+class InstrumentationTest(SimpleTestCase):
+
+    def setUp(self):
+        counters.reset()
+        self.response = mock.MagicMock()
+        self.response.json.return_value = GEOJSON_SAMPLE
+        self.response.content = b'{"id": "1"}'
+
+    def test_counters(self, mocked_get):
+        mocked_get.return_value = self.response
+        geodirectory.get_entry('1')
+        geodirectory.get_entry('1')
+        self.assertEqual(counters.get('calls.get'), 2)
+        self.assertEqual(counters.get('response_bytes.get'), 22)
+        self.assertEqual(counters.get('errors.get'), 0)
+        self.assertEqual(get_latency_histogram('get')[-1], (float('inf'), 2))
+
+    def test_signals(self, mocked_get):
+        mocked_get.return_value = self.response
+        self.response.raise_for_status.side_effect = HTTPError('Not found')
+        pre_receiver, post_receiver = mock.MagicMock(), mock.MagicMock()
+        pre_terralego_call.connect(pre_receiver)
+        post_terralego_call.connect(post_receiver)
+        self.addCleanup(pre_terralego_call.disconnect, pre_receiver)
+        self.addCleanup(post_terralego_call.disconnect, post_receiver)
+        with self.assertRaises(HTTPError):
+            geodirectory.closest('1', ['toto'])
+        self.assertEqual(pre_receiver.call_args[1]['operation'], 'closest')
+        self.assertIsInstance(post_receiver.call_args[1]['error'], HTTPError)
+        self.assertEqual(counters.get('errors.closest'), 1)
+
+    @mock.patch.dict(conf.TERRALEGO, {'SLOW_CALL_THRESHOLD': 0})
+    def test_slow_calls_are_logged(self, mocked_get):
+        mocked_get.return_value = self.response
+        with mock.patch('django_terralego.instrumentation.logger') as mocked_logger:
+            geodirectory.get_entry('1')
+        self.assertEqual(mocked_logger.warning.call_count, 1)
+
+    def test_middleware(self, mocked_get):
+        mocked_get.return_value = self.response
+
+        def view(request):
+            geodirectory.get_entry('1')
+            geodirectory.get_entry('2')
+            return HttpResponse()
+
+        middleware = TerralegoStatsMiddleware(view)
+        response = middleware(RequestFactory().get('/'))
+        self.assertRegex(response['Server-Timing'], r'^terralego;dur=[0-9.]+;desc="2 calls"$')
+
+    def test_middleware_collects_concurrent_calls(self, mocked_get):
+        mocked_get.return_value = self.response
+
+        def view(request):
+            run_concurrently(geodirectory.get_entry, ['1', '2', '3'], 3)
+            return HttpResponse()
+
+        middleware = TerralegoStatsMiddleware(view)
+        response = middleware(RequestFactory().get('/'))
+        self.assertRegex(response['Server-Timing'], r'desc="3 calls"$')
@@ -0,0 +1,210 @@
+from datetime import timedelta
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase
+from django.utils import timezone
+from requests import HTTPError
+
+from django_terralego import conf
+from django_terralego.models import TerralegoOutbox
+from django_terralego.outbox import get_ready_operations, process_outbox
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+
+@mock.patch.dict(conf.TERRALEGO, {'DEFERRED': True})
+class TerralegoOutboxTest(TestCase):
+    """ Test the deferred mode by mocking the actual requests. """
+
+    def setUp(self):
+        self.response = mock.MagicMock()
+        self.response.json.return_value = GEOJSON_SAMPLE
+
+    @mock.patch('requests.Session.post')
+    def test_save_writes_outbox(self, mocked_post):
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(mocked_post.call_count, 0)
+        operation = TerralegoOutbox.objects.get()
+        self.assertEqual(operation.operation, TerralegoOutbox.SAVE)
+        self.assertEqual(operation.object_id, str(dummy.pk))
+
+    @mock.patch('requests.Session.post')
+    def test_rollback_drops_outbox(self, mocked_post):
+        try:
+            with transaction.atomic():
+                Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(TerralegoOutbox.objects.exists())
+
+    def test_skip_locked_fallback(self):
+        with mock.patch('django.db.models.query.QuerySet.select_for_update', autospec=True) as mocked_select:
+            mocked_select.side_effect = lambda queryset, **kwargs: queryset
+            with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False, create=True):
+                get_ready_operations(10)
+            self.assertEqual(mocked_select.call_args[1], {})
+            with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True, create=True):
+                get_ready_operations(10)
+            self.assertEqual(mocked_select.call_args[1], {'skip_locked': True})
+
+    @mock.patch('requests.Session.put')
+    @mock.patch('requests.Session.post')
+    def test_created_entry_is_updated(self, mocked_post, mocked_put):
+        mocked_post.return_value = self.response
+        mocked_put.return_value = self.response
+        dummy = Dummy.objects.create(terralego_geometry='POINT(1 1)')
+        # A second operation of the same object, processed after the first one
+        TerralegoOutbox.objects.enqueue(dummy, TerralegoOutbox.SAVE)
+        first, second = TerralegoOutbox.objects.order_by('pk')
+        second.next_attempt = timezone.now() + timedelta(hours=1)
+        second.save()
+        self.assertEqual(process_outbox(), (1, 0))
+        TerralegoOutbox.objects.update(next_attempt=timezone.now())
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(mocked_put.call_count, 1)
+
+    @mock.patch('requests.Session.post')
+    def test_process_collapses_operations(self, mocked_post):
+        mocked_post.return_value = self.response
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        dummy.save()
+        dummy.save()
+        self.assertEqual(TerralegoOutbox.objects.count(), 3)
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertFalse(TerralegoOutbox.objects.exists())
+        dummy.refresh_from_db()
+        self.assertEqual(str(dummy.terralego_id), GEOJSON_SAMPLE['id'])
+
+    @mock.patch('requests.Session.delete')
+    @mock.patch('requests.Session.post')
+    def test_delete_after_save(self, mocked_post, mocked_delete):
+        dummy = Dummy.objects.create(
+            terralego_id=GEOJSON_SAMPLE['id'], terralego_geometry='POINT(-104.590948 38.319914)')
+        dummy.delete()
+        self.assertEqual(mocked_delete.call_count, 0)
+        call_command('terralego_sync', once=True, stdout=mock.MagicMock())
+        self.assertEqual(mocked_post.call_count, 0)
+        self.assertEqual(mocked_delete.call_count, 1)
+        self.assertFalse(TerralegoOutbox.objects.exists())
+
+    @mock.patch('requests.Session.post')
+    def test_claimed_object_is_skipped(self, mocked_post):
+        def fake_post(*args, **kwargs):
+            # Another worker, while the request is made
+            self.assertEqual(process_outbox(), (0, 0))
+            return self.response
+        mocked_post.side_effect = fake_post
+        Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertFalse(TerralegoOutbox.objects.exists())
+
+    @mock.patch('requests.Session.post')
+    def test_expired_claim_is_processed(self, mocked_post):
+        mocked_post.return_value = self.response
+        Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        TerralegoOutbox.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(process_outbox(), (1, 0))
+
+    @mock.patch('requests.Session.post')
+    def test_edit_during_request_is_kept(self, mocked_post):
+        def fake_post(*args, **kwargs):
+            Dummy.objects.filter(pk=dummy.pk).update(terralego_tags='["edited"]')
+            return self.response
+        mocked_post.side_effect = fake_post
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(process_outbox(), (1, 0))
+        dummy.refresh_from_db()
+        self.assertEqual(str(dummy.terralego_id), GEOJSON_SAMPLE['id'])
+        self.assertEqual(dummy.terralego_tags, '["edited"]')
+
+    @mock.patch('requests.Session.delete')
+    @mock.patch('requests.Session.post')
+    def test_delete_instance_synced_since(self, mocked_post, mocked_delete):
+        mocked_post.return_value = self.response
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        process_outbox()
+        # The instance in memory does not know the entry created by the worker
+        self.assertIsNone(dummy.terralego_id)
+        dummy.delete()
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(mocked_delete.call_count, 1)
+        self.assertIn(GEOJSON_SAMPLE['id'], mocked_delete.call_args[0][0])
+
+    @mock.patch('requests.Session.delete')
+    @mock.patch('requests.Session.post')
+    def test_delete_during_request(self, mocked_post, mocked_delete):
+        def fake_post(*args, **kwargs):
+            Dummy.objects.get(pk=dummy.pk).delete()
+            return self.response
+        mocked_post.side_effect = fake_post
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(mocked_delete.call_count, 1)
+        self.assertIn(GEOJSON_SAMPLE['id'], mocked_delete.call_args[0][0])
+        self.assertFalse(TerralegoOutbox.objects.exists())
+
+    @mock.patch('requests.Session.delete')
+    @mock.patch('requests.Session.post')
+    def test_delete_before_sync(self, mocked_post, mocked_delete):
+        Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)').delete()
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(mocked_post.call_count, 0)
+        self.assertEqual(mocked_delete.call_count, 0)
+
+    @mock.patch('requests.Session.post', side_effect=HTTPError('Unavailable'))
+    def test_failure_backoff(self, mocked_post):
+        Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(process_outbox(), (0, 1))
+        operation = TerralegoOutbox.objects.get()
+        self.assertEqual(operation.attempts, 1)
+        self.assertEqual(operation.last_error, 'Unavailable')
+        self.assertGreater(operation.next_attempt, timezone.now() + timedelta(seconds=20))
+        self.assertIsNone(operation.claimed_until)
+        self.assertEqual(process_outbox(), (0, 0))
+
+    @mock.patch('django_terralego.outbox.logger')
+    @mock.patch('requests.Session.post')
+    def test_invalid_row_does_not_stick_the_queue(self, mocked_post, mocked_logger):
+        mocked_post.return_value = self.response
+        invalid = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)', terralego_tags='invalid')
+        valid = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        self.assertEqual(process_outbox(), (1, 1))
+        self.assertTrue(TerralegoOutbox.objects.filter(object_id=str(invalid.pk), attempts=1).exists())
+        self.assertFalse(TerralegoOutbox.objects.filter(object_id=str(valid.pk)).exists())
+        self.assertEqual(mocked_logger.exception.call_count, 1)
+
+    @mock.patch('django_terralego.outbox.logger')
+    def test_unknown_model(self, mocked_logger):
+        Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        with mock.patch('django.contrib.contenttypes.models.ContentType.model_class', return_value=None):
+            self.assertEqual(process_outbox(), (0, 1))
+        self.assertTrue(TerralegoOutbox.objects.get().last_error)
+
+    @mock.patch('requests.Session.post')
+    def test_max_attempts(self, mocked_post):
+        mocked_post.side_effect = HTTPError('Bad request')
+        dummy = Dummy.objects.create(terralego_geometry='POINT(-104.590948 38.319914)')
+        with mock.patch.dict(conf.TERRALEGO, {'OUTBOX_MAX_ATTEMPTS': 2}):
+            for i in range(3):
+                TerralegoOutbox.objects.update(next_attempt=timezone.now())
+                process_outbox()
+            self.assertEqual(mocked_post.call_count, 2)
+            operation = TerralegoOutbox.objects.dead().get()
+            self.assertEqual(operation.last_error, 'Bad request')
+            # A later operation of the object supersedes it
+            mocked_post.side_effect = None
+            mocked_post.return_value = self.response
+            dummy.save()
+            self.assertEqual(process_outbox(), (1, 0))
+        self.assertFalse(TerralegoOutbox.objects.exists())
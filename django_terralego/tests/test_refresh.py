@@ -0,0 +1,66 @@
+import json
+
+from copy import deepcopy
+from datetime import timedelta
+from io import StringIO
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+ORIGIN = {'type': 'Point', 'coordinates': [0, 0]}
+
+
+def fake_get(url, **kwargs):
+    entry = deepcopy(GEOJSON_SAMPLE)
+    entry['id'] = url.rstrip('/').split('/')[-1]
+    response = mock.MagicMock()
+    response.json.return_value = entry
+    return response
+
+
+class RefreshFromTerralegoTest(TestCase):
+
+    def setUp(self):
+        old = timezone.now() - timedelta(days=2)
+        Dummy.objects.bulk_create([
+            Dummy(
+                terralego_id=uuid4(),
+                terralego_last_update=old,
+                terralego_geometry=GEOJSON_SAMPLE['geometry'],
+                terralego_tags=json.dumps(GEOJSON_SAMPLE['properties']['tags']),
+            ),
+            Dummy(terralego_id=uuid4(), terralego_last_update=old, terralego_geometry=ORIGIN),
+            Dummy(terralego_id=uuid4(), terralego_last_update=timezone.now(), terralego_geometry=ORIGIN),
+            Dummy(),
+        ], terralego_commit=False)
+        self.unchanged, self.changed, self.recent = Dummy.objects.order_by('pk')[:3]
+
+    @mock.patch('requests.Session.get', side_effect=fake_get)
+    def test_refresh_queryset(self, mocked_get):
+        updated, failures = Dummy.objects.refresh_from_terralego(chunk_size=2)
+        self.assertEqual(mocked_get.call_count, 3)
+        self.assertEqual((updated, failures), (2, []))
+        self.changed.refresh_from_db()
+        self.assertEqual(self.changed.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+
+    @mock.patch('requests.Session.get', side_effect=fake_get)
+    def test_command_older_than(self, mocked_get):
+        stdout = StringIO()
+        call_command('refresh_from_terralego', 'django_terralego.Dummy', older_than=24, stdout=stdout)
+        self.assertEqual(mocked_get.call_count, 2)
+        self.assertIn('2 rows checked, 1 updated, 0 failed', stdout.getvalue())
+        self.recent.refresh_from_db()
+        self.assertEqual(self.recent.terralego_geometry, ORIGIN)
+        # The unchanged row was checked too, it is not requested again
+        call_command('refresh_from_terralego', 'django_terralego.Dummy', older_than=24, stdout=StringIO())
+        self.assertEqual(mocked_get.call_count, 2)
@@ -0,0 +1,39 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import SimpleTestCase
+
+from django_terralego import conf, geodirectory
+from django_terralego.session import get_session, get_timeout, reset_session
+
+
+class SessionTest(SimpleTestCase):
+
+    def tearDown(self):
+        reset_session()
+
+    def test_session_is_shared(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_session_is_rebuilt_after_fork(self):
+        session = get_session()
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(get_session(), session)
+
+    @mock.patch.dict(conf.TERRALEGO, {'POOL_SIZE': 42, 'RETRIES': 5})
+    def test_pool_and_retries(self):
+        reset_session()
+        adapter = get_session().get_adapter('https://terralego.fr/')
+        self.assertEqual(adapter._pool_maxsize, 42)
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertTrue(adapter.max_retries.is_retry('PUT', 503))
+        self.assertFalse(adapter.max_retries.is_retry('POST', 503))
+
+    @mock.patch.dict(conf.TERRALEGO, {'TIMEOUT': 5, 'TIMEOUTS': {'closest': 1}})
+    @mock.patch('requests.Session.get')
+    def test_timeouts(self, mocked_get):
+        self.assertEqual(get_timeout('create'), 5)
+        geodirectory.closest('123', ['toto'])
+        self.assertEqual(mocked_get.mock_calls[0][2]['timeout'], 1)
@@ -0,0 +1,103 @@
+import json
+import math
+from copy import deepcopy
+from unittest import skipIf
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from django_terralego.simplify import count_vertices, get_importances, np, reduce_geometry
+from django_terralego.stats import counters
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+SINE = {'type': 'LineString', 'coordinates': [[i / 100, math.sin(i / 100)] for i in range(1000)]}
+SQUARE = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0.0000001], [2, 0], [2, 2], [0, 2], [0, 0]]]}
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class ReduceGeometryTest(SimpleTestCase):
+    """ Test the simplification and the rounding of the geometries. """
+
+    def test_importances(self):
+        importances = get_importances(np.array([[0, 0], [1, 1], [2, 0], [3, 0.5], [4, 0]]))
+        self.assertEqual(importances[[0, -1]].tolist(), [float('inf')] * 2)
+        self.assertEqual(importances[1], 1)
+        # Capped by the importance of the vertex splitting the line before it
+        self.assertLessEqual(importances[3], importances[1])
+
+    def test_tolerance(self):
+        reduced = reduce_geometry(SINE, tolerance=0.001)
+        self.assertLess(count_vertices(reduced), 200)
+        self.assertEqual(reduced['coordinates'][0], SINE['coordinates'][0])
+        self.assertEqual(reduced['coordinates'][-1], SINE['coordinates'][-1])
+
+    def test_max_vertices(self):
+        self.assertEqual(count_vertices(reduce_geometry(SINE, max_vertices=10)), 10)
+        collection = {'type': 'GeometryCollection', 'geometries': [{'type': 'Point', 'coordinates': [1, 2]}, SINE]}
+        self.assertEqual(count_vertices(reduce_geometry(collection, max_vertices=5)), 5)
+
+    def test_rings_keep_four_positions(self):
+        self.assertEqual(reduce_geometry(SQUARE, max_vertices=2)['coordinates'], [[[0, 0], [2, 0], [2, 2], [0, 0]]])
+
+    def test_precision(self):
+        reduced = reduce_geometry(SQUARE, precision=3)
+        # The rounded duplicates are dropped, the collinear vertices are kept without a tolerance
+        self.assertEqual(reduced['coordinates'], [[[0, 0], [1, 0], [2, 0], [2, 2], [0, 2], [0, 0]]])
+        self.assertEqual(reduce_geometry({'type': 'Point', 'coordinates': [1.23456, 2]}, precision=2)['coordinates'],
+                         [1.23, 2])
+
+
+@skipIf(np is None, 'NumPy is not installed')
+@mock.patch.object(Dummy, 'terralego_max_vertices', 10)
+class ModelReductionTest(TestCase):
+    """ Test the reduction of the geometries sent to terralego by mocking the actual requests. """
+
+    def setUp(self):
+        counters.reset()
+
+    @mock.patch('requests.Session.post')
+    def test_reduced_before_upload(self, mocked_post):
+        sent = {}
+
+        def fake_post(url, data, **kwargs):
+            sent['geometry'] = json.loads(data['geometry'])
+            entry = deepcopy(GEOJSON_SAMPLE)
+            entry['geometry'] = sent['geometry']
+            response = mock.MagicMock()
+            response.json.return_value = entry
+            return response
+
+        mocked_post.side_effect = fake_post
+        Dummy.objects.create(terralego_geometry=SINE)
+        self.assertEqual(count_vertices(sent['geometry']), 10)
+        self.assertEqual(counters.get('simplify_vertices_in'), 1000)
+        self.assertEqual(counters.get('simplify_vertices_out'), 10)
+        # The original geometry is stored
+        dummy = Dummy.objects.get()
+        self.assertEqual(dummy.terralego_geometry, SINE)
+        self.assertFalse(dummy.terralego_is_dirty())
+
+    def test_reduction_is_memoized(self):
+        dummy = Dummy(terralego_id='6af234fb-ec81-4189-ab6b-ac9b1483e665', terralego_geometry=deepcopy(SINE))
+        dummy.save(terralego_commit=False)
+        dummy = Dummy.objects.get()
+        geometry = dummy.terralego_geometry
+        with mock.patch('django_terralego.simplify.reduce_geometry', wraps=reduce_geometry) as mocked_reduce:
+            for i in range(3):
+                self.assertFalse(dummy.terralego_is_dirty())
+            # Once for the loaded geometry, which is also the current one
+            self.assertEqual(mocked_reduce.call_count, 1)
+            geometry['coordinates'][0] = [0, 1]
+            self.assertTrue(dummy.terralego_is_dirty())
+            self.assertTrue(dummy.terralego_is_dirty())
+            self.assertEqual(mocked_reduce.call_count, 2)
+
+    @mock.patch.object(Dummy, 'terralego_simplify_storage', True)
+    def test_reduced_before_storage(self):
+        Dummy(terralego_geometry=SINE).save(terralego_commit=False)
+        self.assertEqual(count_vertices(Dummy.objects.get().terralego_geometry), 10)
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import SimpleTestCase
+from requests import HTTPError
+
+from django_terralego import conf, geodirectory, singleflight
+from django_terralego.stats import counters
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+
+
+class SingleFlightTest(SimpleTestCase):
+    """ Test that the concurrent identical reads share one request. """
+
+    def setUp(self):
+        counters.reset()
+        self.release = threading.Event()
+
+    def wait_for(self, name, value):
+        deadline = time.time() + 5
+        while counters.get(name) < value and time.time() < deadline:
+            time.sleep(0.01)
+
+    def fake_get(self, url, **kwargs):
+        self.release.wait(5)
+        response = mock.MagicMock()
+        response.json.return_value = dict(GEOJSON_SAMPLE)
+        return response
+
+    def run_threads(self, func, count):
+        results = [None] * count
+
+        def run(i):
+            try:
+                results[i] = func()
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    @mock.patch('requests.Session.get')
+    def test_get_entry(self, mocked_get):
+        mocked_get.side_effect = self.fake_get
+        threads, results = self.run_threads(lambda: geodirectory.get_entry(GEOJSON_SAMPLE['id']), 5)
+        self.wait_for('coalesced.get', 4)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(counters.get('coalesced.get'), 4)
+        self.assertEqual(results, [GEOJSON_SAMPLE] * 5)
+        # Every caller has its own copy
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+
+    @mock.patch('requests.Session.get')
+    def test_closest_tags_order(self, mocked_get):
+        mocked_get.side_effect = self.fake_get
+        threads, results = self.run_threads(lambda: geodirectory.closest(GEOJSON_SAMPLE['id'], ['a', 'b']), 2)
+        self.wait_for('coalesced.closest', 1)
+        other_threads, results = self.run_threads(lambda: geodirectory.closest(GEOJSON_SAMPLE['id'], ['b', 'a']), 1)
+        self.wait_for('coalesced.closest', 2)
+        self.release.set()
+        for thread in threads + other_threads:
+            thread.join()
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(counters.get('coalesced.closest'), 2)
+
+    @mock.patch('requests.Session.get')
+    def test_errors_are_shared(self, mocked_get):
+        def fail(url, **kwargs):
+            self.release.wait(5)
+            raise HTTPError('Server error')
+
+        mocked_get.side_effect = fail
+        threads, results = self.run_threads(lambda: geodirectory.get_entry(GEOJSON_SAMPLE['id']), 3)
+        self.wait_for('coalesced.get', 2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertTrue(all(isinstance(result, HTTPError) for result in results))
+        # The next call makes its own request
+        self.assertRaises(HTTPError, geodirectory.get_entry, GEOJSON_SAMPLE['id'])
+        self.assertEqual(mocked_get.call_count, 2)
+
+    @mock.patch('requests.Session.get')
+    def test_disabled(self, mocked_get):
+        mocked_get.side_effect = self.fake_get
+        self.release.set()
+        with mock.patch.dict(conf.TERRALEGO, {'SINGLE_FLIGHT': False}):
+            threads, results = self.run_threads(lambda: geodirectory.get_entry(GEOJSON_SAMPLE['id']), 3)
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mocked_get.call_count, 3)
+
+    def test_asyncio(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        calls = []
+
+        async def fetch(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return {'value': value}
+
+        async def run():
+            group = singleflight.Group()
+            return await asyncio.gather(*[group.ado(('get', 'a'), fetch, 'a') for i in range(4)] + [
+                group.ado(('get', 'b'), fetch, 'b'),
+            ])
+
+        results = loop.run_until_complete(run())
+        self.assertEqual(sorted(calls), ['a', 'b'])
+        self.assertEqual(results, [{'value': 'a'}] * 4 + [{'value': 'b'}])
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+        self.assertEqual(counters.get('coalesced.get'), 3)
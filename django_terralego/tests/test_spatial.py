@@ -0,0 +1,87 @@
+import json
+from unittest import skipIf
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import TestCase
+
+from django_terralego import conf, spatial
+from django_terralego.tests.models import Dummy
+
+
+def create_dummy(longitude, latitude, tags=None):
+    return Dummy.objects.create(
+        terralego_id=uuid4(),
+        terralego_geometry={'type': 'Point', 'coordinates': [longitude, latitude]},
+        terralego_tags=json.dumps(['django_terralego.Dummy'] + (tags or [])),
+    )
+
+
+@skipIf(spatial.np is None, 'numpy is not installed')
+class LocalClosestTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(conf.TERRALEGO, {'CLOSEST_BACKEND': 'local', 'ENABLED': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        spatial.connect_signals()
+        spatial.index.clear()
+        self.paris = create_dummy(2.3522, 48.8566)
+        self.lyon = create_dummy(4.8357, 45.7640, ['city'])
+        self.marseille = create_dummy(5.3698, 43.2965, ['city', 'port'])
+        self.polygon = Dummy.objects.create(terralego_id=uuid4(), terralego_geometry={
+            'type': 'Polygon', 'coordinates': [[[4.8, 45.7], [4.9, 45.7], [4.9, 45.8], [4.8, 45.7]]],
+        })
+
+    @mock.patch('requests.Session.get')
+    def test_closest(self, mocked_get):
+        self.assertEqual(self.paris.closest(tags=['city']), self.lyon)
+        self.assertEqual(self.lyon.closest(tags=['port']), self.marseille)
+        self.assertEqual(self.lyon.closest(), self.polygon)
+        self.assertIsNone(self.paris.closest(tags=['unknown']))
+        self.assertEqual(mocked_get.call_count, 0)
+
+    @mock.patch('requests.Session.get')
+    def test_closest_many(self, mocked_get):
+        spatial.index.ensure_built()
+        with self.assertNumQueries(2):  # The objects, then their neighbours
+            neighbours = Dummy.objects.closest_many(k=2)
+        self.assertEqual(neighbours[self.paris], [self.lyon, self.polygon])
+        self.assertEqual(neighbours[self.marseille], [self.polygon, self.lyon])
+        self.assertEqual(Dummy.objects.closest_many(tags=['city'], k=5)[self.lyon], [self.marseille])
+        self.assertEqual(mocked_get.call_count, 0)
+
+    def test_nearest_distances(self):
+        spatial.index.ensure_built()
+        keys = spatial.index.nearest((2.3522, 48.8566), k=2)
+        self.assertEqual([pk for model, pk, distance in keys], [self.paris.pk, self.lyon.pk])
+        self.assertAlmostEqual(keys[0][2], 0)
+        self.assertAlmostEqual(spatial.haversine(2.3522, 48.8566, 4.8357, 45.7640) / 1000, 392, delta=1)
+
+    @mock.patch('requests.Session.delete')
+    def test_index_is_updated(self, mocked_delete):
+        self.assertEqual(self.paris.closest(tags=['city']), self.lyon)
+        self.lyon.delete()
+        self.assertEqual(self.paris.closest(tags=['city']), self.marseille)
+        nice = create_dummy(7.2620, 43.7102, ['city'])
+        self.assertEqual(self.marseille.closest(tags=['city']), nice)
+        nice.terralego_geometry = {'type': 'Point', 'coordinates': [-1.5536, 47.2184]}
+        nice.save()
+        self.assertEqual(self.paris.closest(tags=['city']), nice)
+
+    def test_tag_masks_are_updated(self):
+        spatial.index.ensure_built()
+        self.assertEqual(self.paris.closest(tags=['port']), self.marseille)
+        self.marseille.terralego_tags = json.dumps(['city'])
+        self.marseille.save()
+        self.lyon.terralego_tags = json.dumps(['city', 'port'])
+        self.lyon.save()
+        with mock.patch.object(spatial.np, 'fromiter', wraps=spatial.np.fromiter) as mocked_fromiter:
+            self.assertEqual(self.paris.closest(tags=['port']), self.lyon)
+            self.assertEqual(self.paris.closest(tags=['city', 'port']), self.lyon)
+        # Only the mask of city was built, port was updated in place
+        self.assertEqual(mocked_fromiter.call_count, 1)
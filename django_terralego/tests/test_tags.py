@@ -0,0 +1,71 @@
+import json
+from unittest import skipIf
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.db import connection
+from django.test import TestCase
+
+from django_terralego.models import TerralegoTag
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_bulk import fake_post
+
+
+def create_dummy(*tags):
+    return Dummy.objects.create(terralego_id=uuid4(), terralego_tags=json.dumps(list(tags)))
+
+
+class TerralegoTagTest(TestCase):
+
+    def test_tags_are_indexed_on_save(self):
+        dummy = create_dummy('a', 'b')
+        self.assertEqual(set(TerralegoTag.objects.values_list('tag', flat=True)), {'a', 'b'})
+        dummy.terralego_tags = json.dumps(['c'])
+        dummy.save()
+        self.assertEqual(list(TerralegoTag.objects.values_list('tag', flat=True)), ['c'])
+        dummy = Dummy.objects.get(pk=dummy.pk)
+        # The generation is bumped after the commit from Django 1.9, see test_views
+        with self.assertNumQueries(1), mock.patch('django_terralego.models.bump_generation'):
+            dummy.save()
+
+    def test_with_tags(self):
+        ab = create_dummy('a', 'b')
+        a = create_dummy('a')
+        b = create_dummy('b')
+        create_dummy()
+        self.assertEqual(set(Dummy.objects.with_tags(['a'])), {ab, a})
+        self.assertEqual(set(Dummy.objects.with_tags(['a', 'b'])), {ab})
+        self.assertEqual(set(Dummy.objects.with_any_tags(['a', 'b'])), {ab, a, b})
+
+    @skipIf(connection.vendor != 'sqlite', 'The query plan is read from SQLite')
+    def test_with_tags_uses_the_terralego_id_index(self):
+        for i in range(50):
+            create_dummy('a' if i % 10 else 'b')
+        queryset = Dummy.objects.with_tags(['b'])
+        self.assertEqual(queryset.count(), 5)
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertRegex(plan, r'SEARCH (TABLE )?django_terralego_dummy USING INDEX')
+
+    @mock.patch('requests.Session.delete')
+    def test_tags_are_removed_on_delete(self, mocked_delete):
+        dummy = create_dummy('a')
+        dummy.delete()
+        self.assertFalse(TerralegoTag.objects.exists())
+
+    @mock.patch('requests.Session.post', side_effect=fake_post)
+    def test_bulk_create(self, mocked_post):
+        Dummy.objects.bulk_create([Dummy(terralego_geometry='POINT(1 1)') for i in range(3)])
+        self.assertEqual(Dummy.objects.with_tags(['django_terralego.Dummy']).count(), 3)
+
+    def test_index_terralego_tags(self):
+        Dummy.objects.bulk_create([Dummy(terralego_id=uuid4(), terralego_tags='["a"]')], terralego_commit=False)
+        TerralegoTag.objects.all().delete()
+        Dummy.objects.index_terralego_tags()
+        self.assertEqual(Dummy.objects.with_tags(['a']).count(), 1)
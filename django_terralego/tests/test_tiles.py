@@ -0,0 +1,175 @@
+import json
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from django_terralego import conf, tiles
+from django_terralego.tests.models import Dummy
+from django_terralego.views import TileView
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def read_message(data):
+    """
+    Decode a protobuf message as a dict of lists of values, by field number.
+    """
+    fields = {}
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, offset = read_varint(data, offset)
+        elif wire_type == 1:
+            value, offset = data[offset:offset + 8], offset + 8
+        else:
+            length, offset = read_varint(data, offset)
+            value, offset = data[offset:offset + length], offset + length
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def read_packed(data):
+    values = []
+    offset = 0
+    while offset < len(data):
+        value, offset = read_varint(data, offset)
+        values.append(value)
+    return values
+
+
+def read_layer(tile):
+    layers = read_message(tile).get(3, [])
+    if not layers:
+        return None
+    layer = read_message(layers[0])
+    keys = [key.decode('utf-8') for key in layer.get(3, [])]
+    values = [read_message(value).get(1, [b''])[0].decode('utf-8') for value in layer.get(4, [])]
+    features = []
+    for feature in layer.get(2, []):
+        feature = read_message(feature)
+        tags = read_packed(feature[2][0])
+        features.append({
+            'id': feature.get(1, [None])[0],
+            'type': feature[3][0],
+            'geometry': read_packed(feature[4][0]),
+            'properties': dict((keys[tags[i]], values[tags[i + 1]]) for i in range(0, len(tags), 2)),
+        })
+    return {'name': layer[1][0].decode('utf-8'), 'extent': layer[5][0], 'features': features}
+
+
+class TileGeometryTest(SimpleTestCase):
+    """ Test the projection, the clipping and the encoding of the geometries. """
+
+    def test_tile_bbox(self):
+        self.assertEqual(tiles.get_tile_bbox(0, 0, 0)[0::2], (-180, 180))
+        min_x, min_y, max_x, max_y = tiles.get_tile_bbox(1, 1, 0)
+        self.assertEqual((min_x, min_y, max_x), (0, 0, 180))
+        self.assertAlmostEqual(max_y, 85.0511287798)
+        self.assertEqual(tiles.get_tile_range((1, 1, 2, 2), 1), (1, 0, 1, 0))
+
+    def test_point(self):
+        geometries = tiles.get_tile_geometries({'type': 'Point', 'coordinates': [90, 0]}, 1, 1, 1)
+        # MoveTo(1) to (2048, 0)
+        self.assertEqual(geometries, [(tiles.POINT, [9, 4096, 0])])
+        self.assertEqual(tiles.get_tile_geometries({'type': 'Point', 'coordinates': [-90, 0]}, 1, 1, 1), [])
+
+    def test_polygon_is_clipped(self):
+        square = {'type': 'Polygon', 'coordinates': [[[-90, -45], [90, -45], [90, 45], [-90, 45], [-90, -45]]]}
+        (geometry_type, commands), = tiles.get_tile_geometries(square, 1, 1, 1, buffer=0)
+        self.assertEqual(geometry_type, tiles.POLYGON)
+        self.assertEqual(commands[0], 9)  # MoveTo(1)
+        self.assertEqual(commands[3], 2 | 3 << 3)  # LineTo(3), the ring being clipped to a rectangle
+        self.assertEqual(commands[-1], 15)  # ClosePath
+
+    def test_line_is_split(self):
+        line = [[0, 2], [6, 2], [6, 4], [0, 4]]
+        self.assertEqual(tiles.clip_line(line, 1, 5), [[(1, 2), (5, 2)], [(5, 4), (1, 4)]])
+
+    def test_ring_area(self):
+        self.assertGreater(tiles.get_ring_area([(0, 0), (10, 0), (10, 10)]), 0)
+        self.assertLess(tiles.get_ring_area([(0, 0), (10, 10), (10, 0)]), 0)
+
+
+class TileViewTest(TestCase):
+    """ Test the vector tiles view and its cache. """
+
+    def setUp(self):
+        patcher = mock.patch.dict(conf.TERRALEGO, {'TILES': {'TIMEOUT': 60, 'MAX_ZOOM': 4}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+        tiles.connect_signals()
+        self.addCleanup(
+            tiles.post_save.disconnect, tiles.invalidate_instance, dispatch_uid='django_terralego_tiles_save')
+        self.addCleanup(
+            tiles.post_delete.disconnect, tiles.invalidate_instance, dispatch_uid='django_terralego_tiles_delete')
+        self.factory = RequestFactory()
+        self.view = TileView.as_view(model=Dummy)
+        self.dummy = Dummy(
+            terralego_id=uuid4(), terralego_geometry={'type': 'Point', 'coordinates': [90, 45]},
+            terralego_tags=json.dumps(['a']))
+        self.dummy.save(terralego_commit=False)
+
+    def get_layer(self, z, x, y, **params):
+        response = self.view(self.factory.get('/tiles', params), z=str(z), x=str(x), y=str(y))
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        return read_layer(response.content)
+
+    def test_tile(self):
+        layer = self.get_layer(1, 1, 0)
+        self.assertEqual(layer['name'], 'dummy')
+        self.assertEqual(layer['extent'], 4096)
+        feature, = layer['features']
+        self.assertEqual(feature['id'], self.dummy.pk)
+        self.assertEqual(feature['type'], tiles.POINT)
+        self.assertEqual(feature['properties'], {'terralego_id': str(self.dummy.terralego_id), 'tags': '["a"]'})
+        self.assertIsNone(self.get_layer(1, 0, 0))
+        self.assertIsNone(self.get_layer(1, 1, 0, tags='b'))
+
+    def test_cache_invalidation(self):
+        for z, x, y in ((0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1)):
+            self.get_layer(z, x, y)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(self.get_layer(1, 1, 0))
+        self.dummy.terralego_geometry = {'type': 'Point', 'coordinates': [-90, 45]}
+        self.dummy.save(terralego_commit=False)
+        # Both the tiles of the previous and new geometry are regenerated
+        with self.assertNumQueries(2):
+            self.assertIsNone(self.get_layer(1, 1, 0))
+            self.assertIsNotNone(self.get_layer(1, 0, 0))
+        with self.assertNumQueries(0):
+            # The other tiles are still cached
+            self.get_layer(1, 1, 1)
+
+    def test_properties_invalidation(self):
+        self.view = TileView.as_view(model=Dummy, properties=['terralego_last_update'])
+        self.addCleanup(tiles._properties.clear)
+        self.get_layer(1, 1, 0)
+        self.dummy.save(terralego_commit=False, update_fields=['terralego_id'])
+        with self.assertNumQueries(0):
+            self.get_layer(1, 1, 0)
+        self.dummy.save(terralego_commit=False, update_fields=['terralego_last_update'])
+        with self.assertNumQueries(1):
+            self.get_layer(1, 1, 0)
+
+    def test_invalid_tile(self):
+        with self.assertRaises(Http404):
+            self.get_layer(1, 2, 0)
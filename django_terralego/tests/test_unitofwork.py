@@ -0,0 +1,158 @@
+import json
+from unittest import skipIf
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from django_terralego import conf
+from django_terralego.models import TerralegoTag
+from django_terralego.tests.models import Dummy
+from django_terralego.tests.test_bulk import fake_post
+from django_terralego.tests.test_cache import fake_put
+from django_terralego.tests.test_geodirectory_mixin import GEOJSON_SAMPLE
+from django_terralego.unitofwork import unit_of_work
+
+
+@skipIf(not hasattr(transaction, 'on_commit'), 'The unit of work requires Django >= 1.9')
+@mock.patch('requests.Session.delete')
+@mock.patch('requests.Session.put', side_effect=fake_put)
+@mock.patch('requests.Session.post', side_effect=fake_post)
+class UnitOfWorkTest(TransactionTestCase):
+    """ Test that the writes of a transaction are merged and done after the commit. """
+
+    def test_saves_are_merged(self, mocked_post, mocked_put, mocked_delete):
+        with unit_of_work():
+            dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]})
+            dummy.save()
+            dummy.terralego_geometry = {'type': 'Point', 'coordinates': [2, 2]}
+            dummy.save()
+            dummy.save()
+            self.assertEqual(mocked_post.call_count, 0)
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(mocked_put.call_count, 0)
+        dummy = Dummy.objects.get()
+        self.assertIsNotNone(dummy.terralego_id)
+        self.assertTrue(TerralegoTag.objects.filter(terralego_id=dummy.terralego_id).exists())
+
+    def test_create_and_delete(self, mocked_post, mocked_put, mocked_delete):
+        with unit_of_work():
+            dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]})
+            dummy.save()
+            dummy.delete()
+        self.assertEqual(mocked_post.call_count, 0)
+        self.assertEqual(mocked_delete.call_count, 0)
+
+    def test_update_and_delete(self, mocked_post, mocked_put, mocked_delete):
+        dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}, terralego_id=uuid4())
+        dummy.save(terralego_commit=False)
+        with unit_of_work():
+            dummy.terralego_geometry = {'type': 'Point', 'coordinates': [2, 2]}
+            dummy.save()
+            dummy.delete()
+        self.assertEqual(mocked_put.call_count, 0)
+        self.assertEqual(mocked_delete.call_count, 1)
+        self.assertIn(str(dummy.terralego_id), mocked_delete.call_args[0][0])
+
+    def test_rollback(self, mocked_post, mocked_put, mocked_delete):
+        with self.assertRaises(ValueError):
+            with unit_of_work():
+                Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}).save()
+                raise ValueError
+        Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}).save()
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(Dummy.objects.count(), 1)
+
+    def test_savepoint_rollback(self, mocked_post, mocked_put, mocked_delete):
+        with unit_of_work():
+            Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}).save()
+            try:
+                with transaction.atomic():
+                    Dummy(terralego_geometry={'type': 'Point', 'coordinates': [2, 2]}).save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=False).count(), 1)
+
+    def test_savepoint_rollback_of_update(self, mocked_post, mocked_put, mocked_delete):
+        dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}, terralego_id=uuid4())
+        dummy.save(terralego_commit=False)
+        with unit_of_work():
+            Dummy(terralego_geometry={'type': 'Point', 'coordinates': [3, 3]}).save()
+            try:
+                with transaction.atomic():
+                    dummy.terralego_geometry = {'type': 'Point', 'coordinates': [2, 2]}
+                    dummy.save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(mocked_put.call_count, 0)
+        self.assertEqual(Dummy.objects.get(pk=dummy.pk).terralego_geometry['coordinates'], [1, 1])
+
+    def test_savepoint_rollback_of_later_save(self, mocked_post, mocked_put, mocked_delete):
+        with unit_of_work():
+            dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]})
+            dummy.save()
+            try:
+                with transaction.atomic():
+                    dummy.terralego_geometry = {'type': 'Point', 'coordinates': [2, 2]}
+                    dummy.save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(json.loads(mocked_post.call_args[1]['data']['geometry'])['coordinates'], [1, 1])
+
+    def test_unit_created_in_rolled_back_savepoint(self, mocked_post, mocked_put, mocked_delete):
+        with mock.patch.dict(conf.TERRALEGO, {'UNIT_OF_WORK': True}):
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        Dummy(terralego_geometry={'type': 'Point', 'coordinates': [2, 2]}).save()
+                        raise ValueError
+                except ValueError:
+                    pass
+                Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}).save()
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=False).count(), 1)
+
+    def test_changes_after_save_are_not_pushed(self, mocked_post, mocked_put, mocked_delete):
+        with unit_of_work():
+            dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]})
+            dummy.save()
+            dummy.terralego_geometry = {'type': 'Point', 'coordinates': [2, 2]}
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(json.loads(mocked_post.call_args[1]['data']['geometry'])['coordinates'], [1, 1])
+        saved = Dummy.objects.get()
+        # Written back from the response
+        self.assertEqual(saved.terralego_geometry, GEOJSON_SAMPLE['geometry'])
+        # The instance has the entry, and its unsaved change
+        self.assertEqual(str(dummy.terralego_id), str(saved.terralego_id))
+        self.assertEqual(dummy.terralego_geometry['coordinates'], [2, 2])
+        self.assertTrue(dummy.terralego_is_dirty())
+
+    def test_delete_of_created_instance(self, mocked_post, mocked_put, mocked_delete):
+        with unit_of_work():
+            dummy = Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]})
+            dummy.save()
+            Dummy.objects.get(pk=dummy.pk).delete()
+        self.assertEqual(mocked_post.call_count, 0)
+
+    def test_automatic(self, mocked_post, mocked_put, mocked_delete):
+        with mock.patch.dict(conf.TERRALEGO, {'UNIT_OF_WORK': True}):
+            with transaction.atomic():
+                for i in range(3):
+                    Dummy(terralego_geometry={'type': 'Point', 'coordinates': [i, i]}).save()
+                self.assertEqual(mocked_post.call_count, 0)
+            self.assertEqual(mocked_post.call_count, 3)
+            # Outside of a transaction, the request is made during the save
+            Dummy(terralego_geometry={'type': 'Point', 'coordinates': [1, 1]}).save()
+            self.assertEqual(mocked_post.call_count, 4)
+        self.assertEqual(Dummy.objects.filter(terralego_id__isnull=False).count(), 4)
@@ -0,0 +1,122 @@
+import json
+from uuid import uuid4
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.db import transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase
+
+from django_terralego.models import TerralegoGeneration
+from django_terralego.tests.models import Dummy
+from django_terralego.views import GeoJSONView
+
+
+def create_dummy(x, y, tags):
+    dummy = Dummy(
+        terralego_id=uuid4(), terralego_geometry={'type': 'Point', 'coordinates': [x, y]},
+        terralego_tags=json.dumps(tags))
+    dummy.save(terralego_commit=False)
+    return dummy
+
+
+class GeoJSONViewTest(TestCase):
+    """ Test the streaming GeoJSON view. """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.view = GeoJSONView.as_view(model=Dummy)
+        self.paris = create_dummy(2.35, 48.85, ['city', 'capital'])
+        self.lyon = create_dummy(4.83, 45.76, ['city'])
+        Dummy(terralego_geometry='POINT(0 0)').save(terralego_commit=False)
+
+    def get(self, **params):
+        return self.view(self.factory.get('/dummies.geojson', params))
+
+    def get_collection(self, **params):
+        response = self.get(**params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    def test_collection(self):
+        collection = self.get_collection()
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual([feature['id'] for feature in collection['features']], [self.paris.pk, self.lyon.pk])
+        self.assertEqual(collection['features'][0]['geometry'], {'type': 'Point', 'coordinates': [2.35, 48.85]})
+        self.assertEqual(collection['features'][0]['properties'], {
+            'terralego_id': str(self.paris.terralego_id), 'tags': ['city', 'capital'],
+        })
+
+    def test_filters(self):
+        collection = self.get_collection(tags='city,capital')
+        self.assertEqual([feature['id'] for feature in collection['features']], [self.paris.pk])
+        collection = self.get_collection(bbox='4,45,5,46')
+        self.assertEqual([feature['id'] for feature in collection['features']], [self.lyon.pk])
+        self.assertEqual(self.get(bbox='4,45').status_code, 400)
+
+    def test_empty(self):
+        Dummy.objects.all().delete(terralego_commit=False)
+        self.assertEqual(self.get_collection()['features'], [])
+
+
+class GeoJSONConditionalTest(TransactionTestCase):
+    """ Test the conditional requests, the generation being incremented after the commits. """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.view = GeoJSONView.as_view(model=Dummy)
+        self.paris = create_dummy(2.35, 48.85, ['city', 'capital'])
+        self.lyon = create_dummy(4.83, 45.76, ['city'])
+
+    def get(self, view=None, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return (view or self.view)(self.factory.get('/dummies.geojson', **headers))
+
+    def assertModified(self, etag, modified=True, view=None):
+        self.assertEqual(self.get(view, etag).status_code, 200 if modified else 304)
+
+    def test_conditional_get(self):
+        response = self.get()
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertModified(etag, False)
+        Dummy.objects.filter(pk=self.lyon.pk).delete(terralego_commit=False)
+        self.assertModified(etag)
+
+    def test_conditional_get_with_properties(self):
+        view = GeoJSONView.as_view(model=Dummy, properties=['terralego_min_x'])
+        etag = self.get(view)['ETag']
+        self.assertNotEqual(etag, self.get()['ETag'])
+        self.assertModified(etag, False, view)
+        Dummy.objects.filter(pk=self.lyon.pk).update(terralego_min_x=5)
+        self.assertModified(etag, True, view)
+
+    @mock.patch('requests.Session.delete')
+    def test_every_write_is_seen(self, mocked_delete):
+        etag = self.get()['ETag']
+        generation = TerralegoGeneration.objects.get_for(Dummy)[0]
+        # Not a terralego field, terralego_last_update is unchanged
+        self.lyon.terralego_min_y = 1
+        self.lyon.save(terralego_commit=False, update_fields=['terralego_min_y'])
+        self.assertEqual(TerralegoGeneration.objects.get_for(Dummy)[0], generation + 1)
+        self.assertModified(etag)
+        etag = self.get()['ETag']
+        self.paris.delete()
+        self.assertModified(etag)
+
+    def test_rollback_is_not_seen(self):
+        etag = self.get()['ETag']
+        try:
+            with transaction.atomic():
+                Dummy.objects.update(terralego_tags='[]')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertModified(etag, False)
+
+    def test_not_modified_in_one_query(self):
+        etag = self.get()['ETag']
+        with self.assertNumQueries(1):
+            self.assertModified(etag, False)
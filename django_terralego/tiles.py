@@ -0,0 +1,444 @@
+"""
+Mapbox vector tiles of the GeoDirectoryMixin models, served by `django_terralego.views.TileView`.
+
+The geometries are projected in Web Mercator, clipped to the tile and quantized to its extent, then encoded following
+the vector tile specification 2.1. The tiles are cached when `TERRALEGO['TILES']` is set::
+
+    TERRALEGO = {
+        'TILES': {
+            'ALIAS': 'default',  # The Django cache storing the tiles
+            'TIMEOUT': 3600,
+            'MAX_ZOOM': 20,  # The highest zoom invalidated
+            'MAX_INVALIDATED_TILES': 256,  # Above, every tile of the zoom is invalidated at once
+        },
+    }
+
+Saving or deleting an instance invalidates the tiles intersecting its previous and new bounding boxes, through the
+`post_save` and `post_delete` signals, unless the `update_fields` of the save are not in the tiles: the terralego
+fields and the `properties` of the `TileView` of the model. The updates of querysets do not send them, wait for the
+timeout in that case.
+"""
+import math
+import struct
+import uuid
+
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+
+from django_terralego import conf
+from django_terralego.spatial import iter_parts
+
+MAX_LATITUDE = 85.0511287798
+POINT, LINESTRING, POLYGON = 1, 2, 3
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+_properties = {}  # model label -> names of the fields added to the features
+
+
+# Tile coordinates
+
+def get_tile_bbox(z, x, y, buffer=0):
+    """
+    Get the `(min_x, min_y, max_x, max_y)` bounding box of a tile in longitudes and latitudes.
+
+    :param buffer: Optional. A margin around the tile, in tile width.
+    """
+    n = 2 ** z
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return (
+        (x - buffer) / n * 360 - 180,
+        latitude(min(y + 1 + buffer, n)),
+        (x + 1 + buffer) / n * 360 - 180,
+        latitude(max(y - buffer, 0)),
+    )
+
+
+def get_tile_position(longitude, latitude, z):
+    """
+    Get the fractional `(x, y)` position of a point in the tiles of zoom `z`.
+    """
+    n = 2 ** z
+    latitude = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude)))
+    return (longitude + 180) / 360 * n, (1 - math.log(math.tan(latitude) + 1 / math.cos(latitude)) / math.pi) / 2 * n
+
+
+def get_tile_range(bbox, z):
+    """
+    Get the `(min_x, min_y, max_x, max_y)` range of the tiles of zoom `z` intersecting a bounding box.
+    """
+    n = 2 ** z
+    min_x, max_y = get_tile_position(bbox[0], bbox[1], z)
+    max_x, min_y = get_tile_position(bbox[2], bbox[3], z)
+
+    def clamp(value):
+        return max(0, min(n - 1, int(math.floor(value))))
+
+    return clamp(min_x), clamp(min_y), clamp(max_x), clamp(max_y)
+
+
+# Clipping and quantization
+
+def _clip_segment(a, b, low, high):
+    # Liang-Barsky
+    t0, t1 = 0, 1
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    for p, q in ((-dx, a[0] - low), (dx, high - a[0]), (-dy, a[1] - low), (dy, high - a[1])):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+    return (a[0] + t0 * dx, a[1] + t0 * dy), (a[0] + t1 * dx, a[1] + t1 * dy)
+
+
+def clip_line(line, low, high):
+    """
+    Clip a line to the square `[low, high]`, which can split it in many lines.
+    """
+    lines = []
+    current = []
+    for a, b in zip(line, line[1:]):
+        segment = _clip_segment(a, b, low, high)
+        if segment is None:
+            if current:
+                lines.append(current)
+                current = []
+            continue
+        start, end = segment
+        if current and current[-1] != start:
+            lines.append(current)
+            current = []
+        if not current:
+            current = [start]
+        current.append(end)
+        if end != tuple(b):
+            lines.append(current)
+            current = []
+    if current:
+        lines.append(current)
+    return lines
+
+
+def clip_ring(ring, low, high):
+    """
+    Clip a polygon ring, without its closing position, to the square `[low, high]` (Sutherland-Hodgman).
+    """
+    for axis, bound, is_low in ((0, low, True), (0, high, False), (1, low, True), (1, high, False)):
+        if not ring:
+            break
+
+        def inside(position):
+            return position[axis] >= bound if is_low else position[axis] <= bound
+
+        def intersection(a, b):
+            t = (bound - a[axis]) / (b[axis] - a[axis])
+            return a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1])
+
+        clipped = []
+        previous = ring[-1]
+        for position in ring:
+            if inside(position):
+                if not inside(previous):
+                    clipped.append(intersection(previous, position))
+                clipped.append(position)
+            elif inside(previous):
+                clipped.append(intersection(previous, position))
+            previous = position
+        ring = clipped
+    return ring
+
+
+def quantize(positions):
+    """
+    Round the positions to integers, dropping the consecutive duplicates.
+    """
+    quantized = []
+    for position in positions:
+        position = int(round(position[0])), int(round(position[1]))
+        if not quantized or quantized[-1] != position:
+            quantized.append(position)
+    return quantized
+
+
+def get_ring_area(ring):
+    """
+    Get the signed area of a ring with the surveyor's formula, positive for the exterior rings of vector tiles.
+    """
+    return sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(ring, ring[1:] + ring[:1])) / 2
+
+
+# Encoding
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _varint(value):
+    data = bytearray()
+    while value > 0x7f:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def _field(number, wire_type):
+    return _varint(number << 3 | wire_type)
+
+
+def _bytes_field(number, data):
+    return _field(number, 2) + _varint(len(data)) + data
+
+
+def _varint_field(number, value):
+    return _field(number, 0) + _varint(value)
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, b''.join(_varint(value) for value in values))
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        return _varint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+class GeometryEncoder(object):
+    """
+    Encode the geometry commands of a feature, the positions being relative to the previous one.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.cursor = (0, 0)
+
+    def _add_positions(self, positions):
+        for position in positions:
+            self.commands.extend((_zigzag(position[0] - self.cursor[0]), _zigzag(position[1] - self.cursor[1])))
+            self.cursor = position
+
+    def add_points(self, points):
+        self.commands.append(MOVE_TO | len(points) << 3)
+        self._add_positions(points)
+
+    def add_line(self, line, closed=False):
+        self.add_points(line[:1])
+        self.commands.append(LINE_TO | (len(line) - 1) << 3)
+        self._add_positions(line[1:])
+        if closed:
+            self.commands.append(CLOSE_PATH | 1 << 3)
+
+
+class Layer(object):
+    """
+    A layer of a vector tile.
+    """
+
+    def __init__(self, name, extent=4096):
+        self.name = name
+        self.extent = extent
+        self.features = []
+        self.keys = {}
+        self.values = {}
+
+    def _get_index(self, mapping, item):
+        if item not in mapping:
+            mapping[item] = len(mapping)
+        return mapping[item]
+
+    def add_feature(self, geometry_type, commands, properties=None, feature_id=None):
+        tags = []
+        for key, value in sorted((properties or {}).items()):
+            if value is None:
+                continue
+            tags.append(self._get_index(self.keys, key))
+            tags.append(self._get_index(self.values, (type(value), value)))
+        feature = b''
+        if feature_id is not None:
+            feature += _varint_field(1, feature_id)
+        feature += _packed_field(2, tags) + _varint_field(3, geometry_type) + _packed_field(4, commands)
+        self.features.append(feature)
+
+    def encode(self):
+        data = [_varint_field(15, 2), _bytes_field(1, self.name.encode('utf-8'))]
+        data.extend(_bytes_field(2, feature) for feature in self.features)
+        data.extend(_bytes_field(3, key.encode('utf-8')) for key in sorted(self.keys, key=self.keys.get))
+        data.extend(
+            _bytes_field(4, _encode_value(value[1])) for value in sorted(self.values, key=self.values.get))
+        data.append(_varint_field(5, self.extent))
+        return b''.join(data)
+
+
+def encode_tile(layers):
+    """
+    Encode the non empty layers of a vector tile.
+    """
+    return b''.join(_bytes_field(3, layer.encode()) for layer in layers if layer.features)
+
+
+def get_tile_geometries(geometry, z, x, y, extent=4096, buffer=64):
+    """
+    Project, clip and quantize a geojson geometry in a tile.
+
+    :param buffer: The margin kept around the tile, in tile units.
+    :return: A list of `(geometry_type, commands)`, one per type of the parts of the geometry inside the tile.
+    """
+    low, high = -buffer, extent + buffer
+
+    def project(positions):
+        projected = []
+        for position in positions:
+            tile_x, tile_y = get_tile_position(position[0], position[1], z)
+            projected.append(((tile_x - x) * extent, (tile_y - y) * extent))
+        return projected
+
+    points, lines, polygons = [], [], []
+    for part_type, coordinates in iter_parts(geometry):
+        if part_type == 'Point':
+            point = quantize(project([coordinates]))[0]
+            if low <= point[0] <= high and low <= point[1] <= high:
+                points.append(point)
+        elif part_type == 'LineString':
+            for line in clip_line(project(coordinates), low, high):
+                line = quantize(line)
+                if len(line) >= 2:
+                    lines.append(line)
+        elif part_type == 'Polygon':
+            rings = []
+            for index, ring in enumerate(coordinates):
+                ring = quantize(clip_ring(project(ring[:-1] if ring[:1] == ring[-1:] else ring), low, high))
+                if len(ring) > 1 and ring[0] == ring[-1]:
+                    ring.pop()
+                area = get_ring_area(ring) if len(ring) >= 3 else 0
+                if area == 0:
+                    if index == 0:
+                        # The exterior ring is outside of the tile or too small
+                        break
+                    continue
+                # The exterior ring must have a positive area, the holes a negative one
+                if (area > 0) != (index == 0):
+                    ring.reverse()
+                rings.append(ring)
+            if rings:
+                polygons.append(rings)
+    geometries = []
+    if points:
+        encoder = GeometryEncoder()
+        encoder.add_points(points)
+        geometries.append((POINT, encoder.commands))
+    if lines:
+        encoder = GeometryEncoder()
+        for line in lines:
+            encoder.add_line(line)
+        geometries.append((LINESTRING, encoder.commands))
+    if polygons:
+        encoder = GeometryEncoder()
+        for rings in polygons:
+            for ring in rings:
+                encoder.add_line(ring, closed=True)
+        geometries.append((POLYGON, encoder.commands))
+    return geometries
+
+
+# Cache
+
+def get_settings():
+    return conf.TERRALEGO.get('TILES') or {}
+
+
+def is_enabled():
+    return bool(get_settings())
+
+
+def get_cache():
+    return caches[get_settings().get('ALIAS', 'default')]
+
+
+def get_model_label(model):
+    return '{0}.{1}'.format(model._meta.app_label, model._meta.model_name)
+
+
+def _get_version_keys(model, z, x, y):
+    label = get_model_label(model)
+    return 'terralego:tiles:{0}:{1}'.format(label, z), 'terralego:tiles:{0}:{1}:{2}:{3}'.format(label, z, x, y)
+
+
+def get_tile_key(model, z, x, y, variant):
+    """
+    Get the cache key of a tile, which changes when the tile is invalidated.
+
+    :param variant: A string identifying the content of the tile for the same model, e.g. its filters.
+    """
+    zoom_key, tile_key = _get_version_keys(model, z, x, y)
+    versions = get_cache().get_many([zoom_key, tile_key])
+    return 'terralego:tile:{0}:{1}:{2}:{3}:{4}:{5}:{6}'.format(
+        get_model_label(model), z, x, y, versions.get(zoom_key, 0), versions.get(tile_key, 0), variant)
+
+
+def register_properties(model, fields):
+    """
+    Record the fields added to the features of the tiles of a model: saving them invalidates the tiles.
+    """
+    _properties.setdefault(get_model_label(model), set()).update(fields)
+
+
+def invalidate_bbox(model, bbox):
+    """
+    Invalidate the cached tiles of a model intersecting a bounding box, at every zoom up to `MAX_ZOOM`.
+    """
+    settings = get_settings()
+    max_tiles = settings.get('MAX_INVALIDATED_TILES', 256)
+    version = uuid.uuid4().hex
+    versions = {}
+    for z in range(settings.get('MAX_ZOOM', 20) + 1):
+        min_x, min_y, max_x, max_y = get_tile_range(bbox, z)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > max_tiles:
+            versions[_get_version_keys(model, z, 0, 0)[0]] = version
+            continue
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                versions[_get_version_keys(model, z, x, y)[1]] = version
+    get_cache().set_many(versions, settings.get('TIMEOUT', 3600))
+
+
+def _get_bbox(instance):
+    from django_terralego.models import TERRALEGO_BBOX_FIELDS
+    bbox = tuple(instance.__dict__.get(field) for field in TERRALEGO_BBOX_FIELDS)
+    return None if None in bbox else bbox
+
+
+def invalidate_instance(sender, instance, **kwargs):
+    from django_terralego.models import GeoDirectoryMixin, TERRALEGO_BBOX_FIELDS
+    if not isinstance(instance, GeoDirectoryMixin):
+        return
+    update_fields = kwargs.get('update_fields')
+    fields = {'terralego_geometry', 'terralego_tags'} | set(TERRALEGO_BBOX_FIELDS)
+    fields |= _properties.get(get_model_label(type(instance)), set())
+    if update_fields is not None and not fields & set(update_fields):
+        return
+    bbox = _get_bbox(instance)
+    for invalidated in set([getattr(instance, '_terralego_loaded_bbox', None), bbox]):
+        if invalidated is not None:
+            invalidate_bbox(type(instance), invalidated)
+    instance._terralego_loaded_bbox = bbox
+
+
+def connect_signals():
+    post_save.connect(invalidate_instance, dispatch_uid='django_terralego_tiles_save')
+    post_delete.connect(invalidate_instance, dispatch_uid='django_terralego_tiles_delete')
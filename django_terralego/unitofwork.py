@@ -0,0 +1,228 @@
+"""
+Coalesce the terralego writes of a transaction into one batch, done after the commit.
+
+Within a unit of work, saving or deleting an instance of `GeoDirectoryMixin` only records the operation, with a copy of
+the terralego fields of the instance at that time. The operations of the same object are merged into its final state:
+several saves are one create or update, a save followed by a delete is one delete, or nothing if the entry was not
+created yet. The operations recorded in a savepoint rolled back since are dropped: after the commit, the rows of the
+objects are read again, a save is kept if its copy matches its row, and a delete if the row is gone. The remaining
+operations are done with concurrent requests, and the terralego fields written back from the responses with one bulk
+update per model. Nothing is requested when the transaction is rolled back.
+
+Use the `unit_of_work()` context manager, or set `TERRALEGO['UNIT_OF_WORK']` at True to record the writes of every
+`transaction.atomic()` block. It requires Django >= 1.9.
+"""
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy, deepcopy
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from django_terralego import cache, conf
+from django_terralego.breaker import CircuitOpenError
+from django_terralego.stats import counters
+from django_terralego.utils import bulk_update, run_concurrently
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class FlushHook(object):
+    """
+    The `on_commit` callback of a unit of work, only referenced by Django: it is released when Django drops it, with
+    the transaction or the savepoint it was registered in.
+    """
+
+    def __init__(self, unit):
+        self.unit = unit
+
+    def __call__(self):
+        units = _get_units()
+        if units.get(self.unit.using) is self.unit:
+            del units[self.unit.using]
+        self.unit.flush()
+
+
+class UnitOfWork(object):
+    """
+    The pending terralego operations of a transaction, by object.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.hook = None  # Weak reference to the FlushHook
+        self.operations = OrderedDict()  # (model, pk) -> [(kind, instance, snapshot), ...]
+
+    def register(self):
+        """
+        Flush the unit after the commit of the current transaction.
+        """
+        hook = FlushHook(self)
+        self.hook = weakref.ref(hook)
+        transaction.on_commit(hook, using=self.using)
+
+    def is_pending(self):
+        """
+        Return False once the unit is flushed, or dropped with the transaction or the savepoint it was created in.
+        """
+        return self.hook is not None and self.hook() is not None
+
+    def record_save(self, instance):
+        from django_terralego.models import TERRALEGO_FIELDS
+        # Pushed and written back instead of the instance, which may be changed again before the commit
+        snapshot = copy(instance)
+        snapshot._state = copy(instance._state)
+        for field in TERRALEGO_FIELDS:
+            setattr(snapshot, field, deepcopy(getattr(instance, field)))
+        self.operations.setdefault((type(instance), instance.pk), []).append(('save', instance, snapshot))
+
+    def record_delete(self, instance):
+        snapshot = (instance.terralego_id, instance._get_terralego_known_tags())
+        self.operations.setdefault((type(instance), instance.pk), []).append(('delete', instance, snapshot))
+
+    def _get_hashes(self, keys):
+        # The terralego hash of the committed row of every object still in the database
+        pks_by_model = {}
+        for model, pk in keys:
+            pks_by_model.setdefault(model, []).append(pk)
+        hashes = {}
+        for model, pks in pks_by_model.items():
+            for obj in model._base_manager.using(self.using).filter(pk__in=pks):
+                hashes[(model, obj.pk)] = obj.get_terralego_hash()
+        return hashes
+
+    def get_final_operations(self):
+        """
+        :return: A list of `(kind, key, instance, snapshot)`, the last committed operation of every object.
+        """
+        operations, self.operations = self.operations, OrderedDict()
+        hashes = self._get_hashes(operations)
+        final = []
+        for key, recorded in operations.items():
+            if key in hashes:
+                # The deletes were rolled back, the saves rolled back since or overwritten do not match the row
+                matching = [
+                    operation for operation in recorded
+                    if operation[0] == 'save' and operation[2].get_terralego_hash() == hashes[key]
+                ]
+            else:
+                # The rows deleted by the querysets are not saved
+                matching = [operation for operation in recorded if operation[0] == 'delete']
+            if matching:
+                kind, instance, snapshot = matching[-1]
+                if kind == 'save' or snapshot[0] is not None:
+                    final.append((kind, key, instance, snapshot))
+        return final
+
+    def flush(self):
+        """
+        Do the pending operations with concurrent requests.
+        """
+        from django_terralego.models import (
+            TERRALEGO_FIELDS, TerralegoOutbox, TerralegoTag, bump_generation, delete_entry,
+        )
+        operations = self.get_final_operations()
+
+        def apply(operation):
+            kind, key, instance, snapshot = operation
+            if kind == 'save':
+                return snapshot.push_to_terralego()
+            delete_entry(snapshot[0])
+
+        results = run_concurrently(apply, operations, conf.TERRALEGO.get('MAX_WORKERS', 8))
+        synced = OrderedDict()
+        for (kind, key, instance, snapshot), data, error in results:
+            if error is None:
+                if kind == 'save':
+                    snapshot._update_from_pushed_data(data)
+                    synced.setdefault(key[0], []).append((instance, snapshot))
+                    counters.incr('sync_performed')
+                else:
+                    cache.invalidate(snapshot[0])
+                    cache.invalidate_closest([snapshot])
+                continue
+            if kind == 'save':
+                counters.incr('sync_failed')
+            if isinstance(error, CircuitOpenError):
+                # Reconciled by the terralego_sync command
+                TerralegoOutbox.objects.using(self.using).enqueue_many(
+                    key[0], [(key[1], snapshot[0] if kind == 'delete' else snapshot.terralego_id)],
+                    TerralegoOutbox.SAVE if kind == 'save' else TerralegoOutbox.DELETE)
+            else:
+                logger.error('Error while {0} terralego: {1}'.format(
+                    'saving to' if kind == 'save' else 'deleting from', error))
+        for model, pairs in synced.items():
+            snapshots = [snapshot for instance, snapshot in pairs]
+            with transaction.atomic(using=self.using):
+                bulk_update(model, snapshots, TERRALEGO_FIELDS, using=self.using)
+                TerralegoTag.objects.using(self.using).set_for(snapshots)
+                bump_generation(model, self.using)
+            for instance, snapshot in pairs:
+                # The other changes of the instance since its save are kept, and still dirty
+                instance.terralego_id = snapshot.terralego_id
+                instance.terralego_last_update = snapshot.terralego_last_update
+                instance._terralego_hash = snapshot._terralego_hash
+                instance._terralego_loaded = None
+                instance._terralego_indexed = snapshot._terralego_indexed
+
+
+def _get_units():
+    if not hasattr(_local, 'units'):
+        _local.units = {}  # alias -> unit of work
+        _local.forced = 0
+    return _local.units
+
+
+def _check_on_commit():
+    if not hasattr(transaction, 'on_commit'):
+        raise ImproperlyConfigured('The terralego unit of work requires Django >= 1.9')
+
+
+def get_current(using, create=True):
+    """
+    Get the unit of work recording the writes of the current transaction of `using`, or None.
+
+    :param create: Optional. If False, only return the unit of work of the transaction if it has one already.
+    """
+    units = _get_units()
+    if not (_local.forced or conf.TERRALEGO.get('UNIT_OF_WORK', False)) or conf.TERRALEGO.get('DEFERRED', False):
+        return None
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        return None
+    _check_on_commit()
+    current = units.get(using)
+    # The flush callback is dropped by Django when the transaction, or the savepoint it was registered in, is rolled
+    # back: its unit of work is discarded as well
+    if current is None or not current.is_pending():
+        if not create:
+            return None
+        current = units[using] = UnitOfWork(using)
+        current.register()
+    return current
+
+
+@contextmanager
+def unit_of_work(using=None):
+    """
+    Open a transaction in which the terralego writes are recorded, to be done in one batch after the commit.
+
+    Usage::
+
+        with unit_of_work():
+            form.save()
+            place.save()  # Only one request for the place, after the commit
+    """
+    _check_on_commit()
+    _get_units()
+    _local.forced += 1
+    try:
+        with transaction.atomic(using=using or DEFAULT_DB_ALIAS):
+            yield
+    finally:
+        _local.forced -= 1
@@ -1,20 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 from django.apps import apps
+from django.db import models, transaction
 
+from django_terralego.instrumentation import collecting, get_collector
 
-def convert_geodirectory_entry_to_model_instance(entry):
+
+_models_cache = {}
+
+
+def get_model_from_tag(tag):
+    """
+    Get the model described by a tag like `app_label.ModelName`, or None.
+
+    The lookups are memoized.
+    """
+    if tag not in _models_cache:
+        model = None
+        if '.' in tag:
+            try:
+                model = apps.get_model(tag)
+            except (LookupError, ValueError):
+                pass
+        _models_cache[tag] = model
+    return _models_cache[tag]
+
+
+def get_entry_model(entry):
     try:
         if not entry['properties']['tags']:
-            return entry
+            return None
     except KeyError:
-        return entry
-    model_name = entry['properties']['tags'][0]
-    if '.' not in model_name:
-        return entry
-    try:
-        model = apps.get_model(model_name)
-    except LookupError:
-        return entry
-    try:
-        return model.objects.get(terralego_id=entry['id'])
-    except model.DoesNotExist:
-        return entry
+        return None
+    return get_model_from_tag(entry['properties']['tags'][0])
+
+
+def convert_geodirectory_entries(entries, select_related=None, only=None):
+    """
+    Convert geodirectory entries to model instances, with one query per model.
+
+    :param entries: A list of geojson describing entries.
+    :param select_related: Optional. A list of relations to select with each model.
+    :param only: Optional. A list of fields to load for each model.
+    :return: A list, in the same order as entries, of the instances or the entries when no instance is found.
+    """
+    ids_by_model = {}
+    for entry in entries:
+        model = get_entry_model(entry)
+        if model is not None:
+            ids_by_model.setdefault(model, set()).add(entry['id'])
+    instances = {}
+    for model, ids in ids_by_model.items():
+        queryset = model.objects.filter(terralego_id__in=ids)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if only:
+            queryset = queryset.only('terralego_id', *only)
+        for instance in queryset:
+            instances[(model, str(instance.terralego_id))] = instance
+    return [instances.get((get_entry_model(entry), str(entry.get('id'))), entry) for entry in entries]
+
+
+def convert_geodirectory_entry_to_model_instance(entry):
+    return convert_geodirectory_entries([entry])[0]
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable in lists of at most `size` items.
+
+    :param iterable: Any iterable, including a queryset iterator.
+    :param size: The maximum number of items per chunk.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_concurrently(func, items, max_workers):
+    """
+    Call `func` on every item using a pool of at most `max_workers` threads.
+
+    The requests made by the threads are collected with the ones of the calling thread, see
+    `instrumentation.start_collecting`.
+
+    :return: A list of `(item, result, exception)` tuples, in the same order as `items`.
+    """
+    collector = get_collector()
+
+    def call(item):
+        with collecting(collector):
+            try:
+                return item, func(item), None
+            except Exception as e:
+                return item, None, e
+
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+def bulk_update(model, objs, fields, batch_size=None, using=None):
+    """
+    Write `fields` of already saved `objs` back to the database.
+
+    Use `QuerySet.bulk_update` when available (Django >= 2.2) and fall back to one `UPDATE` per object in a single
+    transaction otherwise.
+
+    :param using: Optional. The database alias, defaults to the one the router chooses for writing.
+    """
+    objs = [obj for obj in objs if obj.pk is not None]
+    if not objs:
+        return
+    queryset = model._base_manager.db_manager(using).all()
+    if hasattr(models.QuerySet, 'bulk_update'):
+        queryset.bulk_update(objs, fields, batch_size=batch_size)
+        return
+    with transaction.atomic(using=queryset.db):
+        for obj in objs:
+            queryset.filter(pk=obj.pk).update(**{field: getattr(obj, field) for field in fields})
@@ -1,3 +1,193 @@
-from django.shortcuts import render
+import hashlib
+import json
 
-# Create your views here.
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.views.generic import View
+
+from django_terralego import tiles
+from django_terralego.fields import is_packed, load_geometry, unpack_geometry
+from django_terralego.models import TerralegoGeneration
+from django_terralego.utils import chunked
+
+
+class GeoDirectoryViewMixin(object):
+    """
+    The queryset of a view over a GeoDirectoryMixin model, filtered by the `tags` GET parameter (comma separated, all
+    required).
+    """
+    model = None
+    queryset = None
+    properties = ()  # Names of the fields added to the properties of the features
+
+    def get_queryset(self):
+        if self.queryset is not None:
+            return self.queryset.all()
+        return self.model._default_manager.all()
+
+    def get_tags(self):
+        return [tag for tag in self.request.GET.get('tags', '').split(',') if tag]
+
+    def filter_queryset(self, queryset):
+        tags = self.get_tags()
+        if tags:
+            queryset = queryset.with_tags(tags)
+        return queryset.filter(terralego_geometry__isnull=False)
+
+
+class GeoJSONView(GeoDirectoryViewMixin, View):
+    """
+    Stream the objects of a GeoDirectoryMixin model as a GeoJSON FeatureCollection.
+
+    The features are written from the text of the `terralego_geometry` and `terralego_tags` columns, without decoding
+    them. The collection can be filtered with the `tags` (comma separated, all required) and `bbox`
+    (`min_x,min_y,max_x,max_y`) GET parameters. The conditional requests are answered from the generation of the model,
+    incremented by every write of its objects, see `TerralegoGeneration`.
+
+    Usage: `url(r'^places.geojson$', GeoJSONView.as_view(model=Place, properties=['name']))`
+    """
+    chunk_size = 500  # Features written at once
+    content_type = 'application/geo+json'
+
+    def filter_queryset(self, queryset):
+        """
+        Apply the `tags` and `bbox` filters of the request.
+
+        :raise ValueError: If the bbox is invalid.
+        """
+        queryset = super(GeoJSONView, self).filter_queryset(queryset)
+        bbox = self.request.GET.get('bbox')
+        if bbox:
+            bbox = [float(value) for value in bbox.split(',')]
+            if len(bbox) != 4:
+                raise ValueError('bbox must be min_x,min_y,max_x,max_y')
+            queryset = queryset.in_bbox(*bbox)
+        return queryset
+
+    def get_version(self, queryset):
+        """
+        :return: A tuple `(generation, modified)` of the model, read once per request.
+        """
+        if getattr(self, '_version', None) is None:
+            self._version = TerralegoGeneration.objects.db_manager(queryset.db).get_for(queryset.model)
+        return self._version
+
+    def get_etag(self, request, *args, **kwargs):
+        generation, modified = self.get_version(self.filtered_queryset)
+        # The filters are in the url, the properties depend on the view
+        content = json.dumps([generation, list(self.properties)])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return self.get_version(self.filtered_queryset)[1]
+
+    def get_feature(self, row):
+        """
+        Get the GeoJSON text of a feature from a row of `values_list`, or None if its geometry is not GeoJSON.
+        """
+        pk, terralego_id, geometry, tags = row[:4]
+        if is_packed(geometry):
+            geometry = json.dumps(unpack_geometry(geometry))
+        elif not geometry.lstrip().startswith('{'):
+            # e.g. WKT, never synced with terralego
+            return None
+        properties = dict(zip(self.properties, row[4:]))
+        properties['terralego_id'] = terralego_id
+        # The closing brace of the dumped properties is replaced to insert the raw tags
+        properties = json.dumps(properties, cls=DjangoJSONEncoder)[:-1]
+        return '{{"type":"Feature","id":{0},"geometry":{1},"properties":{2},"tags":{3}}}}}'.format(
+            json.dumps(pk, cls=DjangoJSONEncoder), geometry, properties, tags or '[]')
+
+    def iter_features(self, queryset):
+        fields = ('pk', 'terralego_id', 'terralego_geometry', 'terralego_tags') + tuple(self.properties)
+        for row in queryset.order_by('pk').values_list(*fields).iterator():
+            feature = self.get_feature(row)
+            if feature is not None:
+                yield feature
+
+    def iter_collection(self, queryset):
+        yield '{"type":"FeatureCollection","features":['
+        separator = ''
+        for chunk in chunked(self.iter_features(queryset), self.chunk_size):
+            yield separator + ','.join(chunk)
+            separator = ','
+        yield ']}'
+
+    def stream(self, request, *args, **kwargs):
+        return StreamingHttpResponse(self.iter_collection(self.filtered_queryset), content_type=self.content_type)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.filtered_queryset = self.filter_queryset(self.get_queryset())
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        self._version = None
+        view = condition(etag_func=self.get_etag, last_modified_func=self.get_last_modified)(self.stream)
+        return view(request, *args, **kwargs)
+
+
+class TileView(GeoDirectoryViewMixin, View):
+    r"""
+    Serve the objects of a GeoDirectoryMixin model as Mapbox vector tiles, cached when `TERRALEGO['TILES']` is set.
+
+    The tile is given by the `z`, `x` and `y` url arguments, the features can be filtered with the `tags` GET parameter
+    (comma separated, all required). Each feature has the `terralego_id` and `tags` (JSON list) properties, along with
+    the `properties` fields.
+
+    Usage: `url(r'^places/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+).pbf$', TileView.as_view(model=Place))`
+    """
+    layer_name = None  # Defaults to the name of the model
+    extent = 4096
+    buffer = 64  # Margin around the tile, in tile units
+    content_type = 'application/vnd.mapbox-vector-tile'
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(TileView, cls).as_view(**initkwargs)
+        queryset = initkwargs.get('queryset', cls.queryset)
+        model = initkwargs.get('model', cls.model) or getattr(queryset, 'model', None)
+        if model is not None:
+            # The saves of the properties invalidate the cached tiles
+            tiles.register_properties(model, initkwargs.get('properties', cls.properties))
+        return view
+
+    def get_layer_name(self):
+        return self.layer_name or self.get_queryset().model._meta.model_name
+
+    def get_variant(self):
+        """
+        Get a string identifying the content of the tiles of this view, to cache them.
+        """
+        content = json.dumps([self.get_layer_name(), self.extent, self.buffer, list(self.properties), self.get_tags()])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get_tile(self, z, x, y):
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.in_bbox(*tiles.get_tile_bbox(z, x, y, self.buffer / self.extent))
+        layer = tiles.Layer(self.get_layer_name(), self.extent)
+        fields = ('pk', 'terralego_id', 'terralego_geometry', 'terralego_tags') + tuple(self.properties)
+        for row in queryset.values_list(*fields).iterator():
+            pk, terralego_id, geometry, tag_list = row[:4]
+            geometry = load_geometry(geometry)
+            if geometry is None:
+                continue
+            properties = dict(zip(self.properties, row[4:]))
+            properties.update({'terralego_id': terralego_id and str(terralego_id), 'tags': tag_list})
+            for geometry_type, commands in tiles.get_tile_geometries(geometry, z, x, y, self.extent, self.buffer):
+                layer.add_feature(geometry_type, commands, properties, pk if isinstance(pk, int) else None)
+        return tiles.encode_tile([layer])
+
+    def get(self, request, z, x, y, *args, **kwargs):
+        z, x, y = int(z), int(x), int(y)
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise Http404('Invalid tile')
+        if not tiles.is_enabled():
+            return HttpResponse(self.get_tile(z, x, y), content_type=self.content_type)
+        key = tiles.get_tile_key(self.get_queryset().model, z, x, y, self.get_variant())
+        cache = tiles.get_cache()
+        content = cache.get(key)
+        if content is None:
+            content = self.get_tile(z, x, y)
+            cache.set(key, content, tiles.get_settings().get('TIMEOUT', 3600))
+        return HttpResponse(content, content_type=self.content_type)
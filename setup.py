@@ -1,4 +1,4 @@
-from setuptools import setup
+from setuptools import find_packages, setup
 
 
 def readme():
@@ -21,13 +21,18 @@ setup(
     author='Autonomens',
     author_email='contact@autonomens.fr',
     license='MIT',
-    packages=['django_terralego'],
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=[
         'terralego>=0.1,<=0.2',
         'Django',
         'django-leaflet>=0.21.0',
         'django-geojson[field]>=2.10.0',
     ],
+    extras_require={
+        'local': ['numpy'],
+        'async': ['aiohttp>=3.3'],
+    },
+    python_requires='>=3.5',
     test_suite='nose.collector',
     tests_require=['nose'],
     zip_safe=False,